@@ -0,0 +1,216 @@
+# benchmarks/fake_mirrors.py
+# 本地模拟镜像源：在后台线程中启动若干个HTTP服务，每个服务有固定的附加延迟和带宽上限，
+# 还可以设置所有镜像源共享的总带宽以模拟客户端的本地链路；提供 PEP 691 JSON 或 PEP 503 HTML 索引页和支持Range请求的测试文件，用于离线、可重复地测试tpip的测速引擎
+#
+# 用法:
+#   with FakeMirrors([MirrorSpec("fast", 0.01, 8), MirrorSpec("slow", 0.05, 2)]) as mirrors:
+#       config = BenchmarkConfig(mirrors=mirrors.urls, package=PACKAGE, ...)
+
+import gzip
+import html
+import json
+import re
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 测试包名和文件，文件使用纯Python wheel以便在任何解释器上都被选中
+PACKAGE = "tpip-bench"
+WHEEL_FILENAME = "tpip_bench-1.0.0-py3-none-any.whl"
+# 索引页中旧版本文件的文件名，用于增大索引页
+OLD_FILENAME = "tpip_bench-0.{}.0-py3-none-any.whl"
+DEFAULT_FILE_SIZE = 32 * 1024 * 1024
+CHUNK_SIZE = 16 * 1024
+# 最新版本在启动前多久（秒）发布，旧版本按天依次更早；未同步最新版本的镜像源因此落后约这么久
+RELEASE_AGE = 2 * 3600
+# 索引页的同步序号（X-PyPI-Last-Serial），未同步最新版本的镜像源的序号更小
+LATEST_SERIAL = 1000
+
+
+@dataclass
+class MirrorSpec:
+    """模拟镜像源的参数：附加延迟（秒）、带宽上限（MB/s）、故障类型和索引页格式"""
+    name: str
+    latency: float = 0.01
+    bandwidth: float = 8.0
+    # None: 正常；"down": 所有请求返回503；"no-index": 索引页返回404；"no-range": 不支持Range请求
+    fault: str = None
+    # 每第N个请求返回503，0表示不出错；按请求顺序而非随机出错，结果可重复
+    fail_every: int = 0
+    # "json": PEP 691 JSON 索引；"html": 只支持 PEP 503 HTML 索引的镜像源
+    index_format: str = "json"
+    # 索引页中列在最新版本之前的旧版本文件数量，用于模拟大型索引页
+    old_versions: int = 0
+    # 尚未同步最新版本的镜像源：索引页中只有旧版本（需要 old_versions 大于0）
+    missing_latest: bool = False
+    # 客户端接受gzip时压缩索引页（Content-Encoding: gzip），与开启了gzip的nginx相同
+    gzip: bool = False
+
+
+def _upload_time(age):
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000000Z", time.gmtime(time.time() - age))
+
+
+def index_files(base, file_size, old_versions=0, missing_latest=False):
+    """索引页中的文件列表，旧版本在前、最新版本在后，与PyPI的顺序相同；每个文件带有 PEP 700 的上传时间"""
+    names = [OLD_FILENAME.format(i) for i in range(old_versions)] + ([] if missing_latest else [WHEEL_FILENAME])
+    return [{"filename": name, "url": f"{base}/packages/{name}", "hashes": {}, "size": file_size,
+             "upload-time": _upload_time(RELEASE_AGE + (len(names) - i - 1) * 86400)}
+            for i, name in enumerate(names)]
+
+
+def render_index(files, index_format):
+    """生成索引页，返回 (Content-Type, 内容)"""
+    if index_format == "html":
+        links = "\n".join(f'<a href="{html.escape(f["url"])}">{html.escape(f["filename"])}</a><br/>' for f in files)
+        body = f"<!DOCTYPE html>\n<html><head><title>Links for {PACKAGE}</title></head>\n<body>\n" \
+               f"<h1>Links for {PACKAGE}</h1>\n{links}\n</body></html>\n"
+        return "text/html; charset=utf-8", body.encode()
+    body = json.dumps({"meta": {"api-version": "1.1"}, "name": PACKAGE, "files": files})
+    return "application/vnd.pypi.simple.v1+json", body.encode()
+
+
+class SharedLink:
+    """所有镜像源共享的带宽上限（MB/s），模拟客户端本地链路：每个数据块按顺序占用链路的一个发送时段"""
+
+    def __init__(self, bandwidth):
+        self.interval = CHUNK_SIZE / (bandwidth * 1024 * 1024)
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """返回下一个数据块可以发送的时间（time.monotonic()）"""
+        with self._lock:
+            self._next = max(self._next, time.monotonic()) + self.interval
+            return self._next
+
+
+def _make_handler(spec, file_size, stats, link=None):
+    payload = bytes(range(256)) * (CHUNK_SIZE // 256)
+    lock = threading.Lock()
+
+    def should_fail():
+        with lock:
+            stats["requests"] += 1
+            if spec.fault == "down" or (spec.fail_every and stats["requests"] % spec.fail_every == 0):
+                stats["errors"] += 1
+                return True
+        return False
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _delay(self):
+            time.sleep(spec.latency)
+
+        def _send_empty(self, status):
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def do_HEAD(self):
+            self._delay()
+            self._send_empty(503 if should_fail() else 200)
+
+        def do_GET(self):
+            self._delay()
+            if should_fail():
+                return self._send_empty(503)
+            if self.path.rstrip("/") == f"/simple/{PACKAGE}":
+                return self._index()
+            if self.path.startswith("/packages/") and self.path.endswith(".whl"):
+                return self._file()
+            self._send_empty(404)
+
+        def _index(self):
+            if spec.fault == "no-index":
+                return self._send_empty(404)
+            files = index_files(f"http://{self.headers['Host']}", file_size, spec.old_versions, spec.missing_latest)
+            content_type, body = render_index(files, spec.index_format)
+            compress = spec.gzip and "gzip" in self.headers.get("Accept-Encoding", "")
+            if compress:
+                body = gzip.compress(body)
+            stats["index_bytes"] += len(body)
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            if compress:
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("X-PyPI-Last-Serial", str(LATEST_SERIAL - (10 if spec.missing_latest else 0)))
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _file(self):
+            first, last = 0, file_size - 1
+            match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+            if match and spec.fault != "no-range":
+                first = int(match.group(1))
+                last = min(int(match.group(2) or last), last)
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {first}-{last}/{file_size}")
+            else:
+                self.send_response(200)
+            if spec.fault != "no-range":
+                self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Length", str(last - first + 1))
+            self.end_headers()
+            # 按带宽上限发送数据
+            remaining = last - first + 1
+            interval = CHUNK_SIZE / (spec.bandwidth * 1024 * 1024)
+            next_send = time.monotonic()
+            try:
+                while remaining > 0:
+                    chunk = payload[:min(CHUNK_SIZE, remaining)]
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+                    stats["file_bytes"] += len(chunk)
+                    next_send += interval
+                    send_at = max(next_send, link.reserve()) if link else next_send
+                    time.sleep(max(0.0, send_at - time.monotonic()))
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+
+    return Handler
+
+
+class FakeMirrors:
+    """
+    在后台线程中运行的一组模拟镜像源，urls 为 {名称: 索引地址}，
+    stats 记录每个镜像源收到的请求数、返回的错误数和发送的字节数；
+    link 为所有镜像源共享的总带宽（MB/s），None 表示不限制
+    """
+
+    def __init__(self, specs, file_size=DEFAULT_FILE_SIZE, host="127.0.0.1", link=None):
+        self.specs = list(specs)
+        self.file_size = file_size
+        self.host = host
+        self.link = SharedLink(link) if link else None
+        self.urls = {}
+        self.stats = {}
+        self._servers = []
+
+    def start(self):
+        for spec in self.specs:
+            stats = self.stats[spec.name] = {"requests": 0, "errors": 0, "index_bytes": 0, "file_bytes": 0}
+            server = ThreadingHTTPServer((self.host, 0), _make_handler(spec, self.file_size, stats, self.link))
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self._servers.append(server)
+            self.urls[spec.name] = f"http://{self.host}:{server.server_address[1]}/simple"
+        return self
+
+    def stop(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
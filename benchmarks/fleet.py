@@ -0,0 +1,104 @@
+# benchmarks/fleet.py
+# 多主机共享测速结果的检查：在本地模拟镜像源上同时启动若干个“主机”（各自使用独立缓存目录的子进程），
+# 通过共享文件或 tpip fleet 服务共享测速结果，检查只有一台主机测速、其余主机复用它的排名，
+# 并报告各主机的耗时和镜像源收到的总流量
+#
+# 用法:
+#   python benchmarks/fleet.py                 # 4 台主机通过共享文件共享结果
+#   python benchmarks/fleet.py --http --hosts 8
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_mirrors import PACKAGE, FakeMirrors, MirrorSpec  # noqa: E402
+from tpip.benchmark import BenchmarkConfig, MirrorBenchmark  # noqa: E402
+
+SPECS = [
+    MirrorSpec("fast", latency=0.005, bandwidth=12),
+    MirrorSpec("medium", latency=0.02, bandwidth=6),
+    MirrorSpec("slow", latency=0.04, bandwidth=2),
+    MirrorSpec("down", fault="down"),
+]
+
+
+def run_host(urls, fleet, test_time):
+    """一台主机：使用共享存储测速或复用结果，输出一行JSON"""
+    start = time.monotonic()
+    config = BenchmarkConfig(mirrors=urls, package=PACKAGE, test_time=test_time, latency_samples=3,
+                             fleet=fleet, fleet_segment="bench")
+    result = MirrorBenchmark(config).run()
+    print(json.dumps({"pid": os.getpid(), "best": result.best, "shared_by": result.shared_by,
+                      "from_cache": result.from_cache, "bytes": result.bytes_total,
+                      "duration_s": round(time.monotonic() - start, 3)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在本地模拟镜像源上检查多主机共享测速结果")
+    parser.add_argument("--hosts", type=int, default=4, help="同时启动的主机数量，默认4")
+    parser.add_argument("--http", action="store_true", help="通过 tpip fleet 服务共享，默认通过共享文件")
+    parser.add_argument("--test-time", type=float, default=2, help="下载测试时间（秒），默认2")
+    parser.add_argument("--host-worker", nargs=2, metavar=("URLS", "FLEET"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.host_worker:
+        run_host(json.loads(args.host_worker[0]), args.host_worker[1], args.test_time)
+        return
+
+    workdir = Path(tempfile.mkdtemp(prefix="tpip-fleet-"))
+    server = None
+    if args.http:
+        from tpip.fleet import make_server
+
+        server = make_server(workdir / "server.json", port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        fleet = f"http://127.0.0.1:{server.server_address[1]}"
+    else:
+        fleet = str(workdir / "shared" / "fleet.json")
+
+    with FakeMirrors(SPECS) as mirrors:
+        processes = []
+        for i in range(args.hosts):
+            env = dict(os.environ, TPIP_CACHE_DIR=str(workdir / f"host{i}"))
+            processes.append(subprocess.Popen(
+                [sys.executable, __file__, "--test-time", str(args.test_time),
+                 "--host-worker", json.dumps(mirrors.urls), fleet],
+                env=env, stdout=subprocess.PIPE, text=True))
+        hosts = [json.loads(p.communicate()[0].strip().splitlines()[-1]) for p in processes]
+        file_bytes = sum(s["file_bytes"] for s in mirrors.stats.values())
+    if server:
+        server.shutdown()
+        server.server_close()
+
+    measured = [h for h in hosts if not h["from_cache"]]
+    print(f"{'主机':<8}{'结果来源':<12}{'最佳':<10}{'耗时(s)':>10}{'流量(MB)':>12}")
+    for i, host in enumerate(hosts):
+        source = "本机测速" if not host["from_cache"] else f"共享({host['shared_by']})"
+        print(f"host{i:<4}{source:<12}{str(host['best']):<10}{host['duration_s']:>10}"
+              f"{host['bytes'] / 1024 / 1024:>12.2f}")
+    print(f"\n共享方式: {'tpip fleet 服务' if args.http else '共享文件'}，"
+          f"镜像源发送的测试文件总流量 {file_bytes / 1024 / 1024:.2f} MB")
+
+    problems = []
+    if len(measured) != 1:
+        problems.append(f"{len(measured)} 台主机进行了测速，应为1台")
+    if len({h["best"] for h in hosts}) != 1:
+        problems.append(f"各主机选出的最佳镜像源不一致: {sorted({str(h['best']) for h in hosts})}")
+    for problem in problems:
+        print(f"问题: {problem}")
+    if problems:
+        sys.exit(1)
+    print("所有检查通过")
+
+
+if __name__ == "__main__":
+    main()
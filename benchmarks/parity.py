@@ -0,0 +1,110 @@
+# benchmarks/parity.py
+# 异步引擎与线程池引擎的一致性检查：对同一组本地模拟镜像源分别运行两个引擎，
+# 比较结果的结构、参与下载测试的镜像源、排名和速度
+#
+# 用法:
+#   python benchmarks/parity.py                # 打印两个引擎的结果，不一致时以非零状态退出
+#   python benchmarks/parity.py --tolerance 0.3
+
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_mirrors import PACKAGE, FakeMirrors, MirrorSpec  # noqa: E402
+from tpip.benchmark import BenchmarkConfig, MirrorBenchmark  # noqa: E402
+
+# 延迟和带宽差别明显，两个引擎的排名应完全一致
+SPECS = [
+    MirrorSpec("fast", latency=0.005, bandwidth=12),
+    MirrorSpec("medium", latency=0.02, bandwidth=6),
+    MirrorSpec("slow", latency=0.04, bandwidth=2),
+    MirrorSpec("no-range", latency=0.03, bandwidth=4, fault="no-range"),
+    MirrorSpec("down", fault="down"),
+]
+
+
+def shape(value):
+    """结果的结构：字典的键和值的类型，用于比较两个引擎的输出格式"""
+    if isinstance(value, dict):
+        return {key: shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [shape(value[0])] if value else []
+    return type(value).__name__ if value is not None else None
+
+
+def run_engines(urls, args):
+    config = dict(mirrors=urls, package=PACKAGE, top_count=args.top_count, test_time=args.test_time,
+                  connections=args.connections, reuse_requests=args.reuse_requests, latency_samples=3,
+                  use_cache=False, save_results=False)
+    results = {}
+    for engine in ("async", "threads"):
+        benchmark = MirrorBenchmark(BenchmarkConfig(**config))
+        results[engine] = benchmark.run_sync() if engine == "threads" else benchmark.run()
+    return results
+
+
+def compare(results, tolerance):
+    """返回两个引擎结果的差异列表"""
+    problems = []
+    a, t = results["async"], results["threads"]
+    reports = {engine: r.to_dict() for engine, r in results.items()}
+    mirror_shapes = {}
+    for engine, report in reports.items():
+        for mirror in report["mirrors"]:
+            for key, value in shape(mirror).items():
+                if value is not None:
+                    mirror_shapes.setdefault(engine, {}).setdefault(key, value)
+    if set(reports["async"]) != set(reports["threads"]):
+        problems.append(f"报告字段不同: {sorted(reports['async'])} / {sorted(reports['threads'])}")
+    for key in set(mirror_shapes["async"]) | set(mirror_shapes["threads"]):
+        if mirror_shapes["async"].get(key) != mirror_shapes["threads"].get(key):
+            problems.append(f"字段 {key} 的结构不同: {mirror_shapes['async'].get(key)} / "
+                            f"{mirror_shapes['threads'].get(key)}")
+    if a.best != t.best:
+        problems.append(f"最佳镜像源不同: {a.best} / {t.best}")
+    ranks_a = [m.name for m in a.mirrors if m.rank]
+    ranks_t = [m.name for m in t.mirrors if m.rank]
+    if ranks_a != ranks_t:
+        problems.append(f"排名不同: {ranks_a} / {ranks_t}")
+    failed_a = sorted(m.name for m in a.mirrors if m.latency_ms is None)
+    failed_t = sorted(m.name for m in t.mirrors if m.latency_ms is None)
+    if failed_a != failed_t:
+        problems.append(f"延迟测试失败的镜像源不同: {failed_a} / {failed_t}")
+    for mirror in a.mirrors:
+        other = t.get(mirror.name)
+        if (mirror.speed is None) != (other.speed is None):
+            problems.append(f"{mirror.name} 的下载测试结果不同: {mirror.speed} / {other.speed}")
+        elif mirror.speed and abs(mirror.speed - other.speed) / mirror.speed > tolerance:
+            problems.append(f"{mirror.name} 的下载速度相差超过 {tolerance:.0%}: {mirror.speed} / {other.speed}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较异步引擎与线程池引擎的测速结果")
+    parser.add_argument("--test-time", type=float, default=3, help="下载测试时间（秒），默认3")
+    parser.add_argument("--top-count", type=int, default=4, help="测试下载速度的镜像源数量，默认4")
+    parser.add_argument("--connections", type=int, default=1, help="下载测试的并发连接数，默认1")
+    parser.add_argument("--reuse-requests", type=int, default=0, help="连接复用测试的请求次数，默认0（不测试）")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="允许的下载速度相对误差，默认0.25")
+    args = parser.parse_args()
+
+    with FakeMirrors(SPECS) as mirrors:
+        results = run_engines(mirrors.urls, args)
+
+    for engine, result in results.items():
+        print(f"{engine:8} 最佳: {result.best}  耗时 {result.duration_s:.2f} 秒")
+        for mirror in result.mirrors:
+            print(f"  {mirror.rank or '-'} {mirror.name:10} 延迟 {mirror.latency_ms} ms  速度 {mirror.speed} MB/s  "
+                  f"{'; '.join(mirror.errors)}")
+    problems = compare(results, args.tolerance)
+    for problem in problems:
+        print(f"不一致: {problem}")
+    print("两个引擎的结果一致" if not problems else f"发现 {len(problems)} 处不一致")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# benchmarks/startup.py
+# tpip 启动耗时基准测试
+#
+# 用法:
+#   python benchmarks/startup.py               # 打印导入耗时和 --help / unset --help 的启动耗时
+#   python benchmarks/startup.py --max-ms 150  # 超过阈值时以非零状态退出，便于在CI中跟踪
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# 启动路径上不应出现的重量级模块
+HEAVY_MODULES = ["aiohttp", "requests", "prettytable", "pip"]
+
+COMMANDS = {
+    "tpip --help": ["--help"],
+    "tpip unset --help": ["unset", "--help"],
+}
+
+
+def run_cli(cli_args):
+    """在新进程中运行tpip命令行，返回耗时（毫秒）"""
+    code = "import sys; from tpip.tpip import main; sys.argv[0] = 'tpip'; main()"
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code] + cli_args, cwd=ROOT,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return (time.perf_counter() - start) * 1000
+
+
+def run_interpreter():
+    """运行空解释器，返回耗时（毫秒），作为对比基线"""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"])
+    return (time.perf_counter() - start) * 1000
+
+
+def import_profile():
+    """使用 -X importtime 获取导入 tpip.tpip 时加载的模块及累计耗时（微秒）"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import tpip.tpip"],
+                            cwd=ROOT, capture_output=True, text=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        # 格式: "import time:   self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="tpip 启动耗时基准测试")
+    parser.add_argument("--repeat", type=int, default=10, help="每个命令的运行次数")
+    parser.add_argument("--max-ms", type=float, help="启动耗时中位数的上限（毫秒），超过时返回非零状态")
+    args = parser.parse_args()
+
+    modules = import_profile()
+    print(f"import tpip.tpip 累计耗时: {modules.get('tpip.tpip', 0) / 1000:.2f} ms")
+    loaded_heavy = [m for m in HEAVY_MODULES if m in modules]
+    if loaded_heavy:
+        print(f"警告: 启动时导入了重量级模块: {', '.join(loaded_heavy)}")
+
+    baseline = statistics.median(run_interpreter() for _ in range(args.repeat))
+    print(f"空解释器启动耗时: {baseline:.2f} ms")
+
+    failed = bool(loaded_heavy)
+    for label, cli_args in COMMANDS.items():
+        median = statistics.median(run_cli(cli_args) for _ in range(args.repeat))
+        print(f"{label}: {median:.2f} ms (中位数, {args.repeat} 次)")
+        if args.max_ms is not None and median > args.max_ms:
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
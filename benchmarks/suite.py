@@ -0,0 +1,359 @@
+# benchmarks/suite.py
+# 离线测速基准：在本地模拟镜像源上运行若干场景，检查tpip是否选中了预期的镜像源、排名是否正确，
+# 并记录测速耗时、下载测试以外的开销和传输的字节数；另外对HTML/JSON索引页的解析做微基准测试
+#
+# 用法:
+#   python benchmarks/suite.py                                  # 运行所有场景，两个引擎各一次
+#   python benchmarks/suite.py --scenario faults --engine async
+#   python benchmarks/suite.py --json suite.json                # 保存结果
+#   python benchmarks/suite.py --baseline suite.json            # 与保存的结果比较，耗时退化时以非零状态退出
+#
+# 选错镜像源、排名错误或选中了错误的测试文件时同样以非零状态退出，便于在CI中跟踪；
+# 另外经 tpip serve 的索引代理获取模拟镜像源上的索引页和包文件，检查代理的行为
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from itertools import combinations
+from pathlib import Path
+from typing import Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_mirrors import (OLD_FILENAME, PACKAGE, WHEEL_FILENAME, FakeMirrors, MirrorSpec, index_files,  # noqa: E402
+                          render_index)
+from tpip.benchmark import BenchmarkConfig, MirrorBenchmark, compute_score  # noqa: E402
+from tpip.index import INDEX_READ_SIZE, AnchorParser, parse_json_index  # noqa: E402
+
+ENGINES = ("async", "threads")
+# 耗时超过基线的该比例且绝对差值超过 MIN_REGRESSION_S 时视为退化
+DEFAULT_THRESHOLD = 0.25
+MIN_REGRESSION_S = 0.2
+# 索引页解析微基准的文件数量
+PARSE_SIZES = (100, 2000, 20000)
+
+
+@dataclass
+class Scenario:
+    """测试场景：一组模拟镜像源、预期的最佳镜像源，以及覆盖默认值的测速配置"""
+    name: str
+    description: str
+    specs: List[MirrorSpec]
+    expected_best: str
+    config: Dict[str, object] = field(default_factory=dict)
+    file_size: int = 16 * 1024 * 1024
+    # 客户端本地链路的带宽（MB/s），None 表示不限制
+    link: Optional[float] = None
+
+
+SCENARIOS = [
+    Scenario("baseline", "4个JSON索引镜像源，延迟和带宽各不相同", [
+        MirrorSpec("a", latency=0.005, bandwidth=4),
+        MirrorSpec("b", latency=0.01, bandwidth=12),
+        MirrorSpec("c", latency=0.02, bandwidth=6),
+        MirrorSpec("d", latency=0.03, bandwidth=2),
+    ], expected_best="b", config={"top_count": 4}),
+    Scenario("latency-trap", "延迟最低的镜像源带宽最小，应按下载速度而不是延迟选择", [
+        MirrorSpec("near", latency=0.002, bandwidth=2),
+        MirrorSpec("mid", latency=0.03, bandwidth=5),
+        MirrorSpec("far", latency=0.06, bandwidth=12),
+    ], expected_best="far", config={"top_count": 3}),
+    Scenario("html-index", "只支持HTML索引的镜像源，索引页列出3000个旧版本，其中两个镜像源用gzip压缩索引页", [
+        MirrorSpec("html-fast", latency=0.01, bandwidth=10, index_format="html", old_versions=3000, gzip=True),
+        MirrorSpec("html-slow", latency=0.005, bandwidth=3, index_format="html", old_versions=3000),
+        MirrorSpec("json", latency=0.015, bandwidth=6, old_versions=3000, gzip=True),
+    ], expected_best="html-fast", config={"top_count": 3}),
+    Scenario("faults", "宕机、缺少索引页、不支持Range和间歇出错的镜像源", [
+        MirrorSpec("healthy", latency=0.01, bandwidth=8),
+        MirrorSpec("no-range", latency=0.02, bandwidth=5, fault="no-range"),
+        MirrorSpec("flaky", latency=0.005, bandwidth=3, fail_every=4),
+        MirrorSpec("no-index", latency=0.005, bandwidth=12, fault="no-index"),
+        MirrorSpec("down", fault="down"),
+    ], expected_best="healthy", config={"top_count": 4, "connections": 2}),
+    Scenario("stale-mirror", "带宽最高的镜像源未同步最新版本（落后约2小时），检测同步延迟后应排在后面", [
+        MirrorSpec("stale", latency=0.005, bandwidth=10, old_versions=5, missing_latest=True),
+        MirrorSpec("fresh", latency=0.01, bandwidth=8, old_versions=5),
+        MirrorSpec("slow", latency=0.02, bandwidth=3, old_versions=5),
+    ], expected_best="fresh", config={"top_count": 3, "freshness": True, "freshness_packages": [PACKAGE]}),
+    Scenario("link-limited", "本地链路只有6 MB/s，两个镜像源都能占满链路，应按字节预算测速并按延迟选择", [
+        MirrorSpec("near", latency=0.005, bandwidth=20),
+        MirrorSpec("far", latency=0.03, bandwidth=20),
+        MirrorSpec("slow", latency=0.01, bandwidth=2),
+    ], expected_best="near", config={"top_count": 3, "probe_bytes": 2 * 1024 * 1024}, link=6),
+    Scenario("many-small-files", "带宽最高的镜像源每个请求的往返时间也最长，按连接复用测试的固定开销折算后应选择延迟低的", [
+        MirrorSpec("near", latency=0.005, bandwidth=6),
+        MirrorSpec("far", latency=0.06, bandwidth=12),
+        MirrorSpec("slow", latency=0.01, bandwidth=2),
+    ], expected_best="near", config={"top_count": 3, "reuse_requests": 8}),
+    Scenario("many-mirrors", "48个镜像源，其中4个延迟很高，应被提前淘汰", [
+        MirrorSpec(f"m{i:02d}", latency=0.005 + i * 0.002, bandwidth=16 - i * 0.3) for i in range(44)
+    ] + [MirrorSpec(f"far{i}", latency=0.6, bandwidth=20) for i in range(4)],
+        expected_best="m00", config={"top_count": 3}, file_size=8 * 1024 * 1024),
+]
+
+
+def concordance(ranked, bandwidth):
+    """实际排名与按带宽（检测同步延迟时乘以得分系数，测试连接复用时扣除请求开销）排序的预期排名中顺序一致的镜像源对的比例"""
+    pairs = list(combinations(ranked, 2))
+    if not pairs:
+        return 1.0
+    return sum(bandwidth[first] >= bandwidth[second] for first, second in pairs) / len(pairs)
+
+
+def run_scenario(scenario, engine, args):
+    """在一组新启动的模拟镜像源上运行一次测速，返回指标字典"""
+    config = dict(package=PACKAGE, test_time=args.test_time, latency_samples=3, use_cache=False,
+                  save_results=False, probe_bytes=args.probe_bytes)
+    config.update(scenario.config)
+    # 客户端链路是所有镜像源共同的瓶颈
+    bandwidth = {spec.name: min(spec.bandwidth, scenario.link or spec.bandwidth) for spec in scenario.specs}
+    with FakeMirrors(scenario.specs, file_size=scenario.file_size, link=scenario.link) as mirrors:
+        benchmark = MirrorBenchmark(BenchmarkConfig(mirrors=mirrors.urls, **config))
+        start = time.perf_counter()
+        result = benchmark.run_sync() if engine == "threads" else benchmark.run()
+        wall = time.perf_counter() - start
+        served = sum(s["index_bytes"] + s["file_bytes"] for s in mirrors.stats.values())
+
+    tested = [m for m in result.mirrors if m.speed is not None]
+    expected = {m.name: compute_score({"speed": bandwidth[m.name]}, m.freshness, m.reuse) for m in tested}
+    download_s = max(((m.download or {}).get("duration_s") or 0 for m in tested), default=0)
+    # 未同步最新版本的镜像源上应选中最新的旧版本
+    latest = {spec.name: OLD_FILENAME.format(spec.old_versions - 1) if spec.missing_latest else WHEEL_FILENAME
+              for spec in scenario.specs}
+    return {
+        "scenario": scenario.name,
+        "engine": engine,
+        "best": result.best,
+        "best_ok": result.best == scenario.expected_best,
+        "rank_concordance": round(concordance([m.name for m in tested], expected), 3),
+        "artifact_ok": all(m.artifact["filename"] == latest[m.name] for m in result.mirrors if m.artifact),
+        "tested": len(tested),
+        "failed": sum(m.latency_ms is None for m in result.mirrors),
+        "eliminated": sum(any("已淘汰" in e for e in m.errors) for m in result.mirrors),
+        "wall_s": round(wall, 3),
+        # 下载测试以外的耗时：延迟测试、索引页解析和调度
+        "overhead_s": round(max(wall - download_s, 0), 3),
+        "bytes_reported": result.bytes_total,
+        "bytes_served": served,
+    }
+
+
+def _time_ms(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def parse_benchmarks(repeat):
+    """索引页解析微基准：按流式读取的块大小将HTML索引页分块解析，JSON索引整体解析"""
+    base = "http://127.0.0.1/simple"
+    results = []
+    for count in PARSE_SIZES:
+        files = index_files("http://127.0.0.1", 1024, count - 1)
+        for index_format in ("html", "json"):
+            _, body = render_index(files, index_format)
+
+            def parse():
+                if index_format == "json":
+                    return parse_json_index(body, f"{base}/{PACKAGE}/")
+                parser = AnchorParser(f"{base}/{PACKAGE}/")
+                text = body.decode()
+                for offset in range(0, len(text), INDEX_READ_SIZE):
+                    parser.feed(text[offset:offset + INDEX_READ_SIZE])
+                parser.close()
+                return parser.pop_files()
+
+            parsed = parse()
+            ms = _time_ms(parse, repeat)
+            results.append({
+                "format": index_format,
+                "files": count,
+                "bytes": len(body),
+                "ms": round(ms, 3),
+                "mb_per_s": round(len(body) / 1024 / 1024 / (ms / 1000), 1) if ms else None,
+                "ok": len(parsed) == count and parsed[-1]["filename"] == WHEEL_FILENAME,
+            })
+    return results
+
+
+async def _proxy_checks(mirrors, cache_dir):
+    from aiohttp import ClientSession, web
+
+    from tpip.proxy import DiskCache, ProxyServer
+
+    upstreams = [{"name": name, "url": url} for name, url in mirrors.urls.items()]
+    # index_ttl 为0: 每次请求索引页都访问上游
+    server = ProxyServer(upstreams, DiskCache(cache_dir, 64 * 1024 * 1024), index_ttl=0)
+    runner = web.AppRunner(server.make_app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    base = f"http://127.0.0.1:{runner.addresses[0][1]}"
+    checks = []
+    try:
+        async with ClientSession() as session:
+            async with session.get(f"{base}/simple/{PACKAGE}/") as response:
+                body = await response.text()
+            href = re.search(r'href="([^"#]*' + re.escape(WHEEL_FILENAME) + ')', body)
+            checks.append({"check": "gzip压缩的索引页", "ok": response.status == 200 and href is not None,
+                           "detail": f"HTTP {response.status}"})
+            if href:
+                async with session.get(f"{base}{href.group(1)}") as response:
+                    size = len(await response.read())
+                checks.append({"check": "包文件", "ok": response.status == 200 and size == mirrors.file_size,
+                               "detail": f"HTTP {response.status}, {size} 字节"})
+            # 唯一的上游处于半开状态且探测请求未结束时没有可以发送请求的镜像源：
+            # 已缓存的索引页返回过期内容，没有缓存的返回502
+            name = upstreams[0]["name"]
+            server.breaker.open_until[name] = 0
+            server.breaker.probing.add(name)
+            async with session.get(f"{base}/simple/{PACKAGE}/") as response:
+                checks.append({"check": "上游不可用时的过期索引页", "ok": response.status == 200,
+                               "detail": f"HTTP {response.status}"})
+            async with session.get(f"{base}/simple/not-cached/") as response:
+                checks.append({"check": "上游不可用时的新索引页", "ok": response.status == 502,
+                               "detail": f"HTTP {response.status}"})
+    finally:
+        await runner.cleanup()
+    return checks
+
+
+def proxy_checks():
+    """
+    经本地索引代理获取用gzip压缩索引页的模拟镜像源上的索引页和包文件，
+    并检查没有可用上游时的索引页响应，返回检查结果列表
+    """
+    specs = [MirrorSpec("gzip", latency=0.005, bandwidth=50, gzip=True)]
+    with FakeMirrors(specs, file_size=256 * 1024) as mirrors:
+        return asyncio.run(_proxy_checks(mirrors, tempfile.mkdtemp(prefix="tpip-suite-proxy-")))
+
+
+def find_regressions(report, baseline, threshold):
+    """与基线结果比较，返回耗时退化的描述列表"""
+    problems = []
+    old_runs = {(r["scenario"], r["engine"]): r for r in baseline.get("runs", [])}
+    for run in report["runs"]:
+        old = old_runs.get((run["scenario"], run["engine"]))
+        if not old:
+            continue
+        for key in ("wall_s", "overhead_s"):
+            if run[key] > old[key] * (1 + threshold) and run[key] - old[key] > MIN_REGRESSION_S:
+                problems.append(f"{run['scenario']}/{run['engine']} 的 {key} 从 {old[key]} 增加到 {run[key]}")
+    old_parse = {(r["format"], r["files"]): r for r in baseline.get("parse", [])}
+    for item in report["parse"]:
+        old = old_parse.get((item["format"], item["files"]))
+        if old and item["ms"] > old["ms"] * (1 + threshold) and item["ms"] - old["ms"] > 1:
+            problems.append(f"解析 {item['format']} ({item['files']} 个文件) 从 {old['ms']} ms 增加到 {item['ms']} ms")
+    return problems
+
+
+def find_failures(report):
+    """选择错误的场景和解析结果"""
+    problems = []
+    for run in report["runs"]:
+        if not run["best_ok"]:
+            problems.append(f"{run['scenario']}/{run['engine']} 选中了 {run['best']}")
+        if run["rank_concordance"] < 1:
+            problems.append(f"{run['scenario']}/{run['engine']} 的排名与带宽顺序不一致 ({run['rank_concordance']})")
+        if not run["artifact_ok"]:
+            problems.append(f"{run['scenario']}/{run['engine']} 选中了错误的测试文件")
+    problems.extend(f"解析 {item['format']} ({item['files']} 个文件) 的结果不正确"
+                    for item in report["parse"] if not item["ok"])
+    problems.extend(f"代理检查 {item['check']} 失败: {item['detail']}" for item in report["proxy"] if not item["ok"])
+    return problems
+
+
+def print_report(report):
+    from prettytable import PrettyTable
+
+    table = PrettyTable()
+    table.field_names = ["场景", "引擎", "最佳", "正确", "排名一致", "下载测试", "失败", "淘汰",
+                         "耗时(s)", "开销(s)", "传输(MB)"]
+    for run in report["runs"]:
+        table.add_row([run["scenario"], run["engine"], run["best"], "是" if run["best_ok"] else "否",
+                       run["rank_concordance"], run["tested"], run["failed"], run["eliminated"],
+                       run["wall_s"], run["overhead_s"], round(run["bytes_served"] / 1024 / 1024, 1)])
+    print(table)
+    if report["parse"]:
+        table = PrettyTable()
+        table.field_names = ["索引格式", "文件数", "大小(KB)", "解析(ms)", "MB/s", "正确"]
+        for item in report["parse"]:
+            table.add_row([item["format"], item["files"], round(item["bytes"] / 1024, 1), item["ms"],
+                           item["mb_per_s"], "是" if item["ok"] else "否"])
+        print(table)
+    if report["proxy"]:
+        table = PrettyTable()
+        table.field_names = ["代理检查", "结果", "详情"]
+        table.align["详情"] = "l"
+        for item in report["proxy"]:
+            table.add_row([item["check"], "通过" if item["ok"] else "失败", item["detail"]])
+        print(table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在本地模拟镜像源上离线运行tpip测速基准")
+    parser.add_argument("--scenario", action="append", choices=[s.name for s in SCENARIOS],
+                        help="只运行指定的场景，可多次指定，默认运行所有场景")
+    parser.add_argument("--engine", choices=ENGINES + ("both",), default="both", help="测速引擎，默认两个都运行")
+    parser.add_argument("--test-time", type=float, default=2, help="下载测试时间（秒），默认2")
+    parser.add_argument("--probe-bytes", type=int, metavar="BYTES",
+                        help="所有场景都按字节预算测速，每个镜像源只下载BYTES字节")
+    parser.add_argument("--parse-repeat", type=int, default=5, help="索引页解析微基准的重复次数，0表示跳过，默认5")
+    parser.add_argument("--skip-proxy", action="store_true", help="跳过索引代理的检查")
+    parser.add_argument("--json", type=str, metavar="FILE", help="将结果保存为JSON文件")
+    parser.add_argument("--baseline", type=str, metavar="FILE", help="与之前保存的结果比较")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"耗时超过基线的比例阈值，默认{DEFAULT_THRESHOLD}")
+    args = parser.parse_args()
+
+    engines = ENGINES if args.engine == "both" else (args.engine,)
+    try:
+        import aiohttp  # noqa: F401
+        has_aiohttp = True
+    except ImportError:
+        has_aiohttp = False
+        if "async" in engines:
+            print("未安装aiohttp，跳过异步引擎")
+        engines = tuple(e for e in engines if e != "async")
+
+    # 使用临时缓存目录，不读取本机保存的链路容量，也不写入测速结果
+    os.environ["TPIP_CACHE_DIR"] = tempfile.mkdtemp(prefix="tpip-suite-")
+    scenarios = [s for s in SCENARIOS if not args.scenario or s.name in args.scenario]
+    report = {"timestamp": time.time(), "python": sys.version.split()[0], "runs": [], "parse": [], "proxy": []}
+    for scenario in scenarios:
+        for engine in engines:
+            print(f"运行场景 {scenario.name} ({engine}): {scenario.description}")
+            report["runs"].append(run_scenario(scenario, engine, args))
+    if args.parse_repeat > 0:
+        report["parse"] = parse_benchmarks(args.parse_repeat)
+    # 索引代理依赖aiohttp
+    if not args.skip_proxy and has_aiohttp:
+        report["proxy"] = proxy_checks()
+
+    print_report(report)
+    problems = find_failures(report)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            problems += find_regressions(report, json.load(f), args.threshold)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    for problem in problems:
+        print(f"问题: {problem}")
+    print("所有检查通过" if not problems else f"发现 {len(problems)} 个问题")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
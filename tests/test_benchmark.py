@@ -0,0 +1,37 @@
+# tests/test_benchmark.py
+# 下载测试的放行顺序
+
+from tpip.benchmark import BenchmarkConfig, MirrorBenchmark
+
+
+def run_admissions(finish_order, top_count=2, early_admit=True):
+    """按 finish_order [(名称, 延迟中位数)] 的顺序完成延迟测试，返回每次放行的镜像源"""
+    benchmark = MirrorBenchmark(BenchmarkConfig(top_count=top_count, early_admit=early_admit))
+    latencies, admitted, steps = {}, [], []
+    for name, latency in finish_order:
+        latencies[name] = latency
+        steps.append(benchmark._admit(latencies, admitted, done=False))
+        admitted += steps[-1]
+    steps.append(benchmark._admit(latencies, admitted, done=True))
+    return steps
+
+
+def test_lowest_latency_mirrors_are_always_tested():
+    # 最快的两个镜像源因为排队最后才完成延迟测试
+    steps = run_admissions([("c", 50.0), ("d", 60.0), ("e", 70.0), ("b", 10.0), ("a", 5.0)])
+    assert steps == [[], ["c", "d"], [], [], [], ["a", "b"]]
+
+
+def test_without_early_admission_only_top_count_are_tested():
+    steps = run_admissions([("c", 50.0), ("d", 60.0), ("e", 70.0), ("b", 10.0), ("a", 5.0)], early_admit=False)
+    assert steps == [[], [], [], [], [], ["a", "b"]]
+
+
+def test_no_extra_tests_when_fast_mirrors_finish_first():
+    steps = run_admissions([("b", 10.0), ("a", 5.0), ("c", 50.0)])
+    assert steps == [[], ["a", "b"], [], []]
+
+
+def test_fewer_mirrors_than_top_count():
+    assert run_admissions([("a", 5.0)], top_count=3) == [[], ["a"]]
+    assert run_admissions([("a", 5.0)], top_count=0) == [[], []]
@@ -0,0 +1,51 @@
+# tests/test_failover.py
+# 熔断器的半开探测与对冲请求
+
+import asyncio
+
+from tpip.failover import CircuitBreaker, HedgedFetcher
+
+
+class FakeResponse:
+    status = 200
+
+    def release(self):
+        pass
+
+
+class FakeSession:
+    """slow 中的地址永远不返回，其余地址立即返回200"""
+
+    def __init__(self, slow):
+        self.slow = slow
+
+    async def get(self, url, **kwargs):
+        if url in self.slow:
+            await asyncio.sleep(3600)
+        return FakeResponse()
+
+
+def half_open_breaker(name):
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=0)
+    breaker.record_failure(name)
+    assert breaker.state(name) == "half-open"
+    return breaker
+
+
+def test_cancelled_probe_is_released():
+    breaker = half_open_breaker("a")
+    mirrors = [{"name": "a", "url": "a"}, {"name": "b", "url": "b"}]
+    fetcher = HedgedFetcher(FakeSession({"a"}), mirrors, hedge_delay=0.01, breaker=breaker)
+    mirror, _ = asyncio.run(fetcher.get(lambda m: m["url"]))
+    assert mirror["name"] == "b"
+    # 被取消的探测请求没有结果，之后仍应放行新的探测请求
+    assert "a" not in breaker.probing
+    assert breaker.allow("a")
+
+
+def test_half_open_allows_single_probe():
+    breaker = half_open_breaker("a")
+    assert breaker.allow("a")
+    assert not breaker.allow("a")
+    breaker.record_success("a")
+    assert breaker.state("a") == "closed"
@@ -0,0 +1,53 @@
+# tests/test_fleet.py
+# 多台主机共享测速结果
+
+import asyncio
+import os
+import stat
+import sys
+import time
+
+import pytest
+
+from tpip.benchmark import BenchmarkConfig, MirrorBenchmark, MirrorResult
+from tpip.fleet import FileStore, fleet_key, make_entry
+
+MIRRORS = {"a": "https://a.example/simple", "b": "https://b.example/simple"}
+
+
+def test_waiting_for_fleet_results_does_not_block_event_loop(tmp_path, monkeypatch):
+    monkeypatch.setenv("TPIP_CACHE_DIR", str(tmp_path / "cache"))
+    path = tmp_path / "fleet.json"
+    config = BenchmarkConfig(mirrors=MIRRORS, download_test=False, fleet=str(path), fleet_segment="seg",
+                             fleet_wait=30, save_results=False)
+    store = FileStore(path)
+    key = fleet_key("seg", config.cache_scope)
+    store.acquire(key, "other:1")
+    mirrors = [MirrorResult(name, url, latency_ms=10.0 + i) for i, (name, url) in enumerate(MIRRORS.items())]
+
+    async def publish():
+        # 事件循环被等待阻塞时，这里要等到等待超时后才能运行
+        await asyncio.sleep(0.2)
+        store.put(key, make_entry(mirrors, False, host="other"), "other:1")
+
+    async def main():
+        return (await asyncio.gather(MirrorBenchmark(config).run_async(), publish()))[0]
+
+    result = asyncio.run(asyncio.wait_for(main(), timeout=10))
+    assert result.shared_by == "other"
+    assert [m.name for m in result.mirrors] == ["a", "b"]
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="POSIX 文件权限")
+def test_file_store_follows_umask_and_keeps_mode(tmp_path):
+    path = tmp_path / "fleet.json"
+    store = FileStore(path)
+    old = os.umask(0o022)
+    try:
+        store.put("k", {"timestamp": time.time()})
+    finally:
+        os.umask(old)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o644
+    os.chmod(path, 0o664)
+    store.acquire("k", "host:1")
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o664
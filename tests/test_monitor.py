@@ -0,0 +1,32 @@
+# tests/test_monitor.py
+# tpip monitor 的自动切换
+
+import asyncio
+
+from tpip.monitor import SwitchPolicy, monitor_loop
+
+MIRRORS = {"a": "https://a.example/simple", "b": "https://b.example/simple"}
+
+
+async def probe(name, url):
+    return (10.0, 5.0, None) if name == "b" else (100.0, 1.0, None)
+
+
+def run_loop(tmp_path, on_switch):
+    return asyncio.run(monitor_loop(MIRRORS, probe, interval=0, count=2, policy=SwitchPolicy(confirmations=1),
+                                    on_switch=on_switch, directory=tmp_path, current="a"))
+
+
+def test_switch_updates_current(tmp_path):
+    switched = []
+    state = run_loop(tmp_path, lambda name: switched.append(name) or True)
+    assert switched == ["b"]
+    assert state["current"] == "b"
+
+
+def test_failed_switch_keeps_current(tmp_path):
+    switched = []
+    state = run_loop(tmp_path, lambda name: switched.append(name) or False)
+    # 切换失败后当前镜像源不变，下一轮仍然尝试切换
+    assert switched == ["b", "b"]
+    assert state["current"] == "a"
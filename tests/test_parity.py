@@ -0,0 +1,47 @@
+# tests/test_parity.py
+# 异步引擎与线程池引擎对同一组本地模拟镜像源的测速结果一致（见 benchmarks/parity.py）
+
+import argparse
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("aiohttp")
+pytest.importorskip("requests")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+
+from fake_mirrors import FakeMirrors, MirrorSpec  # noqa: E402
+from parity import SPECS, compare, run_engines  # noqa: E402
+
+from tpip.benchmark import BenchmarkConfig, MirrorBenchmark  # noqa: E402
+
+
+@pytest.mark.parametrize("connections", [1, 2])
+def test_engines_agree_on_fake_mirrors(tmp_path, monkeypatch, connections):
+    monkeypatch.setenv("TPIP_CACHE_DIR", str(tmp_path / "cache"))
+    args = argparse.Namespace(test_time=2, top_count=4, connections=connections, reuse_requests=2)
+    with FakeMirrors(SPECS) as mirrors:
+        results = run_engines(mirrors.urls, args)
+    assert compare(results, tolerance=0.3) == []
+    for result in results.values():
+        assert result.best == "fast"
+        assert result.get("down").latency_ms is None
+
+
+def test_engines_count_failed_latency_samples(tmp_path, monkeypatch):
+    monkeypatch.setenv("TPIP_CACHE_DIR", str(tmp_path / "cache"))
+    # 每第2个请求返回503：每个引擎的4次延迟测试中都有2次失败
+    with FakeMirrors([MirrorSpec("flaky", fail_every=2)]) as mirrors:
+        for run in ("run", "run_sync"):
+            config = BenchmarkConfig(mirrors=mirrors.urls, download_test=False, latency_samples=4,
+                                     use_cache=False, save_results=False)
+            result = getattr(MirrorBenchmark(config), run)().get("flaky")
+            assert len(result.latency["samples"]) == 2
+            assert result.latency["errors"] == 2
+
+
+def test_latency_samples_must_be_positive():
+    with pytest.raises(ValueError):
+        BenchmarkConfig(latency_samples=0)
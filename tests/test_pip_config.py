@@ -0,0 +1,28 @@
+# tests/test_pip_config.py
+# pip配置文件的位置和写入
+
+import os
+
+import pytest
+
+from tpip import pip_config
+
+
+def test_pip_config_file_env_is_used_for_user_scopes(tmp_path, monkeypatch):
+    path = tmp_path / "custom.conf"
+    monkeypatch.setenv("PIP_CONFIG_FILE", str(path))
+    assert pip_config.get_config_file("auto") == path
+    assert pip_config.get_config_file("user") == path
+    assert pip_config.get_config_file("global") != path
+
+    assert pip_config.set_index("https://user:pw@mirror.example:8443/simple") == path
+    assert pip_config.get_index("auto") == "https://user:pw@mirror.example:8443/simple"
+    assert "trusted-host = mirror.example:8443" in path.read_text(encoding="utf-8")
+    assert pip_config.unset_index("user") == path
+    assert pip_config.get_index("auto") is None
+
+
+def test_pip_config_file_devnull_is_rejected(monkeypatch):
+    monkeypatch.setenv("PIP_CONFIG_FILE", os.devnull)
+    with pytest.raises(ValueError):
+        pip_config.get_config_file("auto")
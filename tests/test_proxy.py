@@ -0,0 +1,55 @@
+# tests/test_proxy.py
+# 索引代理的包文件缓存
+
+import asyncio
+
+from aiohttp import ClientSession, web
+
+from tpip.proxy import DiskCache, ProxyServer
+
+FILE_PATH = "/packages/ab/cd/foo-1.0-py3-none-any.whl"
+BODY = b"wheel" * 1000
+
+
+async def _start(app):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, f"127.0.0.1:{runner.addresses[0][1]}"
+
+
+async def _fetch_through_two_mirrors(cache_dir):
+    requests = []
+
+    async def handle_file(request):
+        requests.append(request.path)
+        return web.Response(body=BODY, content_type="application/octet-stream")
+
+    upstream = web.Application()
+    # 两个镜像源的根地址不同: /pypi 和 /repository/pypi
+    upstream.router.add_get("/pypi" + FILE_PATH, handle_file)
+    upstream.router.add_get("/repository/pypi" + FILE_PATH, handle_file)
+    upstream_runner, upstream_host = await _start(upstream)
+    upstreams = [{"name": "a", "url": f"http://{upstream_host}/pypi/simple"},
+                 {"name": "b", "url": f"http://{upstream_host}/repository/pypi/simple"}]
+    server = ProxyServer(upstreams, DiskCache(cache_dir, 1024 * 1024))
+    proxy_runner, proxy_host = await _start(server.make_app())
+    try:
+        async with ClientSession() as session:
+            bodies = []
+            for base in ("pypi", "repository/pypi"):
+                async with session.get(f"http://{proxy_host}/packages/http/{upstream_host}/{base}{FILE_PATH}") as r:
+                    assert r.status == 200
+                    bodies.append(await r.read())
+    finally:
+        await proxy_runner.cleanup()
+        await upstream_runner.cleanup()
+    return bodies, requests, server.stats
+
+
+def test_same_file_on_two_mirrors_shares_cache_entry(tmp_path):
+    bodies, requests, stats = asyncio.run(_fetch_through_two_mirrors(tmp_path))
+    assert bodies == [BODY, BODY]
+    assert requests == ["/pypi" + FILE_PATH]
+    assert stats["misses"] == 1 and stats["hits"] == 1
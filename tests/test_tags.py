@@ -0,0 +1,41 @@
+# tests/test_tags.py
+# 按pip的规则从索引文件列表中选择测试文件的检查
+
+from tpip.tags import candidate_sort_key, select_package_file
+
+
+def entry(filename, **extra):
+    return dict({"filename": filename, "url": f"https://example.com/{filename}", "yanked": False,
+                 "requires_python": None}, **extra)
+
+
+def test_selects_newest_compatible_file():
+    files = [entry("foo-1.0.tar.gz"), entry("foo-1.0-py3-none-any.whl"),
+             entry("foo-2.0-py3-none-any.whl"), entry("foo-2.0.tar.gz")]
+    assert select_package_file(files, "foo")["filename"] == "foo-2.0-py3-none-any.whl"
+
+
+def test_skips_invalid_versions():
+    files = [entry("foo-0.1dev-r1234.tar.gz"), entry("foo-1.0-py3-none-any.whl"),
+             entry("foo-latest-py3-none-any.whl"), entry("foo-0.9.tar.gz")]
+    assert candidate_sort_key(files[0], "foo") is None
+    assert candidate_sort_key(files[2], "foo") is None
+    assert select_package_file(files, "foo")["filename"] == "foo-1.0-py3-none-any.whl"
+
+
+def test_only_invalid_versions():
+    assert select_package_file([entry("foo-0.1dev-r1234.tar.gz")], "foo") is None
+
+
+def test_skips_yanked_and_incompatible_files():
+    files = [entry("foo-3.0-py3-none-any.whl", yanked=True),
+             entry("foo-2.0-py3-none-any.whl", requires_python=">=99"),
+             entry("foo-1.5-cp27-cp27m-win32.whl"),
+             entry("foo-1.0-py3-none-any.whl")]
+    assert select_package_file(files, "foo")["filename"] == "foo-1.0-py3-none-any.whl"
+
+
+def test_ignores_prereleases_when_final_exists():
+    files = [entry("foo-2.0rc1-py3-none-any.whl"), entry("foo-1.0-py3-none-any.whl")]
+    assert select_package_file(files, "foo")["filename"] == "foo-1.0-py3-none-any.whl"
+    assert select_package_file(files[:1], "foo")["filename"] == "foo-2.0rc1-py3-none-any.whl"
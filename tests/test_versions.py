@@ -0,0 +1,54 @@
+# tests/test_versions.py
+# PEP 440 版本号排序键和版本约束的检查
+
+import pytest
+
+from tpip.versions import INVALID_VERSION_KEY, parse_version, specifier_contains, version_key
+
+
+@pytest.mark.parametrize("older, newer", [
+    ("1.0.dev0", "1.0a1"),
+    ("1.0a1", "1.0rc1"),
+    ("1.0rc1", "1.0"),
+    ("1.0", "1.0.post1"),
+    ("1.0", "1.0+local"),
+    ("1.9", "1.10"),
+    ("2.0", "1!0.1"),
+])
+def test_version_order(older, newer):
+    assert version_key(older) < version_key(newer)
+
+
+def test_trailing_zeros_are_equal():
+    assert version_key("1.0") == version_key("1.0.0")
+
+
+@pytest.mark.parametrize("version", ["0.1dev-r1234", "latest", "1.0-beta-final", ""])
+def test_invalid_version(version):
+    assert parse_version(version) is None
+    assert version_key(version) == INVALID_VERSION_KEY
+
+
+def test_invalid_version_sorts_before_valid():
+    versions = ["1.0", "0.1dev-r1234", "0.0.1.dev0", "latest"]
+    ordered = sorted(versions, key=version_key)
+    assert set(ordered[:2]) == {"0.1dev-r1234", "latest"}
+    assert ordered[2:] == ["0.0.1.dev0", "1.0"]
+    assert max(versions, key=version_key) == "1.0"
+
+
+def test_invalid_key_has_version_key_shape():
+    assert len(INVALID_VERSION_KEY) == len(parse_version("1.0"))
+
+
+@pytest.mark.parametrize("specifiers, version, expected", [
+    (">=3.8,!=3.9.*", "3.10.1", True),
+    (">=3.8,!=3.9.*", "3.9.2", False),
+    ("~=3.7", "3.11.0", True),
+    ("~=3.7.1", "3.8.0", False),
+    ("==3.11", "3.11.0", True),
+    ("not a specifier", "3.11.0", True),
+    ("", "3.11.0", True),
+])
+def test_specifier_contains(specifiers, version, expected):
+    assert specifier_contains(specifiers, version) is expected
@@ -1,4 +1,8 @@
 # tpip/__init__.py
 # yjys created on 2023/03/09
 
-__version__ = "0.2.0"
\ No newline at end of file
+__version__ = "0.2.0"
+
+from .benchmark import BenchmarkConfig, BenchmarkResult, MirrorBenchmark, MirrorResult  # noqa: E402
+
+__all__ = ["BenchmarkConfig", "BenchmarkResult", "MirrorBenchmark", "MirrorResult"]
@@ -0,0 +1,1498 @@
+# tpip/benchmark.py
+# 可复用的镜像源测速引擎：显式的测速配置、结构化的测速结果和进度回调，不依赖命令行参数
+
+import asyncio
+import contextlib
+import platform
+import socket
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+from .cache import (DEFAULT_CACHE_TTL, get_cached_results, get_network_identity, get_network_segment,
+                    load_link_capacity, store_link_capacity, store_ranking, store_results)
+from .fleet import (DEFAULT_FLEET_WAIT, LEASE_RETRY_POLLS, POLL_INTERVAL, fleet_key, get_holder, make_entry, open_store,
+                    shared_results)
+from .freshness import (DEFAULT_LAG_HALF_LIFE, FRESHNESS_PACKAGES, compare_mirrors, fetch_snapshot_async,
+                        load_snapshots, missing_pairs, store_snapshots)
+from .index import INDEX_ACCEPT, iter_index_files
+from .mirrors import MIRRORS, redact_url
+from . import tracing
+from .scoring import estimate_install_times, load_history, parse_workload
+from .stats import LinkMeter, ThroughputEstimator, is_settled, median, percentile, stdev
+from .tags import select_package_file
+
+# 默认测试包
+DEFAULT_TEST_PACKAGE = "torch"  # 默认使用torch包，几乎所有镜像源都有
+
+# 每个镜像源的延迟测试请求次数
+DEFAULT_LATENCY_SAMPLES = 5
+
+# 下载测速的吞吐量采样间隔（秒）
+SAMPLE_INTERVAL = 0.25
+
+# 下载测试每次读取的字节数
+DEFAULT_READ_SIZE = 64 * 1024
+
+# 按字节预算测速时每次读取的字节数
+PROBE_READ_SIZE = 64 * 1024
+
+# 下载速度达到本地链路容量的该比例时，认为瓶颈在本机网络而不是镜像源
+LINK_SATURATION = 0.9
+
+# 连接复用测试: 默认的请求次数和每个请求下载的字节数（相当于一个小的依赖包）
+DEFAULT_REUSE_REQUESTS = 8
+DEFAULT_REUSE_BYTES = 64 * 1024
+# 依赖较多的环境中包文件的典型大小，用于把每个请求的固定开销折算进得分
+TYPICAL_FILE_SIZE = 512 * 1024
+
+# 同时进行延迟测试的镜像源数量上限
+DEFAULT_CONCURRENCY = 32
+
+# 同一主机的并发连接数上限（多个镜像源可能位于同一主机上）
+DEFAULT_PER_HOST_LIMIT = 4
+
+# 首次请求的延迟超过第 top_count 快的镜像源的该倍数时，淘汰该镜像源，不再测试
+DEFAULT_ELIMINATE_FACTOR = 4.0
+
+# 淘汰阈值的下限（毫秒），避免在延迟很低的局域网中误淘汰
+MIN_ELIMINATE_MS = 200
+
+# DNS解析结果的缓存时间（秒）
+DNS_CACHE_TTL = 300
+
+# 延迟测试记录的aiohttp请求阶段事件
+TRACE_EVENTS = (
+    "request_start", "request_end", "request_headers_sent",
+    "connection_queued_start", "connection_queued_end",
+    "connection_create_start", "connection_create_end",
+    "dns_resolvehost_start", "dns_resolvehost_end",
+)
+
+# 下载测试使用的类似浏览器/pip的请求头（User-Agent 另行设置）
+DOWNLOAD_HEADERS = {
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.5",
+    "Accept-Encoding": "gzip, deflate, br",
+    "Connection": "keep-alive",
+    "Cache-Control": "max-age=0",
+    "Upgrade-Insecure-Requests": "1",
+}
+
+INDEX_HEADERS = {
+    "Accept": INDEX_ACCEPT,
+    "Accept-Language": "en-US,en;q=0.5",
+    "Accept-Encoding": "gzip, deflate, br",
+    "Connection": "keep-alive",
+    "Cache-Control": "max-age=0",
+}
+
+
+def get_system_info():
+    """获取系统信息，用于构建User-Agent"""
+    python_version = f"{sys.version_info.major}.{sys.version_info.minor}.{sys.version_info.micro}"
+    system = platform.system()
+    machine = platform.machine()
+    return f"Python/{python_version} ({system}; {machine})"
+
+
+def get_pip_like_user_agent():
+    """构建类似pip的User-Agent"""
+    system_info = get_system_info()
+    return f"pip/{get_pip_version()} {system_info}"
+
+
+# pip版本，首次构建User-Agent时才解析
+pip_version = None
+
+
+def get_pip_version():
+    """从包元数据读取pip版本，避免启动pip子进程"""
+    global pip_version
+    if pip_version is None:
+        try:
+            try:
+                from importlib.metadata import version
+            except ImportError:  # Python 3.7
+                from importlib_metadata import version
+            pip_version = version("pip")
+        except Exception:
+            pip_version = "21.0.1"  # 默认版本
+    return pip_version
+
+
+def create_latency_trace_config():
+    """创建记录请求各阶段时间点的aiohttp TraceConfig，时间点写入请求的 trace_request_ctx 字典"""
+    import aiohttp
+
+    trace_config = aiohttp.TraceConfig()
+
+    def recorder(event):
+        async def record(session, trace_config_ctx, params):
+            timings = trace_config_ctx.trace_request_ctx
+            if isinstance(timings, dict):
+                timings[event] = time.perf_counter()
+        return record
+
+    for event in TRACE_EVENTS:
+        # 旧版本aiohttp没有 on_request_headers_sent
+        if hasattr(trace_config, f"on_{event}"):
+            getattr(trace_config, f"on_{event}").append(recorder(event))
+    return trace_config
+
+
+def _phase_ms(timings, start, end):
+    if start in timings and end in timings:
+        return (timings[end] - timings[start]) * 1000
+    return None
+
+
+async def _measure_tcp_connect(host, port, dns_cache=None):
+    """
+    只建立TCP连接（不做TLS握手），返回耗时（毫秒），用于从连接耗时中估算TLS握手耗时。
+    dns_cache 为 {(主机, 端口): 地址} 字典，多个镜像源位于同一主机时只解析一次。
+    """
+    try:
+        address = dns_cache.get((host, port)) if dns_cache is not None else None
+        if address is None:
+            loop = asyncio.get_running_loop()
+            infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+            address = infos[0][4][0]
+            if dns_cache is not None:
+                dns_cache[(host, port)] = address
+        start = time.perf_counter()
+        _, writer = await asyncio.wait_for(asyncio.open_connection(address, port), 5)
+        elapsed = (time.perf_counter() - start) * 1000
+        writer.close()
+        return elapsed
+    except (OSError, asyncio.TimeoutError, IndexError):
+        return None
+
+
+def _speed_mb(estimator, total_size, download_time):
+    """计算下载速度（MB/s），有足够采样时使用去除慢启动后的平均吞吐量"""
+    if download_time <= 0 or total_size <= 0:
+        return None
+    if len(estimator.samples) >= 2:
+        speed = estimator.confidence_interval()[0] / 1024 / 1024
+    else:
+        speed = (total_size / 1024 / 1024) / download_time
+    # 确保速度不为0，最小显示0.01
+    return round(max(speed, 0.01), 2)
+
+
+def _speed_sd(estimator):
+    """去除慢启动后各采样区间吞吐量的标准差（MB/s），采样不足时为None"""
+    sd = stdev(estimator.samples)
+    return round(sd / 1024 / 1024, 3) if sd is not None else None
+
+
+def _quiet(message):
+    pass
+
+
+async def probe_file(session, url, probe_bytes, user_agent, end_time=None, meter=None):
+    """
+    用Range请求下载文件的前 probe_bytes 字节（到达 end_time 时提前结束），返回 {ttfb_ms, bytes, duration_ms, speed, size}，
+    speed 为收到首字节之后的吞吐量（MB/s），数据太少无法估计时为None；
+    size 为响应头中的文件总大小，HTML索引页通常不提供文件大小，需要从这里获得。
+    meter 不为None时，下载的字节数同时计入本地链路的总吞吐量。
+    """
+    headers = _range_headers({"User-Agent": user_agent}, 0, probe_bytes - 1)
+    received = 0
+    start = time.perf_counter()
+    async with session.get(url, headers=headers, timeout=15) as response:
+        if response.status not in (200, 206):
+            raise RuntimeError(f"HTTP {response.status}")
+        size = _response_file_size(response.status, response.content_length,
+                                   response.headers.get("Content-Range", ""))
+        first_byte = None
+        async for chunk in response.content.iter_chunked(PROBE_READ_SIZE):
+            if first_byte is None:
+                first_byte = time.perf_counter()
+            received += len(chunk)
+            if meter is not None:
+                meter.add(len(chunk), time.monotonic())
+            if received >= probe_bytes or (end_time is not None and time.monotonic() >= end_time):
+                break
+    return _probe_stats(start, first_byte, time.perf_counter(), received, size)
+
+
+def _probe_stats(start, first_byte, end, received, size):
+    first_byte = first_byte or end
+    transfer_time = end - first_byte
+    return {
+        "ttfb_ms": round((first_byte - start) * 1000, 2),
+        "bytes": received,
+        "duration_ms": round((end - start) * 1000, 2),
+        "speed": round(received / transfer_time / 1024 / 1024, 3) if transfer_time > 0.001 else None,
+        "size": size,
+    }
+
+
+def _range_headers(headers, first, last):
+    """在 headers 的基础上请求第 first 到 last 字节，Range请求需要原始字节，不能使用压缩编码"""
+    return dict(headers, **{"Range": f"bytes={first}-{last}", "Accept-Encoding": "identity"})
+
+
+def _range_segments(file_size, connections):
+    """将文件按HTTP Range切分为 connections 段，返回 [(首字节, 末字节), ...]，最后一段包含余下的字节"""
+    segment = file_size // connections
+    return [(i * segment, file_size - 1 if i == connections - 1 else (i + 1) * segment - 1)
+            for i in range(connections)]
+
+
+def _response_file_size(status, content_length, content_range):
+    """响应头中的文件总大小：200 响应取 Content-Length，206 响应取 Content-Range 中的总大小，未知时为None"""
+    size = content_length if status == 200 else None
+    if "/" in content_range and content_range.rsplit("/", 1)[1].isdigit():
+        size = int(content_range.rsplit("/", 1)[1])
+    return size
+
+
+def _add_chunk(name, total, size, estimator, estimators, adaptive, meter=None):
+    """
+    记录下载测试收到的一块数据（size 字节，累计 total 字节），同时计入本地链路的总吞吐量，
+    返回是否可以提前结束：adaptive 为True且各镜像源的排名已确定
+    """
+    now = time.monotonic()
+    if meter is not None:
+        meter.add(size, now)
+    return estimator.update(total, now) and adaptive and is_settled(name, estimators)
+
+
+def _register_estimator(estimators, name, label):
+    """为镜像源新建吞吐量估计器并登记到各镜像源共享的 estimators 字典"""
+    estimator = ThroughputEstimator(interval=SAMPLE_INTERVAL, label=label)
+    estimators[name] = estimator
+    return estimator
+
+
+def _latency_stats(latencies, ttfb, dns, connect, tls, errors, start_time):
+    """延迟测试的详细统计（毫秒），两个引擎的格式相同，未测得的阶段为None"""
+    def rounded(value):
+        return round(value, 2) if value is not None else None
+
+    return {
+        "samples": [round(x, 2) for x in latencies],
+        "p50": rounded(median(latencies)),
+        "p90": rounded(percentile(latencies, 90)),
+        "min": rounded(min(latencies)),
+        "dns": rounded(dns),
+        "connect": rounded(connect),
+        "tls": rounded(tls),
+        "ttfb": rounded(ttfb),
+        "errors": errors,
+        "duration_ms": round((time.monotonic() - start_time) * 1000, 2),
+    }
+
+
+async def _download_stream_async(session, name, package_url, headers, end_time, read_size,
+                                 estimator, estimators, adaptive, log=_quiet, meter=None):
+    """
+    单连接下载测试，直到文件结束、到达 end_time 或排名已确定。
+    返回 (下载字节数, 是否提前结束, 文件大小, 是否支持Range请求)，无法下载时返回None。
+    """
+    total_size = 0
+    early_stopped = False
+    async with session.get(package_url, headers=headers, timeout=30) as response:
+        if response.status != 200:
+            log(f"下载测试失败: {name} - 无法下载包文件，状态码: {response.status}")
+            return None
+
+        # 读取数据块并计算大小，每完成一个采样区间检查一次排名是否已确定
+        async def read_chunks():
+            nonlocal total_size, early_stopped
+            while True:
+                chunk = await response.content.read(read_size)
+                if not chunk:
+                    break
+                total_size += len(chunk)
+                if _add_chunk(name, total_size, len(chunk), estimator, estimators, adaptive, meter):
+                    early_stopped = True
+                    break
+
+        estimator.start(time.monotonic())
+        try:
+            await asyncio.wait_for(read_chunks(), max(end_time - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log(f"下载过程中出错: {e}")
+        accept_ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+        return total_size, early_stopped, response.content_length, accept_ranges
+
+
+async def _download_ranges_async(session, name, package_url, headers, file_size, connections, end_time,
+                                 read_size, estimator, estimators, adaptive, meter=None):
+    """
+    将文件按HTTP Range切分为 connections 段，并发下载直到到达 end_time 或排名已确定。
+    返回 (下载字节数, 是否提前结束)，镜像源不支持Range请求时返回None。
+    """
+    progress = {"bytes": 0, "ranged": True}
+    stop = asyncio.Event()
+
+    async def fetch_segment(first, last):
+        async with session.get(package_url, headers=_range_headers(headers, first, last), timeout=30) as response:
+            if response.status != 206:
+                progress["ranged"] = False
+                stop.set()
+                return
+            while not stop.is_set():
+                chunk = await response.content.read(read_size)
+                if not chunk:
+                    break
+                progress["bytes"] += len(chunk)
+                if _add_chunk(name, progress["bytes"], len(chunk), estimator, estimators, adaptive, meter):
+                    stop.set()
+
+    estimator.start(time.monotonic())
+    tasks = [asyncio.ensure_future(fetch_segment(first, last))
+             for first, last in _range_segments(file_size, connections)]
+    segments = asyncio.ensure_future(asyncio.gather(*tasks))
+    stop_task = asyncio.ensure_future(stop.wait())
+    try:
+        # 所有分段下载完毕、排名已确定或到达截止时间时结束
+        await asyncio.wait([segments, stop_task], timeout=max(end_time - time.monotonic(), 0),
+                           return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks + [stop_task]:
+            task.cancel()
+        await asyncio.gather(segments, stop_task, return_exceptions=True)
+    if not progress["ranged"]:
+        return None
+    return progress["bytes"], stop.is_set()
+
+
+@dataclass
+class BenchmarkConfig:
+    """测速配置，各字段与 tpip list 的命令行参数一一对应"""
+    mirrors: Dict[str, str] = field(default_factory=lambda: dict(MIRRORS))
+    package: str = DEFAULT_TEST_PACKAGE
+    download_test: bool = True
+    top_count: int = 3
+    # 提前放行: 已知 top_count 个延迟后立即让当前最快的 top_count 个镜像源开始下载测试，不等待其余镜像源，
+    # 最终延迟最低的 top_count 个镜像源仍然都会被测试，因此最多测试 2 × top_count 个镜像源（见 MirrorBenchmark._admit）；
+    # False 时等所有延迟测试结束后只测试 top_count 个
+    early_admit: bool = True
+    test_time: float = 5
+    sequential: bool = False
+    latency_samples: int = DEFAULT_LATENCY_SAMPLES
+    connections: int = 1
+    read_size: int = DEFAULT_READ_SIZE
+    time_budget: Optional[float] = None
+    adaptive: bool = True
+    # 按字节预算测速: 每个镜像源用Range请求只下载测试文件的前 probe_bytes 字节，在延迟测试和索引页请求全部结束后
+    # 按延迟顺序逐个测试，None 表示按 test_time 限时下载
+    probe_bytes: Optional[int] = None
+    # 连接复用测试: 下载测试之后在保持的连接上依次发送 reuse_requests 个 reuse_bytes 字节的Range请求（0表示不测试），
+    # 测得的每个请求的固定开销计入得分；http2 为True时另用 httpx 测试HTTP/2多路复用（只报告，不影响排名）
+    reuse_requests: int = 0
+    reuse_bytes: int = DEFAULT_REUSE_BYTES
+    http2: bool = False
+    # 调度: 同时测试的镜像源数量、同一主机的并发连接数、淘汰慢速镜像源的倍数（0表示不淘汰）
+    concurrency: int = DEFAULT_CONCURRENCY
+    per_host_limit: int = DEFAULT_PER_HOST_LIMIT
+    eliminate_factor: float = DEFAULT_ELIMINATE_FACTOR
+    # 同步延迟检测: 是否检测、检测用的包、落后多少小时得分减半
+    freshness: bool = False
+    freshness_packages: List[str] = field(default_factory=lambda: list(FRESHNESS_PACKAGES))
+    lag_half_life: float = DEFAULT_LAG_HALF_LIFE
+    # 是否读取未过期的缓存测速结果
+    use_cache: bool = True
+    cache_ttl: int = DEFAULT_CACHE_TTL
+    # 是否将测速结果写入缓存和排名文件
+    save_results: bool = True
+    # 多台主机共享测速结果: 共享存储（共享文件路径或 tpip fleet 服务地址，None 表示不共享）、
+    # 网段标识（None 表示按默认网关和 /24 网段自动生成）、其他主机正在测速时最多等待的秒数
+    fleet: Optional[str] = None
+    fleet_segment: Optional[str] = None
+    fleet_wait: float = DEFAULT_FLEET_WAIT
+    # 安装负载（如 "200 small wheels + 2 large"，见 scoring.parse_workload），设置后按预计安装耗时排名，
+    # 未进行下载测试的镜像源用历史测速结果和监控统计估计
+    workload: Optional[str] = None
+    user_agent: Optional[str] = None
+
+    def __post_init__(self):
+        if self.latency_samples < 1:
+            raise ValueError(f"latency_samples 必须大于0: {self.latency_samples}")
+
+    @property
+    def cache_scope(self):
+        """测速缓存的作用域：测试包名，多连接测试时附加连接数，连接复用测试的结果影响得分，也单独缓存"""
+        scope = f"{self.package}#{self.connections}" if self.connections > 1 else self.package
+        if self.reuse_requests:
+            scope += "~reuse"
+        return scope
+
+
+@dataclass
+class MirrorResult:
+    """单个镜像源的测速结果，未进行或失败的阶段对应字段为None，错误信息记录在 errors 中"""
+    name: str
+    url: str
+    latency_ms: Optional[float] = None
+    # 延迟详细统计: samples、p50、p90、min、dns、connect、tls、ttfb、errors
+    latency: Optional[dict] = None
+    # 索引页统计: url、format、bytes、files、duration_ms
+    index: Optional[dict] = None
+    # 选中的测试文件: url、filename、size、hashes 等
+    artifact: Optional[dict] = None
+    # 下载测试结果: speed、single_speed、aggregate_speed、connections、bytes、early_stopped、duration_s，
+    # 按字节预算测速时还有 ttfb_ms；速度达到本地链路容量时 link_limited 为True，effective_speed 为参与排名的链路容量
+    download: Optional[dict] = None
+    # 同步状态: checked、behind、lag_s、serial_lag、factor、errors，未检测时为None
+    freshness: Optional[dict] = None
+    # 连接复用测试结果: requests、new_connections、errors、median_ms、p90_ms、overhead_ms，
+    # 测试了HTTP/2时还有 http2: {http_version, multiplexed_ms, errors} 或 {error}；未测试时为None
+    reuse: Optional[dict] = None
+    # 按安装负载估计的耗时: total_s、request_s、transfer_s、variance_s、retry_s、speed、error_rate、source，
+    # 未设置安装负载或无法估计时为None
+    estimate: Optional[dict] = None
+    errors: List[str] = field(default_factory=list)
+    timings: Dict[str, float] = field(default_factory=dict)
+    rank: Optional[int] = None
+
+    @property
+    def speed(self):
+        """下载速度（MB/s），未测试或失败时为None"""
+        return (self.download or {}).get("speed")
+
+    @property
+    def score(self):
+        """排名得分，见 compute_score()"""
+        return compute_score(self.download, self.freshness, self.reuse)
+
+    def add_error(self, message):
+        self.errors.append(message)
+
+    def to_dict(self):
+        """转换为测速报告中的一项，地址中的凭据被隐藏"""
+        data = asdict(self)
+        data["url"] = redact_url(self.url)
+        if (data.get("artifact") or {}).get("url"):
+            data["artifact"]["url"] = redact_url(data["artifact"]["url"])
+        return data
+
+
+@dataclass
+class BenchmarkResult:
+    """一次测速的结果，mirrors 按排名排列"""
+    package: str
+    mirrors: List[MirrorResult]
+    best: Optional[str] = None
+    download_tested: bool = False
+    from_cache: bool = False
+    cache_age_s: Optional[float] = None
+    # 结果来自共享存储时为测速的主机名
+    shared_by: Optional[str] = None
+    duration_s: float = 0.0
+    # 本地链路容量的估计值（MB/s），为本次和之前测得的最高总吞吐量，未进行下载测试时为None
+    link_capacity: Optional[float] = None
+    timestamp: float = field(default_factory=time.time)
+
+    def get(self, name):
+        """按名称查找镜像源的测速结果"""
+        return next((m for m in self.mirrors if m.name == name), None)
+
+    @property
+    def bytes_total(self):
+        """测速过程中读取的索引页和下载的总字节数"""
+        return sum((m.index or {}).get("bytes", 0) + (m.download or {}).get("bytes", 0) for m in self.mirrors)
+
+    def to_dict(self):
+        """转换为 --json 输出的测速报告"""
+        from . import __version__
+
+        report = {
+            "tpip_version": __version__,
+            "timestamp": self.timestamp,
+            "package": self.package,
+            "from_cache": self.from_cache,
+            "best": self.best,
+            "duration_s": self.duration_s,
+            "bytes_total": self.bytes_total,
+            "link_capacity": self.link_capacity,
+            "mirrors": [m.to_dict() for m in self.mirrors],
+        }
+        if self.from_cache:
+            report["cache_age_s"] = self.cache_age_s
+        if self.shared_by:
+            report["shared_by"] = self.shared_by
+        return report
+
+
+def fill_latency(result, latency_result):
+    """将延迟测试结果 (名称, 延迟, 地址, 详细统计) 写入镜像源的测速结果"""
+    _, latency, _, stats = latency_result
+    stats = stats or {}
+    result.latency_ms = latency
+    if latency is None:
+        if stats.get("error"):
+            result.add_error(f"延迟测试失败: {stats['error']}")
+        return
+    result.latency = {key: value for key, value in stats.items() if key != "duration_ms"}
+    if stats.get("duration_ms") is not None:
+        result.timings["latency_ms"] = stats["duration_ms"]
+
+
+def latency_attrs(latency_result):
+    """延迟测试结果在性能跟踪中记录的属性"""
+    stats = latency_result[3] or {}
+    attrs = {key: stats.get(key) for key in ("p50", "dns", "connect", "tls", "ttfb", "errors")}
+    attrs["error"] = stats.get("error")
+    return attrs
+
+
+def index_attrs(result):
+    """索引页请求和解析在性能跟踪中记录的属性"""
+    index = result.index or {}
+    return {"format": index.get("format"), "bytes": index.get("bytes"), "files": index.get("files"),
+            "parse_ms": index.get("duration_ms"), "filename": (result.artifact or {}).get("filename"),
+            "errors": "; ".join(result.errors) or None}
+
+
+def reuse_attrs(result):
+    """连接复用测试结果在性能跟踪中记录的属性"""
+    reuse = result.reuse or {}
+    attrs = {key: reuse.get(key) for key in ("requests", "new_connections", "median_ms", "overhead_ms")}
+    attrs["http_version"] = (reuse.get("http2") or {}).get("http_version")
+    return attrs
+
+
+def download_attrs(result):
+    """下载测试结果在性能跟踪中记录的属性"""
+    download = result.download or {}
+    attrs = {key: download.get(key) for key in ("speed", "bytes", "connections", "early_stopped", "ttfb_ms")}
+    attrs["errors"] = "; ".join(result.errors) or None
+    return attrs
+
+
+_STAGE_ATTRS = {"index": index_attrs, "download": download_attrs}
+
+
+@contextlib.contextmanager
+def stage_span(stage, name, result, **attrs):
+    """
+    镜像源测速阶段（index / download）的跟踪区间，阶段结束时记录该阶段结果的属性；
+    index 阶段的耗时同时写入 result.timings
+    """
+    start = time.monotonic()
+    with tracing.span(stage, track=name, **attrs) as span:
+        yield span
+        span.set(**_STAGE_ATTRS[stage](result))
+    if stage == "index":
+        result.timings["index_ms"] = round((time.monotonic() - start) * 1000, 2)
+
+
+def compute_score(download, freshness=None, reuse=None):
+    """
+    排名得分：下载速度乘以同步延迟的得分系数，未检测同步延迟时等于下载速度。
+    速度受本地链路限制的镜像源按链路容量计算，得分相同，排名由延迟决定。
+    测试了连接复用时，按下载 TYPICAL_FILE_SIZE 大小的文件计算有效速度：每个文件的传输时间加上每个请求的固定开销。
+    没有下载速度时返回None。
+    """
+    if not download or download.get("speed") is None:
+        return None
+    speed = download.get("effective_speed") or download["speed"]
+    overhead_ms = (reuse or {}).get("overhead_ms")
+    if overhead_ms is not None and speed > 0:
+        transfer_ms = TYPICAL_FILE_SIZE / (speed * 1024 * 1024) * 1000
+        speed *= transfer_ms / (transfer_ms + overhead_ms)
+    return round(speed * (freshness or {}).get("factor", 1.0), 3)
+
+
+def reuse_stats(durations, sizes, new_connections, errors, speed):
+    """
+    连接复用测试的统计。durations 为各请求的耗时（毫秒），sizes 为各请求下载的字节数，
+    new_connections 为测试中新建的连接数（无法得知时为None），speed 为下载测试的单连接速度（MB/s）。
+    overhead_ms 为请求耗时的中位数减去按 speed 传输这些字节所需的时间，即每个请求的固定开销（往返、服务端处理）。
+    """
+    stats = {"requests": len(durations), "new_connections": new_connections, "errors": errors,
+             "median_ms": None, "p90_ms": None, "overhead_ms": None}
+    if not durations:
+        return stats
+    transfer_ms = median(sizes) / (speed * 1024 * 1024) * 1000 if speed else 0.0
+    stats.update(median_ms=round(median(durations), 2), p90_ms=round(percentile(durations, 90), 2),
+                 overhead_ms=round(max(median(durations) - transfer_ms, 0.0), 2))
+    return stats
+
+
+def has_http2():
+    """HTTP/2 多路复用测试需要 httpx 和 h2（pip install httpx[http2]）"""
+    import importlib.util
+
+    return all(importlib.util.find_spec(module) is not None for module in ("httpx", "h2"))
+
+
+def _multiplex_stats(version, elapsed, count, errors):
+    return {"http_version": version, "multiplexed_ms": round(elapsed * 1000 / count, 2) if count else None,
+            "errors": errors}
+
+
+async def multiplex_test_async(url, nbytes, count, user_agent):
+    """
+    HTTP/2 多路复用测试：用 httpx 建立一个连接后在其上同时发送 count 个 nbytes 字节的Range请求，
+    返回 {http_version, multiplexed_ms（平均每个请求的耗时）, errors}。镜像源只支持HTTP/1.1时 httpx 会为并发请求建立多个连接。
+    """
+    import httpx
+
+    headers = {"User-Agent": user_agent, "Range": f"bytes=0-{nbytes - 1}", "Accept-Encoding": "identity"}
+    async with httpx.AsyncClient(http2=True, timeout=10) as client:
+        # 第一个请求建立连接并协商协议，镜像源不支持Range请求时不再继续，以免下载完整文件
+        async with client.stream("GET", url, headers=headers) as response:
+            if response.status_code != 206:
+                return {"error": "不支持Range请求" if response.status_code == 200 else f"HTTP {response.status_code}"}
+            version = response.http_version
+            await response.aread()
+        start = time.perf_counter()
+        responses = await asyncio.gather(*(client.get(url, headers=headers) for _ in range(count)),
+                                         return_exceptions=True)
+        elapsed = time.perf_counter() - start
+    errors = sum(isinstance(r, Exception) or r.status_code != 206 for r in responses)
+    return _multiplex_stats(version, elapsed, count, errors)
+
+
+def rank_mirrors(mirrors, workload=None, history=None):
+    """
+    排名：有下载速度的按得分（检测了同步延迟时为按落后时间折算后的速度）从高到低，
+    其余按延迟从低到高，失败的排在最后（不参与排名）。
+    给出安装负载（scoring.Workload）时先为所有镜像源批量估计安装耗时，能估计的按预计耗时从低到高排在前面，
+    history 为 scoring.load_history() 返回的历史数据，用于估计未测试下载速度的镜像源。
+    """
+    mirrors = list(mirrors)
+    if workload is not None:
+        for mirror, estimate in zip(mirrors, estimate_install_times(mirrors, workload, history)):
+            mirror.estimate = estimate
+        mirrors.sort(key=lambda m: (m.estimate is None, (m.estimate or {}).get("total_s", 0), m.score is None,
+                                    -(m.score or 0), m.latency_ms is None, m.latency_ms or 0))
+    else:
+        mirrors.sort(key=lambda m: (m.score is None, -(m.score or 0), m.latency_ms is None, m.latency_ms or 0))
+    for rank, mirror in enumerate(mirrors, 1):
+        mirror.rank = rank if mirror.latency_ms is not None else None
+    return mirrors
+
+
+class MirrorBenchmark:
+    """
+    镜像源测速引擎：延迟测试 -> 获取包链接 -> 下载测试，各镜像源以流水线方式并发进行。
+
+    on_log(消息) 接收进度文本，默认不输出；on_progress(事件, 数据) 接收结构化的进度事件：
+    "latency"（单个镜像源完成延迟测试，数据为 MirrorResult）、
+    "latency_done"（全部延迟测试完成，数据为按延迟排序的成功的 MirrorResult 列表）、
+    "download"（单个镜像源完成下载测试，数据为 MirrorResult）、
+    "done"（测速结束，数据为 BenchmarkResult）。
+    session 为调用方提供的 aiohttp.ClientSession，此时只能使用 run_async()，会话由调用方负责关闭；
+    会话没有挂载 create_latency_trace_config() 时，延迟按请求耗时计算，不含DNS/连接/TLS分解。
+    """
+
+    def __init__(self, config=None, session=None, on_log: Optional[Callable[[str], None]] = None,
+                 on_progress: Optional[Callable[[str, object], None]] = None):
+        self.config = config or BenchmarkConfig()
+        self.session = session
+        self.on_log = on_log
+        self.on_progress = on_progress
+        self.user_agent = self.config.user_agent or get_pip_like_user_agent()
+        self.dns_cache = {}
+        self._first_latencies = []
+        self._lock = threading.Lock()
+        self.link_meter = LinkMeter(interval=SAMPLE_INTERVAL)
+        # 持有的共享测速租约 (存储, 键)，以及是否已经等待过其他主机的结果
+        self._fleet_lease = None
+        self._fleet_waited = False
+        self._http2 = False
+
+    def log(self, message):
+        if self.on_log:
+            self.on_log(message)
+
+    def emit(self, event, data):
+        if self.on_progress:
+            self.on_progress(event, data)
+
+    def run(self):
+        """同步入口：已安装aiohttp时在新的事件循环中运行异步引擎，否则使用线程池引擎，返回 BenchmarkResult"""
+        if self.session is not None:
+            raise RuntimeError("使用调用方提供的会话时请在其事件循环中调用 run_async()")
+        try:
+            import aiohttp  # noqa: F401
+        except ImportError:
+            return self.run_sync()
+        return asyncio.run(self.run_async())
+
+    def run_sync(self):
+        """线程池引擎：用 requests.Session 和线程池完成同样的测速流程，不依赖asyncio和aiohttp"""
+        from .threaded import run_threaded
+
+        result = self.cached_result()
+        if result is None:
+            result = run_threaded(self)
+        self.emit("done", result)
+        return result
+
+    async def run_async(self):
+        """异步入口：优先使用未过期的缓存测速结果，否则运行测速并返回 BenchmarkResult"""
+        # 读取缓存时可能要访问共享存储并等待其他主机的测速结果（tpip --fleet），在线程池中进行，不阻塞事件循环
+        result = await asyncio.get_running_loop().run_in_executor(None, tracing.bind(self.cached_result))
+        if result is None:
+            if self.session is not None:
+                result = await self._run(self.session)
+            else:
+                import aiohttp
+
+                timeout = aiohttp.ClientTimeout(total=30)
+                config = self.config
+                # 延迟测试和下载测试各自的并发连接数之和，同一主机至少允许 connections 个连接
+                connector = aiohttp.TCPConnector(limit=config.concurrency + config.top_count * config.connections,
+                                                 limit_per_host=max(config.per_host_limit, config.connections),
+                                                 ttl_dns_cache=DNS_CACHE_TTL)
+                async with aiohttp.ClientSession(timeout=timeout, connector=connector,
+                                                 trace_configs=[create_latency_trace_config()]) as session:
+                    result = await self._run(session)
+        self.emit("done", result)
+        return result
+
+    def cached_result(self):
+        """读取未过期的缓存测速结果，没有可用缓存时返回None"""
+        with tracing.span("cache_read") as span:
+            result = self._cached_result()
+            span.set(hit=result is not None)
+        return result
+
+    def _cached_result(self):
+        config = self.config
+        if not config.use_cache:
+            return None
+        cached = get_cached_results(get_network_identity(), config.cache_scope, config.mirrors,
+                                    ttl=config.cache_ttl, need_download=config.download_test)
+        shared_by = None
+        if cached is None and config.fleet:
+            cached, shared_by = self._fleet_results()
+        if cached is None:
+            return None
+        freshness = {}
+        if shared_by:
+            # 共享结果带有测速主机得到的同步状态，并写入本机的排名文件供故障转移使用
+            freshness = {entry["name"]: entry.get("freshness") for entry in cached}
+            if config.save_results:
+                store_ranking(get_network_identity(), config.cache_scope, cached)
+        elif config.freshness:
+            # 同步延迟快照也需要都在缓存中，否则重新测速
+            snapshots, pending = self._freshness_pending()
+            if pending:
+                return None
+            freshness = compare_mirrors(config.mirrors, config.freshness_packages, snapshots, config.lag_half_life)
+        mirrors = []
+        for entry in cached:
+            mirror = MirrorResult(entry["name"], entry["url"], freshness=freshness.get(entry["name"]),
+                                  reuse=entry.get("reuse"))
+            fill_latency(mirror, (entry["name"], entry["latency"], entry["url"], entry.get("latency_stats")))
+            if entry.get("speed") is not None:
+                mirror.download = {"speed": entry["speed"], "speed_sd": entry.get("speed_sd")}
+                if entry.get("effective_speed") is not None:
+                    mirror.download.update(link_limited=True, effective_speed=entry["effective_speed"])
+            mirrors.append(mirror)
+        mirrors = self._rank(mirrors)
+        return BenchmarkResult(config.package, mirrors,
+                               best=mirrors[0].name if mirrors and mirrors[0].rank else None,
+                               download_tested=any(m.speed is not None for m in mirrors), from_cache=True,
+                               cache_age_s=round(time.time() - min(r["timestamp"] for r in cached), 1),
+                               shared_by=shared_by)
+
+    def _fleet_results(self):
+        """
+        从共享存储读取同一网段其他主机发布的测速结果，返回 (结果列表, 测速主机)，没有可用结果时返回 (None, None)。
+        没有结果时申请测速租约：获得租约的主机负责测速并在 save() 中发布结果；
+        其他主机正在测速时最多等待 fleet_wait 秒（不超过其租约的剩余时间），超时或共享存储不可用时本机自行测速。
+        """
+        config = self.config
+        store = open_store(config.fleet)
+        key = fleet_key(config.fleet_segment or get_network_segment(), config.cache_scope)
+        deadline = None
+        polls = 0
+        with tracing.span("fleet_read") as span:
+            try:
+                while True:
+                    entry = store.get(key)
+                    cached = shared_results(entry, config.mirrors, config.cache_ttl,
+                                            need_download=config.download_test, need_freshness=config.freshness)
+                    if cached is not None:
+                        span.set(hit=True, host=entry.get("host"))
+                        return cached, entry.get("host") or "?"
+                    if self._fleet_waited:
+                        return None, None
+                    if polls % LEASE_RETRY_POLLS == 0:
+                        granted, lease = store.acquire(key, get_holder())
+                        if granted:
+                            self._fleet_lease = (store, key)
+                            span.set(hit=False, lease=True)
+                            return None, None
+                        if deadline is None:
+                            wait = max(min(config.fleet_wait, lease.get("expires", 0) - time.time()), 0)
+                            deadline = time.monotonic() + wait
+                            self.log(f"{lease.get('holder')} 正在测速，等待它共享测速结果（最多 {round(wait)} 秒）...")
+                    if time.monotonic() >= deadline:
+                        self.log("等待共享测速结果超时，本机自行测速")
+                        self._fleet_waited = True
+                        span.set(hit=False, lease=False)
+                        return None, None
+                    polls += 1
+                    time.sleep(POLL_INTERVAL)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                self.log(f"读取共享测速结果失败: {e}")
+                self._fleet_waited = True
+                span.set(error=str(e))
+                return None, None
+
+    def _publish_fleet(self, mirrors, download_tested):
+        """将本机的测速结果发布到共享存储，同时释放测速租约"""
+        config = self.config
+        store, key = self._fleet_lease or (open_store(config.fleet),
+                                           fleet_key(config.fleet_segment or get_network_segment(),
+                                                     config.cache_scope))
+        self._fleet_lease = None
+        try:
+            store.put(key, make_entry(mirrors, download_tested), get_holder())
+        except (OSError, ValueError) as e:
+            self.log(f"发布共享测速结果失败: {e}")
+
+    def _release_fleet(self):
+        """测速没有得到可发布的结果时释放测速租约，让其他主机接手"""
+        if self._fleet_lease is None:
+            return
+        store, key = self._fleet_lease
+        self._fleet_lease = None
+        try:
+            store.release(key, get_holder())
+        except (OSError, ValueError) as e:
+            self.log(f"释放共享测速租约失败: {e}")
+
+    async def _run(self, session):
+        config = self.config
+        start_time = time.monotonic()
+        results = {name: MirrorResult(name, url) for name, url in config.mirrors.items()}
+
+        self._first_latencies = []
+        self.link_meter = LinkMeter(interval=SAMPLE_INTERVAL)
+        semaphore = asyncio.Semaphore(max(config.concurrency, 1))
+
+        async def measure(name, url):
+            async with semaphore:
+                with tracing.span("latency", track=name) as span:
+                    latency_result = await self.measure_latency(session, name, url, eliminate=True)
+                    span.set(**latency_attrs(latency_result))
+                return latency_result
+
+        self.log(f"正在异步测试 {len(config.mirrors)} 个镜像源的延迟，请稍候...")
+        latency_tasks = {name: asyncio.ensure_future(measure(name, url)) for name, url in config.mirrors.items()}
+
+        pipeline_tasks = []
+        if config.download_test:
+            # 各镜像源共享的吞吐量估计器和下载测试总时间预算
+            estimators = {}
+            aggregate_estimators = {}
+            deadline = self._start_downloads()
+            download_lock = asyncio.Lock() if config.sequential else None
+        admitted = []
+        latencies = {}
+
+        def admit(done):
+            for name in self._admit(latencies, admitted, done):
+                admitted.append(name)
+                pipeline_tasks.append(asyncio.ensure_future(
+                    self._pipeline(session, name, config.mirrors[name], estimators, deadline, download_lock,
+                                   aggregate_estimators, results[name])))
+
+        for future in asyncio.as_completed(list(latency_tasks.values())):
+            latency_result = await future
+            fill_latency(results[latency_result[0]], latency_result)
+            self.emit("latency", results[latency_result[0]])
+            if config.download_test and latency_result[1] is not None:
+                latencies[latency_result[0]] = latency_result[1]
+                admit(done=False)
+        if config.download_test:
+            admit(done=True)
+        self._latency_done(results, start_time)
+
+        if pipeline_tasks:
+            await asyncio.gather(*pipeline_tasks, return_exceptions=True)
+        if config.download_test and config.probe_bytes:
+            for name in admitted:
+                if results[name].artifact:
+                    with stage_span("download", name, results[name], probe_bytes=config.probe_bytes):
+                        await self.test_download(session, name, results[name].url, results[name].artifact["url"],
+                                                 deadline=deadline, result=results[name])
+                    self.emit("download", results[name])
+        if config.download_test and config.reuse_requests:
+            names = self._start_reuse(results, admitted)
+            reuse_start = time.monotonic()
+
+            async def reuse(name):
+                with tracing.span("reuse", track=name) as span:
+                    await self.test_reuse(session, name, results[name])
+                    span.set(**reuse_attrs(results[name]))
+
+            await asyncio.gather(*(reuse(name) for name in names))
+            self._reuse_done(results, names, reuse_start)
+        # 在测速之后检测同步延迟，不占用下载测试的带宽，也不预热延迟测试的连接
+        if config.freshness:
+            with tracing.span("freshness"):
+                self._apply_freshness(results, await self.check_freshness_async(session))
+        # 保存结果时会写入缓存文件并发布到共享存储，同样在线程池中进行
+        return await asyncio.get_running_loop().run_in_executor(None, tracing.bind(self._finish), results, start_time)
+
+    def _freshness_pending(self):
+        """返回 (未过期的快照缓存, 需要重新获取的 (名称, 地址, 包名) 列表)"""
+        config = self.config
+        cached = load_snapshots(config.cache_ttl) if config.use_cache else {}
+        return cached, missing_pairs(config.mirrors, config.freshness_packages, cached)
+
+    def _freshness_done(self, cached, fetched, start_time):
+        """保存新获取的快照，比较各镜像源的同步状态并输出日志"""
+        config = self.config
+        if fetched and config.save_results and config.cache_ttl > 0:
+            store_snapshots(fetched, config.cache_ttl)
+        status = compare_mirrors(config.mirrors, config.freshness_packages, {**cached, **fetched},
+                                 config.lag_half_life)
+        lagging = [name for name, s in status.items() if s["behind"]]
+        self.log(f"同步延迟检测耗时: {round((time.monotonic() - start_time) * 1000, 2)} ms"
+                 f"（{len(fetched)} 个索引页，{len(lagging)} 个镜像源落后于最新版本）")
+        return status
+
+    async def check_freshness_async(self, session):
+        """并发获取各镜像源上 freshness_packages 的最新版本和同步序号（优先使用缓存），返回 {名称: 同步状态}"""
+        config = self.config
+        start_time = time.monotonic()
+        cached, pending = self._freshness_pending()
+        if pending:
+            self.log(f"正在检测 {len(config.mirrors)} 个镜像源的同步延迟...")
+        semaphore = asyncio.Semaphore(max(config.concurrency, 1))
+
+        async def fetch(url, package):
+            async with semaphore:
+                return (url, package), await fetch_snapshot_async(session, url, package, self.user_agent)
+
+        fetched = dict(await asyncio.gather(*(fetch(url, package) for _, url, package in pending)))
+        return self._freshness_done(cached, fetched, start_time)
+
+    def _apply_freshness(self, results, status):
+        for name, result in results.items():
+            result.freshness = status.get(name)
+
+    def _start_reuse(self, results, admitted):
+        """返回需要进行连接复用测试的镜像源（下载测试成功的），需要而无法测试HTTP/2时给出提示"""
+        names = [name for name in admitted if results[name].speed is not None and results[name].artifact]
+        self._http2 = self.config.http2 and has_http2()
+        if self.config.http2 and not self._http2:
+            self.log("HTTP/2 多路复用测试需要安装 httpx[http2]，已跳过")
+        if names:
+            self.log(f"正在测试 {len(names)} 个镜像源的连接复用（每个镜像源依次发送 {self.config.reuse_requests} 个请求）...")
+        return names
+
+    def _reuse_done(self, results, names, start_time):
+        summary = []
+        for name in names:
+            reuse = results[name].reuse or {}
+            if reuse.get("overhead_ms") is not None:
+                summary.append(f"{name} {reuse['overhead_ms']} ms")
+        self.log(f"连接复用测试耗时: {round((time.monotonic() - start_time) * 1000, 2)} ms"
+                 + (f"，每个请求的固定开销: {', '.join(summary)}" if summary else ""))
+
+    def _reuse_speed(self, result):
+        """扣除传输时间所用的速度：测试请求都在一个连接上，多连接测试时使用单连接速度"""
+        download = result.download or {}
+        return download.get("single_speed") or download.get("speed")
+
+    async def test_reuse(self, session, name, result):
+        """
+        连接复用测试：在会话保持的连接上对测试文件依次发送 reuse_requests 个 reuse_bytes 字节的Range请求，
+        模拟pip在同一连接上逐个下载依赖较多的环境中的小文件，结果写入 result.reuse。
+        镜像源不支持Range请求时每个请求都会提前关闭连接，表现为新建连接数和固定开销增大。
+        """
+        config = self.config
+        headers = _range_headers({"User-Agent": self.user_agent}, 0, config.reuse_bytes - 1)
+        file_url = result.artifact["url"]
+        durations, sizes, errors = [], [], 0
+        new_connections = None
+        for _ in range(max(config.reuse_requests, 1)):
+            timings = {}
+            start = time.perf_counter()
+            received = 0
+            try:
+                async with session.get(file_url, headers=headers, timeout=10, trace_request_ctx=timings) as response:
+                    if response.status not in (200, 206):
+                        errors += 1
+                        continue
+                    # 206 响应完整读取，连接回到连接池；不支持Range请求的镜像源返回完整文件，读够字节数后断开
+                    async for chunk in response.content.iter_chunked(config.read_size):
+                        received += len(chunk)
+                        if response.status == 200 and received >= config.reuse_bytes:
+                            break
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                errors += 1
+                continue
+            queued = _phase_ms(timings, "connection_queued_start", "connection_queued_end") or 0
+            durations.append((time.perf_counter() - start) * 1000 - queued)
+            sizes.append(received)
+            if "request_start" in timings:
+                # 会话挂载了 create_latency_trace_config() 时才能知道是否新建了连接
+                new_connections = (new_connections or 0) + ("connection_create_start" in timings)
+        result.reuse = reuse_stats(durations, sizes, new_connections, errors, self._reuse_speed(result))
+        if self._http2:
+            try:
+                result.reuse["http2"] = await multiplex_test_async(file_url, config.reuse_bytes,
+                                                                   config.reuse_requests, self.user_agent)
+            except Exception as e:
+                result.reuse["http2"] = {"error": str(e) or type(e).__name__}
+
+    def _start_downloads(self):
+        """输出下载测试的模式，返回所有下载测试共用的截止时间"""
+        config = self.config
+        if config.probe_bytes:
+            self.log(f"使用字节预算测试模式（每个镜像源下载 {round(config.probe_bytes / 1024)} KB）...")
+        else:
+            self.log("使用顺序测试模式..." if config.sequential else "使用并行测试模式...")
+        self.log(f"延迟最低的{config.top_count}个镜像源将立即开始下载速度测试...")
+        return time.monotonic() + config.time_budget if config.time_budget else None
+
+    def _latency_done(self, results, start_time):
+        valid = sorted((r for r in results.values() if r.latency_ms is not None), key=lambda r: r.latency_ms)
+        self.emit("latency_done", valid)
+        self.log(f"延迟测试总耗时: {round((time.monotonic() - start_time) * 1000, 2)} ms")
+
+    def _finish(self, results, start_time):
+        """汇总各镜像源的测速结果并排名，保存到缓存，返回 BenchmarkResult"""
+        config = self.config
+        if config.download_test:
+            self.log(f"测速总耗时: {round(time.monotonic() - start_time, 2)} 秒")
+        else:
+            self.log("\n已跳过下载速度测试")
+        link_capacity = self._check_link(results.values()) if config.download_test else None
+        mirrors = self._rank(results.values())
+        download_tested = any(m.speed is not None for m in mirrors)
+        if config.download_test and not download_tested:
+            self.log("所有镜像源下载测试失败")
+        elif config.save_results:
+            self.save(mirrors, download_tested)
+        self._release_fleet()
+        result = BenchmarkResult(config.package, mirrors,
+                                 best=mirrors[0].name if mirrors and mirrors[0].rank else None,
+                                 download_tested=download_tested,
+                                 duration_s=round(time.monotonic() - start_time, 3), link_capacity=link_capacity)
+        index_bytes = sum((m.index or {}).get("bytes", 0) for m in mirrors)
+        self.log(f"本次测速传输了 {round(result.bytes_total / 1024 / 1024, 2)} MB"
+                 f"（索引页 {round(index_bytes / 1024, 1)} KB，"
+                 f"下载测试 {round((result.bytes_total - index_bytes) / 1024 / 1024, 2)} MB）")
+        return result
+
+    def _rank(self, mirrors):
+        """排名，设置了安装负载时读取历史数据，按预计安装耗时排名"""
+        if not self.config.workload:
+            return rank_mirrors(mirrors)
+        with tracing.span("scoring") as span:
+            history = load_history(get_network_identity(), self.config.mirrors)
+            mirrors = rank_mirrors(mirrors, parse_workload(self.config.workload), history)
+            span.set(workload=self.config.workload, history=len(history),
+                     estimated=sum(m.estimate is not None for m in mirrors))
+        return mirrors
+
+    def _check_link(self, mirrors):
+        """
+        估计本地链路容量（MB/s），标记速度受本地链路限制的镜像源，返回链路容量，没有下载数据时返回None。
+        链路容量为本次测得的最高总吞吐量与之前保存的容量中的较大者；
+        至少两次测量（两个镜像源，或一个镜像源和之前保存的容量）都达到容量的 LINK_SATURATION 时，
+        认为瓶颈在本机网络，这些镜像源的速度差异只是测量误差，按链路容量参与排名。
+        """
+        config = self.config
+        speeds = {m.name: m.speed for m in mirrors if m.speed is not None}
+        observed = max([self.link_meter.peak / 1024 / 1024] + list(speeds.values()))
+        if observed <= 0:
+            return None
+        network_id = get_network_identity()
+        stored = load_link_capacity(network_id)
+        capacity = round(max(observed, stored or 0), 2)
+        if config.save_results and observed >= (stored or 0):
+            store_link_capacity(network_id, round(observed, 2))
+
+        threshold = capacity * LINK_SATURATION
+        saturated = [name for name, speed in speeds.items() if speed >= threshold]
+        if len(saturated) + (stored is not None and stored >= threshold) >= 2:
+            for mirror in mirrors:
+                if mirror.name in saturated:
+                    mirror.download.update(link_limited=True, effective_speed=capacity)
+            self.log(f"{len(saturated)} 个镜像源的下载速度达到本地链路容量（约 {capacity} MB/s），"
+                     "瓶颈在本机网络，这些镜像源按延迟排名")
+        elif (stored and not config.sequential and not config.probe_bytes and len(speeds) > 1
+              and self.link_meter.peak / 1024 / 1024 >= stored * LINK_SATURATION):
+            self.log(f"并行下载测试占满了本地链路（约 {stored} MB/s），各镜像源的速度可能被低估，"
+                     "建议使用 --sequential 或 --probe-bytes")
+        return capacity
+
+    def save(self, mirrors, download_tested):
+        """将测速结果写入磁盘缓存，保存完整的镜像源排名，设置了 fleet 时发布到共享存储"""
+        config = self.config
+        results = [{"name": m.name, "url": m.url, "latency": m.latency_ms, "latency_stats": m.latency,
+                    "speed": m.speed, "speed_sd": (m.download or {}).get("speed_sd"), "score": m.score,
+                    "reuse": m.reuse} for m in mirrors]
+        with tracing.span("cache_write"):
+            network_id = get_network_identity()
+            store_ranking(network_id, config.cache_scope, results)
+            if config.cache_ttl > 0:
+                store_results(network_id, config.cache_scope, results, download_tested)
+        if config.fleet:
+            with tracing.span("fleet_write"):
+                self._publish_fleet(mirrors, download_tested)
+
+    def _admit(self, latencies, admitted, done):
+        """
+        返回现在可以进入下载测试的镜像源。latencies 为已完成延迟测试的镜像源的延迟中位数 {名称: ms}，
+        admitted 为已进入下载测试的镜像源，done 表示所有镜像源的延迟测试都已结束。
+        config.early_admit 为True时，已知至少 top_count 个延迟后，当前延迟最低的 top_count 个镜像源立即开始测试
+        （不等待其余镜像源），此后不再提前放行；所有延迟都已知时，补上最终延迟最低的 top_count 个中还没有测试的镜像源。
+        因此最终延迟最低的 top_count 个镜像源一定会被测试，提前放行的镜像源最多多测试 top_count 个，
+        不会因为某个镜像源首次握手慢或在并发限制中排队而改变测试哪些镜像源。
+        early_admit 为False时只在所有延迟都已知后放行，恰好测试 top_count 个镜像源。
+        """
+        top_count = self.config.top_count
+        early = self.config.early_admit and len(latencies) >= top_count and not admitted
+        if top_count <= 0 or (not done and not early):
+            return []
+        return [name for name in sorted(latencies, key=latencies.get)[:top_count] if name not in admitted]
+
+    async def _pipeline(self, session, name, url, estimators, deadline, download_lock, aggregate_estimators, result):
+        """
+        单个镜像源在延迟测试之后的测速流水线：获取包链接 -> 下载测试。
+        每个阶段完成后立即进入下一阶段，不等待其他镜像源；哪些镜像源进入流水线见 _admit()。
+        download_lock 不为None时，下载测试按顺序逐个进行。
+        """
+        with stage_span("index", name, result):
+            package_file = await self.fetch_package_file(session, name, url, result)
+        if not package_file:
+            return
+        if self.config.probe_bytes:
+            # 按字节预算测速在所有延迟测试和索引页请求结束后逐个进行，各镜像源不争用本地带宽
+            return
+
+        async with download_lock or _NullLock():
+            with stage_span("download", name, result):
+                await self.test_download(session, name, url, package_file["url"], estimators, deadline,
+                                         aggregate_estimators, result)
+        self.emit("download", result)
+
+    def _latency_cutoff(self):
+        """淘汰阈值（毫秒）：已完成首次请求的镜像源中第 top_count 快的延迟乘以 eliminate_factor，样本不足时为None"""
+        config = self.config
+        rank = max(config.top_count, 1)
+        with self._lock:
+            if not config.eliminate_factor or len(self._first_latencies) < rank:
+                return None
+            reference = sorted(self._first_latencies)[rank - 1]
+        return max(reference * config.eliminate_factor, MIN_ELIMINATE_MS)
+
+    def _check_first_latency(self, latency):
+        """记录镜像源首次请求的延迟，返回该镜像源是否应被淘汰"""
+        with self._lock:
+            self._first_latencies.append(latency)
+        cutoff = self._latency_cutoff()
+        return cutoff is not None and latency > cutoff
+
+    async def measure_latency(self, session, name, url, samples=None, eliminate=False):
+        """
+        对同一镜像源连续发送 samples 次 HEAD 请求（复用已建立的连接），
+        返回 (名称, 延迟中位数ms, 地址, 详细统计)，失败时延迟为None。
+        延迟不包含等待连接池空闲的排队时间。
+        eliminate 为True时，首次请求明显慢于已测试的镜像源（见 _latency_cutoff）的镜像源被淘汰，不再继续测试。
+        """
+        if samples is None:
+            samples = self.config.latency_samples
+        latencies = []
+        ttfbs = []
+        cold = None  # 首次请求（新建连接）的阶段耗时
+        error = None
+        errors = 0
+        start_time = time.monotonic()
+        for i in range(samples):
+            timings = {}
+            cutoff = self._latency_cutoff() if eliminate and i == 0 else None
+            request_start = time.perf_counter()
+            try:
+                async with session.head(url, timeout=min(10, cutoff / 1000) if cutoff else 10,
+                                        trace_request_ctx=timings) as response:
+                    elapsed = (time.perf_counter() - request_start) * 1000
+                    if not 200 <= response.status < 400:
+                        error = f"HTTP {response.status}"
+                        errors += 1
+                        continue
+            except Exception as e:
+                if cutoff and isinstance(e, asyncio.TimeoutError):
+                    return self._eliminated(name, url, cutoff)
+                error = e
+                errors += 1
+                continue
+            queued = _phase_ms(timings, "connection_queued_start", "connection_queued_end") or 0
+            total = _phase_ms(timings, "request_start", "request_end")
+            if total is None:
+                # 会话没有挂载TraceConfig，按请求耗时计算
+                total = elapsed
+            latencies.append(total - queued)
+            if eliminate and len(latencies) == 1 and self._check_first_latency(latencies[0]):
+                return self._eliminated(name, url, self._latency_cutoff())
+            create = _phase_ms(timings, "connection_create_start", "connection_create_end")
+            ttfb = _phase_ms(timings, "request_headers_sent", "request_end")
+            if ttfb is None:
+                ttfb = total - queued - (create or 0)
+            ttfbs.append(ttfb)
+            if create is not None and cold is None:
+                dns = _phase_ms(timings, "dns_resolvehost_start", "dns_resolvehost_end") or 0.0
+                cold = {"dns": dns, "connect": create - dns, "tls": None}
+
+        if not latencies:
+            return self._latency_failed(name, url, error)
+
+        parsed = urlparse(url)
+        if cold is not None and parsed.scheme == "https":
+            tcp = await _measure_tcp_connect(parsed.hostname, parsed.port or 443, self.dns_cache)
+            if tcp is not None:
+                cold["tls"] = max(cold["connect"] - tcp, 0.0)
+                cold["connect"] = min(tcp, cold["connect"])
+        cold = cold or {"dns": None, "connect": None, "tls": None}
+        stats = _latency_stats(latencies, median(ttfbs), cold["dns"], cold["connect"], cold["tls"], errors,
+                               start_time)
+        return name, stats["p50"], url, stats
+
+    def _eliminated(self, name, url, cutoff):
+        message = f"延迟超过 {round(cutoff)} ms，已淘汰"
+        self.log(f"{name} ({redact_url(url)}) {message}")
+        return name, None, url, {"error": message}
+
+    def _latency_failed(self, name, url, error):
+        """所有延迟测试请求都失败时的结果，error 为最后一个错误"""
+        self.log(f"延迟测试失败: {name} ({redact_url(url)}) - {error}")
+        return name, None, url, {"error": str(error)}
+
+    def _index_failed(self, name, result, message, error):
+        """记录获取包链接失败的原因，返回None"""
+        self.log(f"{name} 的包链接获取失败: {message}")
+        add_error(result, error)
+        return None
+
+    def _index_done(self, name, index_url, files, index_stats, start_time, result):
+        """
+        按pip的规则（版本号、wheel标签优先级、requires-python）从索引页的文件中选择会被安装的文件，
+        记录索引页统计，返回选中的文件信息字典，没有合适的文件时返回None
+        """
+        parse_time = (time.monotonic() - start_time) * 1000
+        selected = select_package_file(files, self.config.package)
+        self.log(f"{name} 的索引页: {index_stats.get('format', 'html').upper()}，"
+                 f"读取 {round(index_stats.get('bytes', 0) / 1024, 1)} KB，耗时 {round(parse_time, 2)} ms")
+        if result is not None:
+            result.index = {"url": index_url, "format": index_stats.get("format"),
+                            "bytes": index_stats.get("bytes", 0), "files": len(files),
+                            "duration_ms": round(parse_time, 2)}
+        if not selected:
+            return self._index_failed(name, result, "未找到适合的包文件", "未找到适合的包文件")
+        size_note = f" ({round(selected['size'] / 1024 / 1024, 2)} MB)" if selected["size"] else ""
+        self.log(f"{name} 的包链接: @{redact_url(selected['url'])}{size_note}")
+        if result is not None:
+            result.artifact = selected
+        return selected
+
+    async def fetch_package_file(self, session, name, url, result=None):
+        """
+        获取镜像源中测试包的下载文件，返回文件信息字典（url、filename、size、hashes 等），失败时返回None。
+        优先请求PEP 691 JSON索引，HTML索引边下载边解析。
+        result 不为None时，索引页统计、选中的文件和错误信息会写入其中。
+        """
+        package_name = self.config.package
+        index_url = f"{url}/{package_name}/"
+        headers = dict(INDEX_HEADERS, **{"User-Agent": self.user_agent})
+        try:
+            index_stats = {}
+            start_time = time.monotonic()
+            async with session.get(index_url, headers=headers, timeout=10) as response:
+                if response.status != 200:
+                    return self._index_failed(name, result, "无法访问包信息页面", f"索引页 HTTP {response.status}")
+                # 索引页按上传时间从旧到新列出文件，需要解析完整的索引页才能选出pip会安装的最新版本
+                files = [package_file async for package_file in
+                         iter_index_files(response, str(response.url), index_stats)]
+            return self._index_done(name, index_url, files, index_stats, start_time, result)
+        except Exception as e:
+            return self._index_failed(name, result, str(e), f"获取包链接失败: {e}")
+
+    async def test_download(self, session, name, url, package_url, estimators=None, deadline=None,
+                            aggregate_estimators=None, result=None):
+        """
+        测试镜像源的实际下载速度。
+        estimators / aggregate_estimators 为各镜像源共享的单连接 / 多连接吞吐量估计器，用于在排名确定后提前结束测试；
+        deadline 为所有下载测试共用的截止时间（time.monotonic()）。
+        connections 大于1时，前一半时间测试单连接速度，后一半时间用Range请求并发下载，测试聚合速度。
+        返回 (名称, 速度MB/s, 地址, 详细信息)，多连接测试成功时速度为聚合速度。
+        result 不为None时，下载详细信息和错误信息会写入其中。
+        """
+        config = self.config
+        # 只在顺序模式下输出详细信息
+        detail = self.log if config.sequential else _quiet
+        headers = dict(DOWNLOAD_HEADERS, **{"User-Agent": self.user_agent})
+        try:
+            start_time, end_time, single_end = self._download_window(deadline)
+            if config.probe_bytes:
+                try:
+                    probe = await probe_file(session, package_url, config.probe_bytes, self.user_agent, end_time,
+                                             self.link_meter)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    probe = None
+                    add_error(result, f"下载测试失败: {e}")
+                return self._probe_done(name, url, probe, start_time, result)
+
+            detail(f"测试 {name} 下载 {config.package} 包的速度（限时{config.test_time}秒）...")
+            estimators = {} if estimators is None else estimators
+            estimator = _register_estimator(estimators, name, name)
+            try:
+                stream = await _download_stream_async(session, name, package_url, headers, single_end,
+                                                      config.read_size, estimator, estimators, config.adaptive,
+                                                      detail, self.link_meter)
+            except asyncio.CancelledError:
+                detail(f"下载测试被取消: {name}")
+                raise
+            except Exception as e:
+                detail(f"下载测试失败: {name} - {e}")
+                add_error(result, f"下载测试失败: {e}")
+                return name, None, url, None
+            finally:
+                estimator.finished = True
+            details = self._single_done(name, stream, estimator, start_time, detail, result)
+            if details is None:
+                return name, None, url, None
+
+            # 多连接Range并发下载测试
+            if self._wants_ranges(name, stream, end_time, detail):
+                aggregate_estimators = {} if aggregate_estimators is None else aggregate_estimators
+                aggregate = _register_estimator(aggregate_estimators, name, f"{name} x{config.connections}")
+                aggregate_start = time.monotonic()
+                try:
+                    ranged = await _download_ranges_async(session, name, package_url, headers, stream[2],
+                                                          config.connections, end_time, config.read_size, aggregate,
+                                                          aggregate_estimators, config.adaptive, self.link_meter)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    ranged = None
+                    add_error(result, f"多连接下载测试失败: {e}")
+                    detail(f"多连接下载测试失败: {name} - {e}")
+                finally:
+                    aggregate.finished = True
+                self._aggregate_done(name, details, ranged, aggregate, aggregate_start, detail)
+            return self._download_done(name, url, details, start_time, result)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return self._download_failed(name, url, e, result)
+
+    def _download_window(self, deadline):
+        """
+        下载测试的时间窗口 (开始时间, 结束时间, 单连接测试结束时间)，结束时间不超过所有下载测试共用的 deadline。
+        多连接测试时，前一半时间用于单连接测试。
+        """
+        start_time = time.monotonic()
+        end_time = start_time + self.config.test_time
+        if deadline is not None:
+            end_time = min(end_time, deadline)
+        single_end = start_time + (end_time - start_time) / 2 if self.config.connections > 1 else end_time
+        return start_time, end_time, single_end
+
+    def _single_done(self, name, stream, estimator, start_time, detail, result):
+        """汇总单连接下载测试的结果，返回详细信息字典，无法计算速度时返回None"""
+        if stream is None:
+            add_error(result, "无法下载包文件")
+            return None
+        total_size, early_stopped = stream[:2]
+        download_time = min(time.monotonic() - start_time, self.config.test_time)
+        stop_note = "（排名已确定，提前结束）" if early_stopped else ""
+        detail(f"下载完成: {round(download_time, 2)}秒内下载了 {round(total_size/1024/1024, 2)} MB{stop_note}")
+
+        speed = _speed_mb(estimator, total_size, download_time)
+        if speed is None:
+            detail(f"下载测试失败: {name} - 下载时间过短或文件大小为0")
+            add_error(result, "下载时间过短或文件大小为0")
+            return None
+        detail(f"{name} 下载速度: {speed} MB/s ({round(download_time, 2)}秒内下载: "
+               f"{round(total_size/1024/1024, 2)} MB)")
+        return {"single_speed": speed, "speed_sd": _speed_sd(estimator), "aggregate_speed": None,
+                "connections": 1, "bytes": total_size, "early_stopped": early_stopped}
+
+    def _wants_ranges(self, name, stream, end_time, detail):
+        """单连接测试之后是否进行多连接Range并发下载测试，stream 为单连接测试的结果"""
+        if self.config.connections <= 1:
+            return False
+        _, _, file_size, accept_ranges = stream
+        if file_size and accept_ranges and time.monotonic() < end_time:
+            return True
+        detail(f"{name} 不支持Range请求或文件大小未知，仅测试单连接速度")
+        return False
+
+    def _aggregate_done(self, name, details, ranged, aggregate, aggregate_start, detail):
+        """将多连接下载测试的结果 (下载字节数, 是否提前结束) 合并到 details"""
+        if not ranged:
+            return
+        connections = self.config.connections
+        aggregate_speed = _speed_mb(aggregate, ranged[0], time.monotonic() - aggregate_start)
+        details.update(aggregate_speed=aggregate_speed, connections=connections,
+                       bytes=details["bytes"] + ranged[0])
+        detail(f"{name} {connections}连接聚合下载速度: {aggregate_speed} MB/s")
+
+    def _download_done(self, name, url, details, start_time, result):
+        """
+        返回下载测试的 (名称, 速度MB/s, 地址, 详细信息)，多连接测试成功时速度为聚合速度。
+        result 不为None时，详细信息写入其中。
+        """
+        aggregate_speed = details["aggregate_speed"]
+        details["speed"] = aggregate_speed if aggregate_speed is not None else details["single_speed"]
+        details["duration_s"] = round(min(time.monotonic() - start_time, self.config.test_time), 2)
+        if result is not None:
+            result.download = details
+        return name, details["speed"], url, details
+
+    def _download_failed(self, name, url, error, result):
+        self.log(f"下载测试失败: {name} ({redact_url(url)}) - {error}")
+        add_error(result, f"下载测试失败: {error}")
+        return name, None, url, None
+
+    def _probe_done(self, name, url, probe, start_time, result):
+        """汇总按字节预算测速的结果，返回与 test_download 相同的 (名称, 速度MB/s, 地址, 详细信息)"""
+        if probe is None:
+            return name, None, url, None
+        if not probe["speed"]:
+            add_error(result, "下载的数据太少，无法估计速度")
+            return name, None, url, None
+        speed = round(max(probe["speed"], 0.01), 2)
+        self.log(f"{name} 下载速度: {speed} MB/s（首字节 {probe['ttfb_ms']} ms，"
+                 f"下载 {round(probe['bytes'] / 1024, 1)} KB）")
+        details = {"speed": speed, "single_speed": speed, "aggregate_speed": None, "connections": 1,
+                   "bytes": probe["bytes"], "early_stopped": False, "ttfb_ms": probe["ttfb_ms"],
+                   "duration_s": round(time.monotonic() - start_time, 2)}
+        if result is not None:
+            result.download = details
+        return name, speed, url, details
+
+
+class _NullLock:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def add_error(result, message):
+    """记录镜像源测速过程中的错误信息，result 为None时忽略"""
+    if result is not None:
+        result.add_error(message)
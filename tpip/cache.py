@@ -0,0 +1,305 @@
+# tpip/cache.py
+# 镜像源测速结果的磁盘缓存
+
+import hashlib
+import json
+import os
+import socket
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from .mirrors import redact_url
+
+# 缓存有效期（秒），超过后重新测速
+DEFAULT_CACHE_TTL = 3600
+# 超过该时间的缓存条目在写入时被清理
+MAX_ENTRY_AGE = 7 * 24 * 3600
+CACHE_FILE_NAME = "results.json"
+# 最近一次测速得到的镜像源排名，供故障转移和对冲请求使用
+RANKING_FILE_NAME = "ranking.json"
+# 各网络环境的本地链路容量估计
+LINK_FILE_NAME = "link.json"
+# 链路容量估计的有效期（秒），过期后以新测得的值为准
+LINK_CAPACITY_TTL = 24 * 3600
+# 版本2起缓存和排名中不再保存镜像源地址本身，旧版本的文件被忽略
+CACHE_VERSION = 2
+
+
+def get_cache_dir():
+    """获取tpip的缓存目录，可通过 TPIP_CACHE_DIR 环境变量覆盖"""
+    env_dir = os.environ.get("TPIP_CACHE_DIR")
+    if env_dir:
+        return Path(env_dir)
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+        return Path(base) / "tpip" / "Cache"
+    if sys.platform == "darwin":
+        return Path.home() / "Library" / "Caches" / "tpip"
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return Path(base) / "tpip"
+
+
+def get_default_gateway():
+    """读取默认网关地址（仅Linux，其他平台返回None）"""
+    try:
+        with open("/proc/net/route") as f:
+            for line in f.readlines()[1:]:
+                fields = line.split()
+                # Destination为00000000且带有RTF_GATEWAY标志的即默认路由
+                if len(fields) > 3 and fields[1] == "00000000" and int(fields[3], 16) & 2:
+                    gateway = bytes.fromhex(fields[2])[::-1]
+                    return f"{fields[0]}/{socket.inet_ntoa(gateway)}"
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def get_local_address():
+    """获取出口网卡的本地地址（UDP connect不会发送任何数据包）"""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(("8.8.8.8", 80))
+            return s.getsockname()[0]
+    except OSError:
+        return None
+
+
+def get_network_identity():
+    """根据默认网关和出口地址生成网络标识，网络环境变化后缓存自动失效"""
+    parts = [get_default_gateway() or "", get_local_address() or ""]
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()[:16]
+
+
+def get_network_segment():
+    """
+    根据默认网关和出口地址所在的 /24 网段生成网段标识，同一网段的主机共享测速结果（tpip --fleet）。
+    与 get_network_identity 不同，标识中不包含主机自己的地址。
+    """
+    address = get_local_address() or ""
+    subnet = address.rsplit(".", 1)[0] + ".0/24" if address else ""
+    parts = [get_default_gateway() or "", subnet]
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()[:16]
+
+
+def url_id(url):
+    """镜像源地址的摘要，缓存和共享存储中不保存地址本身，以免泄露私有镜像源的凭据"""
+    return hashlib.sha256(url.encode()).hexdigest()[:16]
+
+
+def _entry_key(network_id, package, url):
+    return f"{network_id}|{package}|{url_id(url)}"
+
+
+def load_cache(path=None):
+    """读取缓存文件，文件不存在或损坏时返回空缓存"""
+    path = Path(path) if path else get_cache_dir() / CACHE_FILE_NAME
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") == CACHE_VERSION and isinstance(data.get("entries"), dict):
+            return data
+    except (OSError, ValueError):
+        pass
+    return {"version": CACHE_VERSION, "entries": {}}
+
+
+def save_cache(data, path=None):
+    """原子地写入缓存文件（先写临时文件再重命名）"""
+    path = Path(path) if path else get_cache_dir() / CACHE_FILE_NAME
+    _write_json_atomic(data, path)
+
+
+def _default_file_mode(path):
+    """path 已存在时沿用它的权限，否则为按当前 umask 新建文件时的默认权限"""
+    try:
+        return os.stat(path).st_mode & 0o777
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def _write_json_atomic(data, path, shared=False):
+    """
+    先写临时文件再重命名。临时文件只有所有者可以读写；
+    shared 为True时（多个用户共用的文件）改为沿用原文件的权限，新建时按 umask 取默认权限。
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), prefix=".tmp-", suffix=".json")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        if shared:
+            os.chmod(tmp_path, _default_file_mode(path))
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def get_cached_results(network_id, package, mirrors, ttl=DEFAULT_CACHE_TTL, need_download=True, path=None):
+    """
+    查找缓存的测速结果。
+    只有当所有镜像源都有未过期的结果时才返回结果列表，否则返回None。
+    """
+    if ttl <= 0:
+        return None
+    entries = load_cache(path)["entries"]
+    now = time.time()
+    results = []
+    for name, url in mirrors.items():
+        entry = entries.get(_entry_key(network_id, package, url))
+        if not entry or now - entry.get("timestamp", 0) > ttl:
+            return None
+        if need_download and not entry.get("download_tested"):
+            return None
+        results.append(dict(entry, name=name, url=url))
+    return results
+
+
+def get_history(network_id, mirrors, path=None):
+    """
+    查找各镜像源在本网络下最近一次测得的下载速度，不区分测试包、不检查有效期（最多保留 MAX_ENTRY_AGE），
+    返回 {名称: {name, speed, speed_sd, timestamp}}，没有记录的镜像源不在其中。
+    """
+    names = {url_id(url): name for name, url in mirrors.items()}
+    now = time.time()
+    history = {}
+    for key, entry in load_cache(path)["entries"].items():
+        entry_network, _, rest = key.partition("|")
+        name = names.get(rest.partition("|")[2])
+        last = entry.get("last_download")
+        if last is None and entry.get("speed") is not None:
+            last = {"speed": entry["speed"], "speed_sd": entry.get("speed_sd"), "timestamp": entry.get("timestamp", 0)}
+        if entry_network != network_id or name is None or not last or now - last["timestamp"] > MAX_ENTRY_AGE:
+            continue
+        if last["timestamp"] > history.get(name, {}).get("timestamp", 0):
+            history[name] = dict(last, name=name)
+    return history
+
+
+def store_results(network_id, package, results, download_tested, path=None):
+    """
+    保存一次测速的结果。
+    results 为字典列表，包含 name、url、latency、latency_stats、speed、speed_sd、reuse 字段。
+    """
+    try:
+        data = load_cache(path)
+        now = time.time()
+        entries = {key: entry for key, entry in data["entries"].items()
+                   if now - entry.get("timestamp", 0) <= MAX_ENTRY_AGE}
+        for result in results:
+            key = _entry_key(network_id, package, result["url"])
+            # 本次没有测试下载速度的镜像源保留之前测得的速度，供按安装负载排名时估计
+            if result.get("speed") is not None:
+                last_download = {"speed": result["speed"], "speed_sd": result.get("speed_sd"), "timestamp": now}
+            else:
+                last_download = (entries.get(key) or {}).get("last_download")
+            entries[key] = {
+                "name": result["name"],
+                "latency": result.get("latency"),
+                "latency_stats": result.get("latency_stats"),
+                "speed": result.get("speed"),
+                "speed_sd": result.get("speed_sd"),
+                "reuse": result.get("reuse"),
+                "last_download": last_download,
+                "download_tested": download_tested,
+                "timestamp": now,
+            }
+        data["entries"] = entries
+        save_cache(data, path)
+    except OSError as e:
+        # 缓存写入失败不影响测速结果
+        print(f"写入测速缓存失败: {e}")
+
+
+def rank_results(results):
+    """
+    按测速结果给镜像源排名：有下载速度的按得分（没有得分时为速度）从高到低排在前面，
+    其余按延迟从低到高排列，延迟测试失败的镜像源不参与排名。
+    """
+    with_speed = sorted((r for r in results if r.get("speed") is not None),
+                        key=lambda r: -(r["speed"] if r.get("score") is None else r["score"]))
+    latency_only = sorted((r for r in results if r.get("speed") is None and r.get("latency") is not None),
+                          key=lambda r: r["latency"])
+    return with_speed + latency_only
+
+
+def best_cached_mirror(results):
+    """从缓存结果中选出最佳镜像源：优先下载速度，其次延迟"""
+    ranked = rank_results(results)
+    return ranked[0]["name"] if ranked else None
+
+
+def store_ranking(network_id, package, results, path=None):
+    """
+    保存完整的镜像源排名（而不只是最快的一个），results 的格式与 store_results 相同。
+    只保存隐藏了凭据的地址（用于显示）和地址摘要 url_id，读取时按 url_id 从镜像源列表中取回完整地址。
+    """
+    ranking = []
+    for result in rank_results(results):
+        stats = result.get("latency_stats") or {}
+        ranking.append({"name": result["name"], "url": redact_url(result["url"]), "url_id": url_id(result["url"]),
+                        "latency": result.get("latency"),
+                        "latency_p90": stats.get("p90"), "speed": result.get("speed")})
+    data = {"version": CACHE_VERSION, "network_id": network_id, "package": package,
+            "timestamp": time.time(), "mirrors": ranking}
+    try:
+        _write_json_atomic(data, Path(path) if path else get_cache_dir() / RANKING_FILE_NAME)
+    except OSError as e:
+        print(f"写入镜像源排名失败: {e}")
+
+
+def load_ranking(network_id=None, path=None):
+    """
+    读取保存的镜像源排名，返回 [{name, url, url_id, latency, latency_p90, speed}, ...]，url 中的凭据已被隐藏。
+    指定 network_id 时只返回在同一网络环境下得到的排名，没有时返回空列表。
+    """
+    path = Path(path) if path else get_cache_dir() / RANKING_FILE_NAME
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return []
+    if data.get("version") != CACHE_VERSION or not isinstance(data.get("mirrors"), list):
+        return []
+    if network_id is not None and data.get("network_id") != network_id:
+        return []
+    return data["mirrors"]
+
+
+def load_link_capacity(network_id, ttl=LINK_CAPACITY_TTL, path=None):
+    """读取该网络环境下未过期的本地链路容量（MB/s），没有时返回None"""
+    path = Path(path) if path else get_cache_dir() / LINK_FILE_NAME
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        entry = data["networks"][network_id]
+        if data.get("version") == CACHE_VERSION and time.time() - entry["timestamp"] <= ttl:
+            return entry["capacity"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def store_link_capacity(network_id, capacity, path=None):
+    """保存该网络环境下测得的本地链路容量（MB/s），过期的条目在写入时被清理"""
+    path = Path(path) if path else get_cache_dir() / LINK_FILE_NAME
+    try:
+        with open(path, encoding="utf-8") as f:
+            networks = json.load(f).get("networks", {})
+    except (OSError, ValueError, AttributeError):
+        networks = {}
+    now = time.time()
+    networks = {key: entry for key, entry in networks.items()
+                if isinstance(entry, dict) and now - entry.get("timestamp", 0) <= LINK_CAPACITY_TTL}
+    networks[network_id] = {"capacity": capacity, "timestamp": now}
+    try:
+        _write_json_atomic({"version": CACHE_VERSION, "networks": networks}, path)
+    except OSError as e:
+        print(f"写入链路容量失败: {e}")
@@ -0,0 +1,208 @@
+# tpip/failover.py
+# 按镜像源排名进行故障转移和对冲请求（hedged requests），并用熔断器隔离不健康的镜像源
+
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+# 没有延迟测试结果时的对冲延迟（秒）
+DEFAULT_HEDGE_DELAY = 0.5
+# 自动计算的对冲延迟的下限（秒），避免对低延迟镜像源过早发出对冲请求
+MIN_HEDGE_DELAY = 0.1
+# 自动对冲延迟 = 延迟测试 P90 的倍数
+HEDGE_P90_FACTOR = 3
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_COOLDOWN = 30
+
+
+class NoMirrorAvailable(Exception):
+    pass
+
+
+def mirror_file_base(mirror_url):
+    """镜像源包文件的根地址：索引地址去掉末尾的 /simple，pypi.org 的文件位于 files.pythonhosted.org"""
+    parts = urlsplit(mirror_url)
+    if parts.netloc == "pypi.org":
+        return "https://files.pythonhosted.org"
+    path = parts.path.rstrip("/")
+    if path.endswith("/simple"):
+        path = path[:-len("/simple")]
+    return f"{parts.scheme}://{parts.netloc}{path}"
+
+
+def split_file_url(url, mirrors):
+    """
+    PyPI 镜像源的包文件路径都是 <根地址>/packages/...，可以在镜像源之间互换。
+    返回 (地址所属的镜像源, 去掉根地址后的相对路径 /packages/...)，地址不属于任何镜像源时返回 (None, None)。
+    """
+    for source in mirrors:
+        base = mirror_file_base(source["url"])
+        if url.startswith(f"{base}/packages/"):
+            return source, url[len(base):]
+    return None, None
+
+
+def relocate_file_url(url, mirrors):
+    """返回 {镜像源名称: 该镜像源上同一文件的地址}，地址不属于任何镜像源时返回空字典，见 split_file_url()"""
+    source, relative = split_file_url(url, mirrors)
+    if source is None:
+        return {}
+    return {m["name"]: url if m is source else f"{mirror_file_base(m['url'])}{relative}" for m in mirrors}
+
+
+class CircuitBreaker:
+    """
+    每个镜像源一个熔断器：连续失败 failure_threshold 次后熔断 cooldown 秒，
+    熔断期间不再向该镜像源发送请求；冷却结束后放行一个探测请求（半开状态），成功则恢复。
+    """
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, cooldown=DEFAULT_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = {}
+        self.open_until = {}
+        self.probing = set()
+
+    def state(self, name, now=None):
+        until = self.open_until.get(name)
+        if until is None:
+            return "closed"
+        if (now or time.monotonic()) < until:
+            return "open"
+        return "half-open"
+
+    def allow(self, name):
+        """是否可以向镜像源发送请求，半开状态下只放行一个探测请求"""
+        state = self.state(name)
+        if state == "closed":
+            return True
+        if state == "half-open" and name not in self.probing:
+            self.probing.add(name)
+            return True
+        return False
+
+    def release(self, name):
+        """请求在得到结果前被取消（如对冲请求中其他镜像源先返回）时调用，结束探测以便下次重新放行探测请求"""
+        self.probing.discard(name)
+
+    def record_success(self, name):
+        if name in self.open_until:
+            print(f"镜像源 {name} 已恢复")
+        self.failures.pop(name, None)
+        self.open_until.pop(name, None)
+        self.probing.discard(name)
+
+    def record_failure(self, name):
+        self.failures[name] = self.failures.get(name, 0) + 1
+        half_open = name in self.probing
+        self.probing.discard(name)
+        if half_open or self.failures[name] >= self.failure_threshold:
+            if name not in self.open_until or half_open:
+                print(f"镜像源 {name} 连续失败 {self.failures[name]} 次，熔断 {self.cooldown} 秒")
+            self.open_until[name] = time.monotonic() + self.cooldown
+
+
+class HedgedFetcher:
+    """
+    按排名向镜像源发送请求：先请求排名最高的健康镜像源，
+    超过对冲延迟仍未收到响应头时，同时请求下一个镜像源，使用最先返回的响应；
+    请求失败（连接错误、超时、5xx）时立即转向下一个镜像源。
+    mirrors 为按排名排列的 [{name, url, latency_p90}, ...]。
+    """
+
+    def __init__(self, session, mirrors, hedge_delay=None, breaker=None):
+        self.session = session
+        self.mirrors = list(mirrors)
+        self.hedge_delay = hedge_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.stats = {"requests": 0, "hedged": 0, "failovers": 0, "wins": {}}
+
+    def delay_for(self, mirror):
+        """发出对冲请求前等待的时间（秒），默认按镜像源的延迟P90计算"""
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        p90 = mirror.get("latency_p90") or mirror.get("latency")
+        if p90 is None:
+            return DEFAULT_HEDGE_DELAY
+        return max(MIN_HEDGE_DELAY, p90 * HEDGE_P90_FACTOR / 1000)
+
+    async def get(self, url_for, prefer=None, **kwargs):
+        """
+        发送GET请求，url_for(镜像源) 返回该镜像源上的请求地址（返回None表示跳过该镜像源）。
+        prefer 为优先请求的镜像源名称（如按包路由选出的镜像源），其余镜像源仍按排名排在后面。
+        返回 (镜像源, 响应)，响应未读取，调用方负责释放；所有镜像源都失败时抛出最后一个错误。
+        """
+        self.stats["requests"] += 1
+        mirrors = self.mirrors
+        if prefer is not None:
+            mirrors = sorted(mirrors, key=lambda m: m["name"] != prefer)
+        candidates = [(m, url_for(m)) for m in mirrors]
+        candidates = [(m, url) for m, url in candidates if url is not None]
+        # 所有镜像源都已熔断时仍然按排名尝试，而不是直接失败
+        bypass = all(self.breaker.state(m["name"]) == "open" for m, _ in candidates)
+        queue = iter(candidates)
+        pending = {}
+        last_error = None
+
+        def launch():
+            for mirror, url in queue:
+                if not bypass and not self.breaker.allow(mirror["name"]):
+                    continue
+                task = asyncio.ensure_future(self.session.get(url, **kwargs))
+                pending[task] = mirror
+                return mirror
+            return None
+
+        current = launch()
+        try:
+            while pending:
+                timeout = self.delay_for(current) if current else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 超过对冲延迟仍未响应，同时请求下一个镜像源
+                    current = launch()
+                    if current:
+                        self.stats["hedged"] += 1
+                    continue
+                winner = None
+                for task in done:
+                    mirror = pending.pop(task)
+                    try:
+                        response = task.result()
+                    except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                        last_error = e
+                        self.breaker.record_failure(mirror["name"])
+                        continue
+                    if response.status >= 500:
+                        last_error = aiohttp.ClientResponseError(
+                            response.request_info, response.history, status=response.status,
+                            message=f"{mirror['name']} HTTP {response.status}")
+                        response.release()
+                        self.breaker.record_failure(mirror["name"])
+                        continue
+                    self.breaker.record_success(mirror["name"])
+                    if winner is None:
+                        winner = mirror, response
+                    else:
+                        response.release()
+                if winner:
+                    wins = self.stats["wins"]
+                    wins[winner[0]["name"]] = wins.get(winner[0]["name"], 0) + 1
+                    return winner
+                if not pending:
+                    current = launch()
+                    if current:
+                        self.stats["failovers"] += 1
+        finally:
+            for task, mirror in pending.items():
+                task.cancel()
+                self.breaker.release(mirror["name"])
+            if pending:
+                # 被取消前已完成的请求需要释放连接
+                results = await asyncio.gather(*pending, return_exceptions=True)
+                for result in results:
+                    if isinstance(result, aiohttp.ClientResponse):
+                        result.release()
+        raise last_error or NoMirrorAvailable("没有可用的镜像源")
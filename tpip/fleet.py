@@ -0,0 +1,315 @@
+# tpip/fleet.py
+# 多台主机共享测速结果：同一网段内由一台主机测速，其余主机直接使用它发布的排名
+#
+# 共享存储可以是共享文件系统上的一个JSON文件（写入时加文件锁），也可以是 tpip fleet 提供的HTTP服务。
+# 条目按 网段|测速作用域 索引；没有可用条目时，先取得测速租约的主机负责测速，其他主机等待它发布结果。
+
+import contextlib
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+from urllib.parse import quote, unquote
+
+from .cache import CACHE_VERSION, MAX_ENTRY_AGE, _write_json_atomic, get_cache_dir, url_id
+
+# 默认的共享存储位置，可被 --fleet 覆盖
+FLEET_ENV = "TPIP_FLEET"
+FLEET_FILE_NAME = "fleet.json"
+DEFAULT_FLEET_PORT = 3142
+# 测速租约的有效期（秒），持有者异常退出时租约到期后由其他主机接手
+LEASE_TTL = 120
+# 其他主机正在测速时，最多等待它发布结果的时间（秒）
+DEFAULT_FLEET_WAIT = 60
+# 等待期间查询共享存储的间隔（秒），每 LEASE_RETRY_POLLS 次查询重新申请一次租约（持有者失败退出时接手）
+POLL_INTERVAL = 0.5
+LEASE_RETRY_POLLS = 10
+# 访问HTTP共享存储的超时（秒）
+REQUEST_TIMEOUT = 5
+# HTTP共享存储接受的请求体上限（字节）
+MAX_BODY_SIZE = 1024 * 1024
+
+
+def get_holder():
+    """本进程的租约持有者标识: 主机名:进程号"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def fleet_key(segment, scope):
+    return f"{segment}|{scope}"
+
+
+def make_entry(mirrors, download_tested, host=None):
+    """
+    由排名后的 MirrorResult 列表生成共享条目。
+    每个镜像源保存 url_id、name、latency、latency_stats、speed、effective_speed、score、freshness、reuse。
+    """
+    results = []
+    for m in mirrors:
+        download = m.download or {}
+        results.append({"url_id": url_id(m.url), "name": m.name, "latency": m.latency_ms,
+                        "latency_stats": m.latency, "speed": m.speed,
+                        "effective_speed": download.get("effective_speed"), "score": m.score,
+                        "freshness": m.freshness, "reuse": m.reuse})
+    return {"host": host or socket.gethostname(), "timestamp": time.time(),
+            "download_tested": download_tested, "results": results}
+
+
+def shared_results(entry, mirrors, ttl, need_download=True, need_freshness=False):
+    """
+    从共享条目中取出 mirrors 中各镜像源的结果，格式与 get_cached_results 相同（另有 effective_speed 和 freshness）。
+    条目过期、缺少某个镜像源、需要而没有下载测试结果或同步状态时返回None。
+    """
+    if not isinstance(entry, dict) or ttl <= 0 or time.time() - entry.get("timestamp", 0) > ttl:
+        return None
+    if need_download and not entry.get("download_tested"):
+        return None
+    by_id = {r.get("url_id"): r for r in entry.get("results", []) if isinstance(r, dict)}
+    results = []
+    for name, url in mirrors.items():
+        result = by_id.get(url_id(url))
+        if result is None or (need_freshness and result.get("freshness") is None):
+            return None
+        results.append(dict(result, name=name, url=url, timestamp=entry["timestamp"]))
+    return results
+
+
+@contextlib.contextmanager
+def lock_file(path):
+    """在 path 旁的 .lock 文件上加排他锁（POSIX 记录锁可用于NFS，Windows 使用 msvcrt）"""
+    lock_path = path.with_name(path.name + ".lock")
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "a+") as f:
+        if sys.platform == "win32":
+            import msvcrt
+
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.lockf(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(f.fileno(), fcntl.LOCK_UN)
+
+
+class FileStore:
+    """
+    共享文件系统上的结果存储。写入在文件锁内读取-合并-原子替换，读取不加锁。
+    文件锁只在进程之间互斥，同一进程内的多个线程（tpip fleet 的请求线程）另用线程锁。
+    """
+
+    def __init__(self, path):
+        self.path = Path(path).expanduser()
+        self._thread_lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with self._thread_lock, lock_file(self.path):
+            yield
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            # 损坏的文件视为空存储，下次写入时覆盖
+            data = {}
+        if not isinstance(data, dict) or data.get("version") != CACHE_VERSION:
+            data = {}
+        return {"version": CACHE_VERSION, "entries": data.get("entries") or {}, "leases": data.get("leases") or {}}
+
+    def _save(self, data):
+        now = time.time()
+        data["entries"] = {key: entry for key, entry in data["entries"].items()
+                           if now - entry.get("timestamp", 0) <= MAX_ENTRY_AGE}
+        data["leases"] = {key: lease for key, lease in data["leases"].items() if lease.get("expires", 0) > now}
+        # 共享文件可能由不同用户读写，不使用临时文件的0600权限
+        _write_json_atomic(data, self.path, shared=True)
+
+    def get(self, key):
+        """读取共享条目，没有时返回None"""
+        return self._load()["entries"].get(key)
+
+    def put(self, key, entry, holder=None):
+        """写入共享条目，同时释放 holder 持有的该条目的测速租约"""
+        with self._locked():
+            data = self._load()
+            data["entries"][key] = entry
+            if holder and data["leases"].get(key, {}).get("holder") == holder:
+                del data["leases"][key]
+            self._save(data)
+
+    def acquire(self, key, holder, ttl=LEASE_TTL):
+        """
+        申请测速租约，返回 (是否获得, 租约)。租约为 {holder, expires}；
+        其他持有者的租约未过期时不获得，返回其租约；自己已持有时续期。
+        """
+        with self._locked():
+            data = self._load()
+            lease = data["leases"].get(key)
+            if lease and lease.get("holder") != holder and lease.get("expires", 0) > time.time():
+                return False, lease
+            lease = {"holder": holder, "expires": time.time() + ttl}
+            data["leases"][key] = lease
+            self._save(data)
+            return True, lease
+
+    def release(self, key, holder):
+        """释放 holder 持有的测速租约"""
+        with self._locked():
+            data = self._load()
+            if data["leases"].get(key, {}).get("holder") == holder:
+                del data["leases"][key]
+                self._save(data)
+
+
+class HttpStore:
+    """
+    tpip fleet 提供的HTTP结果存储，接口与 FileStore 相同:
+    GET/PUT /v1/entries/<key>，POST/DELETE /v1/leases/<key>，key 经过URL编码。
+    """
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+
+    def _request(self, method, path, body=None):
+        from urllib.error import HTTPError
+        from urllib.request import Request, urlopen
+
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        request = Request(f"{self.url}/v1/{path}", data=data, method=method,
+                          headers={"Content-Type": "application/json"})
+        try:
+            with urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+                payload = response.read()
+        except HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+        return json.loads(payload) if payload else None
+
+    def get(self, key):
+        return self._request("GET", f"entries/{quote(key, safe='')}")
+
+    def put(self, key, entry, holder=None):
+        self._request("PUT", f"entries/{quote(key, safe='')}", {"entry": entry, "holder": holder})
+
+    def acquire(self, key, holder, ttl=LEASE_TTL):
+        reply = self._request("POST", f"leases/{quote(key, safe='')}", {"holder": holder, "ttl": ttl})
+        return bool(reply["granted"]), reply["lease"]
+
+    def release(self, key, holder):
+        self._request("DELETE", f"leases/{quote(key, safe='')}", {"holder": holder})
+
+
+def open_store(location):
+    """按位置打开共享存储：http(s):// 开头为 tpip fleet 服务，否则为共享文件路径"""
+    if location.startswith(("http://", "https://")):
+        return HttpStore(location)
+    return FileStore(location)
+
+
+def get_fleet_path():
+    return get_cache_dir() / FLEET_FILE_NAME
+
+
+def make_handler(store):
+    """生成 tpip fleet 的请求处理类，请求转发给 store（FileStore）"""
+    from http.server import BaseHTTPRequestHandler
+
+    class FleetHandler(BaseHTTPRequestHandler):
+        server_version = "tpip-fleet"
+
+        def _route(self):
+            parts = self.path.split("?", 1)[0].strip("/").split("/")
+            if len(parts) != 3 or parts[0] != "v1" or parts[1] not in ("entries", "leases"):
+                return None, None
+            return parts[1], unquote(parts[2])
+
+        def _body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > MAX_BODY_SIZE:
+                raise ValueError("请求体过大")
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(body, dict):
+                raise ValueError("请求体不是JSON对象")
+            return body
+
+        def _reply(self, status, payload=None):
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else b""
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _handle(self, method):
+            kind, key = self._route()
+            if kind is None:
+                return self._reply(404, {"error": "not found"})
+            try:
+                if (kind, method) == ("entries", "GET"):
+                    entry = store.get(key)
+                    return self._reply(200, entry) if entry is not None else self._reply(404, {"error": "not found"})
+                body = self._body()
+                if (kind, method) == ("entries", "PUT"):
+                    if not isinstance(body.get("entry"), dict):
+                        raise ValueError("缺少 entry")
+                    store.put(key, body["entry"], body.get("holder"))
+                    return self._reply(200, {})
+                if (kind, method) == ("leases", "POST"):
+                    ttl = min(float(body.get("ttl") or LEASE_TTL), LEASE_TTL * 10)
+                    granted, lease = store.acquire(key, str(body["holder"]), ttl)
+                    return self._reply(200, {"granted": granted, "lease": lease})
+                if (kind, method) == ("leases", "DELETE"):
+                    store.release(key, str(body.get("holder")))
+                    return self._reply(200, {})
+            except (KeyError, TypeError, ValueError) as e:
+                return self._reply(400, {"error": str(e)})
+            except OSError as e:
+                return self._reply(500, {"error": str(e)})
+            return self._reply(405, {"error": "method not allowed"})
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_PUT(self):
+            self._handle("PUT")
+
+        def do_POST(self):
+            self._handle("POST")
+
+        def do_DELETE(self):
+            self._handle("DELETE")
+
+        def log_message(self, format, *args):
+            # 等待中的主机每秒查询一次，只记录写入和租约请求
+            if self.command != "GET":
+                super().log_message(format, *args)
+
+    return FleetHandler
+
+
+def make_server(path=None, host="127.0.0.1", port=DEFAULT_FLEET_PORT):
+    """创建共享存储HTTP服务（尚未开始处理请求），数据保存在 path（默认为tpip缓存目录下的 fleet.json）"""
+    from http.server import HTTPServer
+    from socketserver import ThreadingMixIn
+
+    class FleetServer(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    store = FileStore(path or get_fleet_path())
+    server = FleetServer((host, port), make_handler(store))
+    server.store = store
+    return server
@@ -0,0 +1,194 @@
+# tpip/freshness.py
+# 镜像源同步延迟检测：比较各镜像源上一组常更新的包的最新版本和同步序号，估计镜像源落后于PyPI的时间
+
+import json
+import time
+from datetime import datetime
+from pathlib import Path
+
+from .cache import CACHE_VERSION, DEFAULT_CACHE_TTL, _write_json_atomic, get_cache_dir
+from .index import INDEX_ACCEPT, iter_index_files, iter_index_files_sync
+from .tags import file_version
+from .versions import parse_version, version_key
+
+# 发布频繁、索引页不大的包，用于检测同步延迟（boto3 几乎每个工作日都有新版本）
+FRESHNESS_PACKAGES = ["boto3", "pip", "certifi", "urllib3", "packaging"]
+# 作为比较基准的镜像源（PyPI 官方源）
+REFERENCE_MIRROR = "default"
+# 落后该时间（小时）的镜像源得分减半
+DEFAULT_LAG_HALF_LIFE = 6.0
+FRESHNESS_FILE_NAME = "freshness.json"
+
+
+def get_freshness_path():
+    return get_cache_dir() / FRESHNESS_FILE_NAME
+
+
+def _parse_time(value):
+    """解析 PEP 700 的 upload-time（ISO 8601），返回时间戳"""
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+def make_snapshot(files, serial, package):
+    """
+    由索引页的文件列表生成快照: {latest, serial, uploads}。
+    latest 为未撤回、版本号符合 PEP 440 的文件中的最高版本；uploads 为 {版本: 最早上传时间戳}，只有提供了 upload-time 的索引（如PyPI的JSON索引）才有。
+    """
+    latest = None
+    uploads = {}
+    for f in files:
+        version = file_version(f["filename"], package)
+        if not version or f["yanked"] or parse_version(version) is None:
+            continue
+        if latest is None or version_key(version) > version_key(latest):
+            latest = version
+        uploaded = _parse_time(f.get("upload_time"))
+        if uploaded is not None and uploaded < uploads.get(version, float("inf")):
+            uploads[version] = uploaded
+    return {"latest": latest, "serial": serial, "uploads": uploads, "timestamp": time.time()}
+
+
+async def fetch_snapshot_async(session, url, package, user_agent=None):
+    """异步获取镜像源上一个包的快照，失败时返回 {"error": 错误信息}"""
+    headers = {"Accept": INDEX_ACCEPT}
+    if user_agent:
+        headers["User-Agent"] = user_agent
+    try:
+        async with session.get(f"{url}/{package}/", headers=headers, timeout=15) as response:
+            if response.status != 200:
+                return {"error": f"HTTP {response.status}"}
+            stats = {}
+            files = [f async for f in iter_index_files(response, str(response.url), stats)]
+    except Exception as e:
+        return {"error": str(e) or type(e).__name__}
+    return make_snapshot(files, stats.get("serial"), package)
+
+
+def fetch_snapshot_sync(session, url, package, user_agent=None):
+    """fetch_snapshot_async 的同步版本，session 为 requests.Session"""
+    headers = {"Accept": INDEX_ACCEPT}
+    if user_agent:
+        headers["User-Agent"] = user_agent
+    try:
+        with session.get(f"{url}/{package}/", headers=headers, timeout=15, stream=True) as response:
+            if response.status_code != 200:
+                return {"error": f"HTTP {response.status_code}"}
+            stats = {}
+            files = list(iter_index_files_sync(response, response.url, stats))
+    except Exception as e:
+        return {"error": str(e) or type(e).__name__}
+    return make_snapshot(files, stats.get("serial"), package)
+
+
+def load_snapshots(ttl=DEFAULT_CACHE_TTL, path=None):
+    """读取未过期的快照缓存，返回 {(镜像源地址, 包名): 快照}"""
+    path = Path(path) if path else get_freshness_path()
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get("version") != CACHE_VERSION or not isinstance(data.get("snapshots"), dict):
+        return {}
+    now = time.time()
+    snapshots = {}
+    for key, snapshot in data["snapshots"].items():
+        url, _, package = key.rpartition("|")
+        if now - snapshot.get("timestamp", 0) <= ttl:
+            snapshots[(url, package)] = snapshot
+    return snapshots
+
+
+def store_snapshots(snapshots, ttl=DEFAULT_CACHE_TTL, path=None):
+    """保存快照缓存，失败的快照不缓存，过期的条目在写入时被清理"""
+    merged = load_snapshots(ttl, path)
+    merged.update((key, s) for key, s in snapshots.items() if "error" not in s)
+    data = {"version": CACHE_VERSION, "snapshots": {f"{url}|{package}": s for (url, package), s in merged.items()}}
+    try:
+        _write_json_atomic(data, Path(path) if path else get_freshness_path())
+    except OSError as e:
+        print(f"写入同步延迟缓存失败: {e}")
+
+
+def missing_pairs(mirrors, packages, cached):
+    """需要重新获取快照的 (名称, 地址, 包名) 列表"""
+    return [(name, url, package) for name, url in mirrors.items() for package in packages
+            if (url, package) not in cached]
+
+
+def compare_mirrors(mirrors, packages, snapshots, half_life=DEFAULT_LAG_HALF_LIFE, now=None):
+    """
+    比较各镜像源的快照，返回 {名称: 同步状态}。
+    基准版本为所有镜像源（包括PyPI官方源）中的最高版本，基准序号优先使用 REFERENCE_MIRROR 的序号；
+    镜像源缺少基准版本时，落后时间为它缺少的最早版本的上传时间到现在的时长。
+    同步状态: checked（成功比较的包数）、behind（落后的包数）、lag_s（最大落后秒数，落后但无法估计时为None）、
+    serial_lag（最大序号差）、factor（得分系数 1 / (1 + 落后小时数 / half_life)）、errors。
+    """
+    now = now or time.time()
+    references = {}
+    for package in packages:
+        package_snapshots = [snapshots.get((url, package)) or {} for url in mirrors.values()]
+        valid = [s for s in package_snapshots if s.get("latest")]
+        if not valid:
+            continue
+        uploads = {}
+        for s in valid:
+            for version, uploaded in s.get("uploads", {}).items():
+                uploads[version] = min(uploaded, uploads.get(version, uploaded))
+        reference = snapshots.get((mirrors.get(REFERENCE_MIRROR), package)) or {}
+        serials = [s["serial"] for s in valid if s.get("serial") is not None]
+        references[package] = {
+            "latest": max((s["latest"] for s in valid), key=version_key),
+            "serial": reference.get("serial") or (max(serials) if serials else None),
+            "uploads": uploads,
+        }
+
+    status = {}
+    for name, url in mirrors.items():
+        checked, behind, lags, serial_lags, errors = 0, 0, [], [], []
+        for package, reference in references.items():
+            snapshot = snapshots.get((url, package)) or {}
+            if not snapshot.get("latest"):
+                errors.append(f"{package}: {snapshot.get('error', '没有可用的版本')}")
+                continue
+            checked += 1
+            if reference["serial"] is not None and snapshot.get("serial") is not None:
+                serial_lags.append(max(reference["serial"] - snapshot["serial"], 0))
+            if version_key(snapshot["latest"]) >= version_key(reference["latest"]):
+                continue
+            behind += 1
+            missing = [t for v, t in reference["uploads"].items()
+                       if version_key(v) > version_key(snapshot["latest"])]
+            if missing:
+                lags.append(max(now - min(missing), 0.0))
+        # 部分落后的包没有上传时间时，以能估计的最大落后时间作为下限
+        lag_s = max(lags) if lags else (None if behind else 0.0)
+        if lag_s is not None:
+            factor = 1 / (1 + lag_s / 3600 / half_life)
+        else:
+            # 落后但没有上传时间可用时，按落后的包的比例降低得分
+            factor = 1 - 0.5 * behind / checked
+        status[name] = {
+            "checked": checked,
+            "behind": behind,
+            "lag_s": round(lag_s, 1) if lag_s is not None else None,
+            "serial_lag": max(serial_lags) if serial_lags else None,
+            "factor": round(factor, 4) if checked else 1.0,
+            "errors": errors,
+        }
+    return status
+
+
+def format_lag(freshness):
+    """同步状态的简短描述，用于表格显示"""
+    if not freshness or not freshness["checked"]:
+        return "-"
+    if not freshness["behind"]:
+        return "最新"
+    if freshness["lag_s"] is None:
+        return f"落后 {freshness['behind']}/{freshness['checked']} 个包"
+    hours = freshness["lag_s"] / 3600
+    return f"落后 {hours:.1f} 小时" if hours >= 1 else f"落后 {freshness['lag_s'] / 60:.0f} 分钟"
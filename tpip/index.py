@@ -0,0 +1,180 @@
+# tpip/index.py
+# 解析镜像源的 simple 索引页（PEP 503 HTML / PEP 691 JSON）
+
+import codecs
+import json
+import re
+from html.parser import HTMLParser
+from urllib.parse import urldefrag, urljoin
+
+JSON_CONTENT_TYPE = "application/vnd.pypi.simple.v1+json"
+# 优先请求JSON格式，不支持PEP 691的镜像源会返回HTML
+INDEX_ACCEPT = (f"{JSON_CONTENT_TYPE}, application/vnd.pypi.simple.v1+html;q=0.2, "
+                "text/html;q=0.01")
+
+# 流式解析HTML索引页时每次读取的字节数
+INDEX_READ_SIZE = 64 * 1024
+# PyPI 和 bandersnatch 镜像源在响应头中返回项目的最新同步序号，HTML索引页末尾也有 <!--SERIAL n--> 注释
+SERIAL_HEADER = "X-PyPI-Last-Serial"
+_SERIAL_COMMENT = re.compile(r"^\s*SERIAL\s+(\d+)\s*$")
+
+
+def _make_file(filename, url, hashes=None, size=None, requires_python=None, yanked=False, upload_time=None):
+    return {
+        "filename": filename,
+        "url": url,
+        "hashes": hashes or {},
+        "size": size,
+        "requires_python": requires_python,
+        "yanked": yanked,
+        "upload_time": upload_time,
+    }
+
+
+def _split_hash(url):
+    """从URL片段中提取哈希值，如 #sha256=..."""
+    url, fragment = urldefrag(url)
+    hashes = {}
+    if "=" in fragment:
+        name, value = fragment.split("=", 1)
+        hashes[name] = value
+    return url, hashes
+
+
+class AnchorParser(HTMLParser):
+    """增量解析PEP 503 HTML索引页中的文件链接，可多次调用 feed()"""
+
+    def __init__(self, base_url):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.files = []
+        self.serial = None
+        self._anchor = None
+        self._text = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "base":
+            href = dict(attrs).get("href")
+            if href:
+                self.base_url = urljoin(self.base_url, href)
+        elif tag == "a":
+            self._anchor = dict(attrs)
+            self._text = []
+
+    def handle_data(self, data):
+        if self._anchor is not None:
+            self._text.append(data)
+
+    def handle_comment(self, data):
+        match = _SERIAL_COMMENT.match(data)
+        if match:
+            self.serial = int(match.group(1))
+
+    def handle_endtag(self, tag):
+        if tag != "a" or self._anchor is None:
+            return
+        attrs, self._anchor = self._anchor, None
+        href = attrs.get("href")
+        if not href:
+            return
+        url, hashes = _split_hash(urljoin(self.base_url, href))
+        filename = "".join(self._text).strip() or url.rsplit("/", 1)[-1]
+        self.files.append(_make_file(filename, url, hashes,
+                                     requires_python=attrs.get("data-requires-python"),
+                                     yanked="data-yanked" in attrs))
+
+    def pop_files(self):
+        files, self.files = self.files, []
+        return files
+
+
+def parse_json_index(data, base_url, stats=None):
+    """解析PEP 691 JSON索引，返回文件列表；stats 不为None时写入 meta 中的 _last-serial"""
+    if isinstance(data, (bytes, str)):
+        data = json.loads(data)
+    if stats is not None and data.get("meta", {}).get("_last-serial") is not None:
+        stats["serial"] = int(data["meta"]["_last-serial"])
+    files = []
+    for item in data.get("files", []):
+        url = urljoin(base_url, item["url"])
+        yanked = item.get("yanked", False)
+        files.append(_make_file(item["filename"], url, item.get("hashes"),
+                                size=item.get("size"),
+                                requires_python=item.get("requires-python"),
+                                yanked=bool(yanked),
+                                upload_time=item.get("upload-time")))
+    return files
+
+
+def _header_serial(response):
+    value = response.headers.get(SERIAL_HEADER, "")
+    return int(value) if value.strip().isdigit() else None
+
+
+def is_json_response(response):
+    return response.headers.get("Content-Type", "").split(";")[0].strip() == JSON_CONTENT_TYPE
+
+
+async def iter_index_files(response, base_url, stats=None):
+    """
+    异步逐个产出索引页中的文件。
+    HTML索引页边下载边解析，JSON索引需完整读取后解析。索引页按上传时间从旧到新列出文件，
+    调用方需要迭代完整个索引页，再按pip的规则（见 tags.select_package_file）选出会被安装的文件。
+    stats 字典中会累计 bytes（读取字节数）和 format（索引格式），镜像源提供同步序号时写入 serial：
+    响应头中的序号在开始迭代时写入，HTML注释中的序号在迭代结束后才写入。
+    """
+    if stats is None:
+        stats = {}
+    stats.setdefault("bytes", 0)
+    stats["serial"] = _header_serial(response)
+    if is_json_response(response):
+        stats["format"] = "json"
+        body = await response.read()
+        stats["bytes"] += len(body)
+        for item in parse_json_index(body, base_url, stats):
+            yield item
+        return
+
+    stats["format"] = "html"
+    parser = AnchorParser(base_url)
+    # 增量解码，避免多字节字符被数据块边界截断
+    decoder = codecs.getincrementaldecoder(response.charset or "utf-8")(errors="replace")
+    async for chunk in response.content.iter_chunked(INDEX_READ_SIZE):
+        stats["bytes"] += len(chunk)
+        parser.feed(decoder.decode(chunk))
+        for item in parser.pop_files():
+            yield item
+    parser.feed(decoder.decode(b"", final=True))
+    parser.close()
+    stats["serial"] = stats["serial"] or parser.serial
+    for item in parser.pop_files():
+        yield item
+
+
+def iter_index_files_sync(response, base_url, stats=None):
+    """iter_index_files 的同步版本，response 为 requests 以 stream=True 发出的请求的响应"""
+    if stats is None:
+        stats = {}
+    stats.setdefault("bytes", 0)
+    stats["serial"] = _header_serial(response)
+    if is_json_response(response):
+        stats["format"] = "json"
+        body = response.content
+        stats["bytes"] += len(body)
+        yield from parse_json_index(body, base_url, stats)
+        return
+
+    stats["format"] = "html"
+    parser = AnchorParser(base_url)
+    # requests对未声明编码的text/html默认使用ISO-8859-1，这里与aiohttp一样按声明的编码或UTF-8解码
+    params = response.headers.get("Content-Type", "").split(";")[1:]
+    charset = next((p.split("=", 1)[1].strip(' "') for p in params if p.strip().lower().startswith("charset=")), None)
+    decoder = codecs.getincrementaldecoder(charset or "utf-8")(errors="replace")
+    for chunk in response.iter_content(INDEX_READ_SIZE):
+        stats["bytes"] += len(chunk)
+        parser.feed(decoder.decode(chunk))
+        yield from parser.pop_files()
+    parser.feed(decoder.decode(b"", final=True))
+    parser.close()
+    stats["serial"] = stats["serial"] or parser.serial
+    yield from parser.pop_files()
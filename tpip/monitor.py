@@ -0,0 +1,276 @@
+# tpip/monitor.py
+# tpip monitor：周期性探测镜像源，维护滚动统计（EWMA）和定长的磁盘时间序列，并在满足迟滞条件时切换镜像源
+
+import asyncio
+import json
+import struct
+import time
+from pathlib import Path
+
+from .cache import get_cache_dir, save_cache
+from .stats import median, percentile
+
+DEFAULT_INTERVAL = 60
+# EWMA的平滑系数，越大越重视最近的探测结果
+DEFAULT_ALPHA = 0.3
+# 新镜像源的得分需要超过当前镜像源的比例
+DEFAULT_MARGIN = 0.2
+# 新镜像源需要连续多少轮保持领先才切换
+DEFAULT_CONFIRMATIONS = 3
+# 时间序列最多保存的探测记录数，写满后覆盖最旧的记录
+DEFAULT_RING_SIZE = 10080
+
+RING_FILE_NAME = "monitor.ring"
+STATE_FILE_NAME = "monitor.json"
+RING_MAGIC = b"TPRB"
+RING_VERSION = 1
+# 文件头：魔数, 版本, 保留, 容量, 已写入的记录总数
+RING_HEADER = struct.Struct("<4sHHIQ")
+# 记录：时间戳, 镜像源编号, 标志, 延迟(ms), 吞吐量(MB/s)
+RING_RECORD = struct.Struct("<dHHff")
+FLAG_OK = 1
+FLAG_THROUGHPUT = 2
+
+
+class RingStore:
+    """
+    定长记录的磁盘环形缓冲区，文件大小固定为 文件头 + 容量 × 记录长度。
+    capacity 为None时沿用已有文件的容量；与已有文件的容量不同时重建文件。
+    """
+
+    def __init__(self, path, capacity=DEFAULT_RING_SIZE):
+        self.path = Path(path)
+        self.capacity = capacity
+        self.written = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = None
+        self._open()
+
+    def _open(self):
+        if self.path.exists():
+            f = open(self.path, "r+b")
+            header = f.read(RING_HEADER.size)
+            if len(header) == RING_HEADER.size:
+                magic, version, _, capacity, written = RING_HEADER.unpack(header)
+                if magic == RING_MAGIC and version == RING_VERSION and self.capacity in (None, capacity):
+                    self._file, self.written, self.capacity = f, written, capacity
+                    return
+            # 格式或容量不同的旧文件直接重建
+            f.close()
+        self.capacity = self.capacity or DEFAULT_RING_SIZE
+        self._file = open(self.path, "w+b")
+        self._write_header()
+
+    def _write_header(self):
+        self._file.seek(0)
+        self._file.write(RING_HEADER.pack(RING_MAGIC, RING_VERSION, 0, self.capacity, self.written))
+
+    def append(self, records):
+        """追加 (时间戳, 镜像源编号, 标志, 延迟, 吞吐量) 记录"""
+        for record in records:
+            self._file.seek(RING_HEADER.size + (self.written % self.capacity) * RING_RECORD.size)
+            self._file.write(RING_RECORD.pack(*record))
+            self.written += 1
+        self._write_header()
+        self._file.flush()
+
+    def read(self, since=None):
+        """按时间顺序返回缓冲区中的记录，since 指定时只返回该时间戳之后的记录"""
+        count = min(self.written, self.capacity)
+        start = self.written - count
+        self._file.seek(RING_HEADER.size)
+        data = self._file.read(self.capacity * RING_RECORD.size)
+        records = []
+        for i in range(start, self.written):
+            offset = (i % self.capacity) * RING_RECORD.size
+            record = RING_RECORD.unpack_from(data, offset)
+            if since is None or record[0] >= since:
+                records.append(record)
+        return records
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+def update_ewma(stats, latency, throughput, ok, alpha=DEFAULT_ALPHA):
+    """用一次探测结果更新镜像源的EWMA统计（延迟、吞吐量、错误率）"""
+    def ewma(old, new):
+        return new if old is None else alpha * new + (1 - alpha) * old
+
+    stats["error_rate"] = ewma(stats.get("error_rate"), 0.0 if ok else 1.0)
+    if latency is not None:
+        stats["latency"] = ewma(stats.get("latency"), latency)
+    if throughput is not None:
+        stats["throughput"] = ewma(stats.get("throughput"), throughput)
+    stats["samples"] = stats.get("samples", 0) + 1
+    stats["updated"] = time.time()
+    return stats
+
+
+def mirror_scores(stats):
+    """
+    计算各镜像源的得分（越大越好）：所有镜像源都有吞吐量时按吞吐量，否则按延迟的倒数，
+    再乘以成功率。没有成功探测过的镜像源不参与比较。
+    """
+    usable = {name: s for name, s in stats.items() if s.get("latency") is not None}
+    use_throughput = usable and all(s.get("throughput") for s in usable.values())
+    scores = {}
+    for name, s in usable.items():
+        base = s["throughput"] if use_throughput else 1000 / max(s["latency"], 0.001)
+        scores[name] = base * (1 - s.get("error_rate", 0))
+    return scores
+
+
+class SwitchPolicy:
+    """
+    带迟滞的镜像源切换策略：候选镜像源的得分需要比当前镜像源高出 margin，
+    并且连续 confirmations 轮保持领先才切换，避免在相近的镜像源之间来回切换。
+    """
+
+    def __init__(self, margin=DEFAULT_MARGIN, confirmations=DEFAULT_CONFIRMATIONS):
+        self.margin = margin
+        self.confirmations = confirmations
+        self.candidate = None
+        self.streak = 0
+
+    def observe(self, current, scores):
+        """输入本轮得分，需要切换时返回新镜像源名称，否则返回None"""
+        if not scores:
+            return None
+        best = max(scores, key=scores.get)
+        current_score = scores.get(current, 0)
+        if best == current or scores[best] <= current_score * (1 + self.margin):
+            self.candidate, self.streak = None, 0
+            return None
+        if best == self.candidate:
+            self.streak += 1
+        else:
+            self.candidate, self.streak = best, 1
+        if self.streak >= self.confirmations:
+            self.candidate, self.streak = None, 0
+            return best
+        return None
+
+
+def load_state(path=None):
+    """读取监控状态（EWMA统计、镜像源编号、当前镜像源）"""
+    path = Path(path) if path else get_cache_dir() / STATE_FILE_NAME
+    try:
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+        if isinstance(state.get("mirrors"), dict):
+            return state
+    except (OSError, ValueError):
+        pass
+    return {"mirrors": {}, "ids": {}, "current": None}
+
+
+def summarize(store, ids, window):
+    """汇总最近 window 秒的时间序列：每个镜像源的探测次数、错误率、延迟 P50/P90 和吞吐量中位数"""
+    names = {i: name for name, i in ids.items()}
+    grouped = {}
+    for timestamp, mirror_id, flags, latency, throughput in store.read(since=time.time() - window):
+        entry = grouped.setdefault(names.get(mirror_id, str(mirror_id)),
+                                   {"probes": 0, "errors": 0, "latencies": [], "throughputs": []})
+        entry["probes"] += 1
+        if not flags & FLAG_OK:
+            entry["errors"] += 1
+            continue
+        entry["latencies"].append(latency)
+        if flags & FLAG_THROUGHPUT:
+            entry["throughputs"].append(throughput)
+    summary = {}
+    for name, entry in grouped.items():
+        summary[name] = {
+            "probes": entry["probes"],
+            "error_rate": entry["errors"] / entry["probes"],
+            "latency_p50": median(entry["latencies"]),
+            "latency_p90": percentile(entry["latencies"], 90),
+            "throughput": median(entry["throughputs"]),
+        }
+    return summary
+
+
+async def monitor_loop(mirrors, probe, interval=DEFAULT_INTERVAL, count=0, alpha=DEFAULT_ALPHA,
+                       policy=None, on_switch=None, ring_size=DEFAULT_RING_SIZE, directory=None, current=None):
+    """
+    周期性探测 mirrors（{名称: 地址}）中的所有镜像源。
+    probe(名称, 地址) 为协程，返回 (延迟ms, 吞吐量MB/s, 错误信息)，失败时延迟为None。
+    每轮探测后更新EWMA统计、写入时间序列，并按 policy 判断是否需要调用 on_switch(新镜像源名称)，
+    on_switch 返回True时才把新镜像源记为当前镜像源，切换失败时保持不变。
+    count 为0时一直运行；current 为当前使用的镜像源，未指定时沿用上次监控的结果。
+    """
+    directory = Path(directory) if directory else get_cache_dir()
+    state_path = directory / STATE_FILE_NAME
+    state = load_state(state_path)
+    if current is not None:
+        state["current"] = current
+    policy = policy or SwitchPolicy()
+    store = RingStore(directory / RING_FILE_NAME, ring_size)
+    ids = state["ids"]
+    for name in mirrors:
+        ids.setdefault(name, max(ids.values(), default=-1) + 1)
+
+    rounds = 0
+    try:
+        while True:
+            started = time.monotonic()
+            results = await asyncio.gather(*(probe(name, url) for name, url in mirrors.items()))
+            now = time.time()
+            records = []
+            for (name, _), (latency, throughput, error) in zip(mirrors.items(), results):
+                ok = latency is not None
+                update_ewma(state["mirrors"].setdefault(name, {}), latency, throughput, ok, alpha)
+                flags = (FLAG_OK if ok else 0) | (FLAG_THROUGHPUT if throughput is not None else 0)
+                records.append((now, ids[name], flags, latency or 0.0, throughput or 0.0))
+            store.append(records)
+
+            scores = mirror_scores({name: state["mirrors"][name] for name in mirrors})
+            print_round(state, scores, mirrors)
+            switch_to = policy.observe(state["current"], scores)
+            if switch_to:
+                print(f"{switch_to} 已连续 {policy.confirmations} 轮领先当前镜像源 "
+                      f"{state['current'] or '(无)'} 超过 {round(policy.margin * 100)}%，切换镜像源")
+                if on_switch is None or on_switch(switch_to):
+                    state["current"] = switch_to
+                else:
+                    print(f"切换到 {switch_to} 失败，继续使用 {state['current'] or '(无)'}")
+            save_cache(state, state_path)
+
+            rounds += 1
+            if count and rounds >= count:
+                return state
+            await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
+    finally:
+        store.close()
+
+
+def print_round(state, scores, mirrors):
+    """每轮探测后打印一行各镜像源的EWMA统计"""
+    parts = []
+    for name in sorted(mirrors, key=lambda n: -scores.get(n, -1)):
+        s = state["mirrors"].get(name, {})
+        if s.get("latency") is None:
+            parts.append(f"{name}: 失败")
+            continue
+        text = f"{name}: {s['latency']:.0f}ms"
+        if s.get("throughput"):
+            text += f" {s['throughput']:.2f}MB/s"
+        if s.get("error_rate"):
+            text += f" 错误{s['error_rate'] * 100:.0f}%"
+        parts.append(("*" if name == state["current"] else "") + text)
+    print(f"[{time.strftime('%H:%M:%S')}] " + " | ".join(parts))
+
+
+def load_summary(window, directory=None):
+    """读取磁盘上的时间序列并汇总最近 window 秒的数据，没有监控数据时返回空字典"""
+    directory = Path(directory) if directory else get_cache_dir()
+    if not (directory / RING_FILE_NAME).exists():
+        return {}
+    store = RingStore(directory / RING_FILE_NAME, capacity=None)
+    try:
+        return summarize(store, load_state(directory / STATE_FILE_NAME)["ids"], window)
+    finally:
+        store.close()
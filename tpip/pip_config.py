@@ -0,0 +1,178 @@
+# tpip/pip_config.py
+# 直接读写pip配置文件，避免多次启动 `pip config` 子进程
+
+import configparser
+import os
+import sys
+import tempfile
+from pathlib import Path
+from urllib.parse import urlparse
+
+WINDOWS = sys.platform.startswith("win")
+CONFIG_BASENAME = "pip.ini" if WINDOWS else "pip.conf"
+CONFIG_SECTION = "global"
+
+# auto 与 `pip config set` 不带参数时的行为一致：虚拟环境中已有配置文件时写入 site，否则写入 user；
+# 设置了 PIP_CONFIG_FILE 时 auto 和 user 都写入该文件
+SCOPES = ("auto", "user", "global", "site", "virtualenv")
+
+# tpip 管理的配置项
+MANAGED_KEYS = ("index-url", "trusted-host", "extra-index-url")
+# pip 最后加载该环境变量指定的配置文件，该文件存在时不再加载用户配置文件
+CONFIG_FILE_ENV = "PIP_CONFIG_FILE"
+
+
+def _user_config_dir():
+    """与pip相同的用户配置目录"""
+    if WINDOWS:
+        return Path(os.environ.get("APPDATA") or os.path.expanduser("~")) / "pip"
+    if sys.platform == "darwin":
+        path = Path.home() / "Library" / "Application Support" / "pip"
+        if path.is_dir():
+            return path
+    return Path(os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config")) / "pip"
+
+
+def _site_config_dirs():
+    """与pip相同的全局配置目录列表（按加载顺序）"""
+    if WINDOWS:
+        return [Path(os.environ.get("ALLUSERSPROFILE") or "C:\\ProgramData") / "pip"]
+    if sys.platform == "darwin":
+        return [Path("/Library/Application Support/pip")]
+    xdg_dirs = os.environ.get("XDG_CONFIG_DIRS") or "/etc/xdg"
+    return [Path(d) / "pip" for d in xdg_dirs.split(os.pathsep) if d] + [Path("/etc")]
+
+
+def in_virtualenv():
+    """检查当前是否运行在虚拟环境中"""
+    return sys.prefix != getattr(sys, "base_prefix", sys.prefix) or hasattr(sys, "real_prefix")
+
+
+def get_config_files():
+    """按pip的加载顺序返回各作用域的配置文件列表"""
+    if WINDOWS:
+        legacy_user = Path(os.environ.get("APPDATA") or os.path.expanduser("~")) / "pip" / CONFIG_BASENAME
+    else:
+        legacy_user = Path.home() / ".pip" / CONFIG_BASENAME
+    return {
+        "global": [d / CONFIG_BASENAME for d in _site_config_dirs()],
+        "user": [legacy_user, _user_config_dir() / CONFIG_BASENAME],
+        "site": [Path(sys.prefix) / CONFIG_BASENAME],
+    }
+
+
+def get_config_file(scope="auto"):
+    """
+    获取指定作用域下应写入的配置文件（与pip一样取该作用域的最后一个文件）。
+    设置了 PIP_CONFIG_FILE 时 auto 和 user 作用域使用该文件：pip 最后加载它，且它存在时不读取用户配置文件。
+    """
+    env_file = os.environ.get(CONFIG_FILE_ENV)
+    if env_file and scope in ("auto", "user"):
+        if env_file == os.devnull:
+            raise ValueError(f"{CONFIG_FILE_ENV} 为 {os.devnull}，pip 不会读取任何配置文件")
+        return Path(env_file)
+    files = get_config_files()
+    if scope == "auto":
+        scope = "site" if any(f.exists() for f in files["site"]) else "user"
+    elif scope == "virtualenv":
+        if not in_virtualenv():
+            raise ValueError("当前不在虚拟环境中，无法使用 virtualenv 作用域")
+        scope = "site"
+    if scope not in files:
+        raise ValueError(f"未知的配置作用域: {scope}")
+    return files[scope][-1]
+
+
+def _write_atomic(path, parser):
+    """先写入同目录下的临时文件再重命名，保证配置文件不会被写坏"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            parser.write(f)
+        if path.exists():
+            os.chmod(tmp_path, path.stat().st_mode & 0o777)
+        else:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _load(path):
+    parser = configparser.RawConfigParser()
+    if path.exists():
+        parser.read(path, encoding="utf-8")
+    return parser
+
+
+def _remove_key(parser, key):
+    # pip 读取配置时将 "_" 视为 "-"，删除时两种写法都要处理
+    for variant in {key, key.replace("-", "_")}:
+        parser.remove_option(CONFIG_SECTION, variant)
+
+
+def update_config(path, values, remove=()):
+    """
+    一次性更新配置文件的 [global] 段。
+    values 中值为列表的配置项以多行形式写入；remove 中的配置项会被删除。
+    """
+    parser = _load(path)
+    if not parser.has_section(CONFIG_SECTION):
+        parser.add_section(CONFIG_SECTION)
+    for key in remove:
+        _remove_key(parser, key)
+    for key, value in values.items():
+        _remove_key(parser, key)
+        if isinstance(value, (list, tuple)):
+            value = "\n".join(value)
+        parser.set(CONFIG_SECTION, key, value)
+    if not parser.items(CONFIG_SECTION):
+        parser.remove_section(CONFIG_SECTION)
+    _write_atomic(path, parser)
+
+
+def trusted_host(url):
+    """地址对应的 trusted-host 值: 主机名加可选的端口，不包含地址中的用户名和密码"""
+    parts = urlparse(url)
+    host = parts.hostname or ""
+    if host and ":" in host:
+        host = f"[{host}]"
+    return f"{host}:{parts.port}" if host and parts.port else host
+
+
+def set_index(index_url, extra_index_urls=(), scope="auto"):
+    """设置 index-url、trusted-host 以及可选的 extra-index-url，返回写入的配置文件路径"""
+    path = get_config_file(scope)
+    hosts = []
+    for url in [index_url, *extra_index_urls]:
+        host = trusted_host(url)
+        if host and host not in hosts:
+            hosts.append(host)
+    values = {"index-url": index_url, "trusted-host": hosts}
+    if extra_index_urls:
+        values["extra-index-url"] = list(extra_index_urls)
+    update_config(path, values)
+    return path
+
+
+def get_index(scope="auto"):
+    """读取指定作用域配置文件中的 index-url，未设置时返回None"""
+    parser = _load(get_config_file(scope))
+    for key in ("index-url", "index_url"):
+        if parser.has_option(CONFIG_SECTION, key):
+            return parser.get(CONFIG_SECTION, key).strip()
+    return None
+
+
+def unset_index(scope="auto"):
+    """删除 tpip 管理的配置项，返回修改的配置文件路径（文件不存在时返回None）"""
+    path = get_config_file(scope)
+    if not path.exists():
+        return None
+    update_config(path, {}, remove=MANAGED_KEYS)
+    return path
@@ -0,0 +1,248 @@
+# tpip/prefetch.py
+# tpip install：先解析依赖，再从多个镜像源并发预下载全部文件，最后让pip从本地目录安装
+
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import unquote, urlsplit
+
+from . import tracing
+from .failover import relocate_file_url
+
+# 默认的并发下载数
+DEFAULT_JOBS = 8
+PREFETCH_READ_SIZE = 256 * 1024
+
+
+def build_requirement_args(requirements=(), requirement_files=(), constraint_files=(), pip_args=()):
+    """拼接传给pip的需求参数"""
+    cmd = list(requirements)
+    for path in requirement_files:
+        cmd += ["-r", path]
+    for path in constraint_files:
+        cmd += ["-c", path]
+    return cmd + list(pip_args)
+
+
+def resolve_requirements(requirement_args, index_url, report_path):
+    """调用 `pip install --dry-run --report` 解析完整的依赖集合，返回pip的退出码"""
+    cmd = [sys.executable, "-m", "pip", "install", "--dry-run", "--quiet", "--report", report_path,
+           "--index-url", index_url] + requirement_args
+    with tracing.span("pip_resolve") as span:
+        code = subprocess.call(cmd)
+        span.set(exit_code=code)
+    return code
+
+
+def load_report(path):
+    """
+    读取pip的安装报告（pip install --report 的输出，也可作为锁定文件重复使用），
+    返回 (需要下载的文件列表, 无法预下载的条目名称列表)。
+    每个文件为 {name, version, url, filename, hashes}。
+    """
+    with open(path, encoding="utf-8") as f:
+        report = json.load(f)
+    items, skipped = [], []
+    for entry in report.get("install", []):
+        metadata = entry.get("metadata", {})
+        name = metadata.get("name") or "?"
+        info = entry.get("download_info", {})
+        url = info.get("url", "")
+        # 本地目录和VCS依赖交给pip处理
+        if "archive_info" not in info or urlsplit(url).scheme not in ("http", "https"):
+            skipped.append(name)
+            continue
+        hashes = dict(info["archive_info"].get("hashes") or {})
+        if not hashes and info["archive_info"].get("hash"):
+            algorithm, _, value = info["archive_info"]["hash"].partition("=")
+            hashes[algorithm] = value
+        items.append({"name": name, "version": metadata.get("version"), "url": url,
+                      "filename": unquote(urlsplit(url).path.rsplit("/", 1)[-1]), "hashes": hashes})
+    return items, skipped
+
+
+def plan_workers(mirrors, jobs):
+    """
+    按镜像源的下载速度分配并发数：速度越快的镜像源分到的下载线程越多，
+    每个线程从同一个队列中取文件，因此下载量会自然地按吞吐量分摊。
+    没有下载速度的镜像源按平均速度计算。
+    """
+    speeds = [m.get("speed") for m in mirrors]
+    known = [s for s in speeds if s]
+    default = sum(known) / len(known) if known else 1
+    weights = [s or default for s in speeds]
+    total = sum(weights)
+    return {m["name"]: max(1, round(jobs * w / total)) for m, w in zip(mirrors, weights)}
+
+
+def _hash_matches(path, hashes):
+    """文件是否与报告中的哈希一致，没有哈希时只要文件存在即可"""
+    if not hashes:
+        return os.path.exists(path)
+    algorithm = "sha256" if "sha256" in hashes else next(iter(hashes))
+    digest = hashlib.new(algorithm)
+    try:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+    except OSError:
+        return False
+    return digest.hexdigest() == hashes[algorithm]
+
+
+async def _download_file(session, url, path, hashes):
+    """下载文件并校验哈希，成功后重命名为最终文件名，返回下载的字节数"""
+    from yarl import URL
+
+    algorithm = None
+    if hashes:
+        algorithm = "sha256" if "sha256" in hashes else next(iter(hashes))
+    digest = hashlib.new(algorithm) if algorithm else None
+    tmp_path = f"{path}.part"
+    size = 0
+    try:
+        async with session.get(URL(url, encoded=True)) as response:
+            response.raise_for_status()
+            with open(tmp_path, "wb") as f:
+                async for chunk in response.content.iter_chunked(PREFETCH_READ_SIZE):
+                    f.write(chunk)
+                    size += len(chunk)
+                    if digest:
+                        digest.update(chunk)
+        if digest and digest.hexdigest() != hashes[algorithm]:
+            raise ValueError(f"{algorithm} 校验失败")
+        os.replace(tmp_path, path)
+        return size
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+async def prefetch(items, mirrors, dest, jobs=DEFAULT_JOBS, user_agent=None):
+    """
+    从多个镜像源并发下载文件到 dest 目录。
+    每个文件优先从分到它的镜像源下载，失败时依次尝试其他镜像源和报告中的原始地址。
+    返回 (失败的文件列表, 各镜像源的 {files, bytes, seconds} 统计)。
+    """
+    import aiohttp
+
+    queue = asyncio.Queue()
+    for item in items:
+        path = os.path.join(dest, item["filename"])
+        if _hash_matches(path, item["hashes"]):
+            print(f"已存在: {item['filename']}")
+            continue
+        queue.put_nowait(item)
+
+    stats = {m["name"]: {"files": 0, "bytes": 0, "seconds": 0.0} for m in mirrors}
+    failed = []
+
+    async def worker(session, mirror, index):
+        while True:
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            alternates = relocate_file_url(item["url"], mirrors)
+            # 分到的镜像源优先，其次是排名靠前的镜像源，最后是原始地址
+            order = [mirror] + [m for m in mirrors if m is not mirror]
+            candidates = [(m["name"], alternates[m["name"]]) for m in order if m["name"] in alternates]
+            if item["url"] not in alternates.values():
+                candidates.append((None, item["url"]))
+            path = os.path.join(dest, item["filename"])
+            errors = []
+            for name, url in candidates:
+                start = time.monotonic()
+                try:
+                    with tracing.span("prefetch", track=f"{mirror['name']} #{index}", filename=item["filename"],
+                                      source=name) as span:
+                        size = await _download_file(session, url, path, item["hashes"])
+                        span.set(bytes=size)
+                except (aiohttp.ClientError, asyncio.TimeoutError, OSError, ValueError) as e:
+                    errors.append(f"{name or url}: {e}")
+                    continue
+                if name in stats:
+                    stats[name]["files"] += 1
+                    stats[name]["bytes"] += size
+                    stats[name]["seconds"] += time.monotonic() - start
+                print(f"已下载: {item['filename']} ({round(size / 1024 / 1024, 2)} MB, {name or '原始地址'})")
+                break
+            else:
+                print(f"下载失败: {item['filename']} - {'; '.join(errors)}")
+                failed.append(item)
+
+    headers = {"User-Agent": user_agent} if user_agent else None
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=60)
+    connector = aiohttp.TCPConnector(limit=jobs + len(mirrors))
+    async with aiohttp.ClientSession(headers=headers, timeout=timeout, connector=connector) as session:
+        workers = plan_workers(mirrors, jobs)
+        await asyncio.gather(*(worker(session, m, i) for m in mirrors for i in range(workers[m["name"]])))
+    return failed, stats
+
+
+def install(requirement_args, mirrors, jobs=DEFAULT_JOBS, download_dir=None, from_report=None,
+            user_agent=None):
+    """
+    解析依赖 -> 并发预下载 -> pip install --find-links，返回pip的退出码。
+    mirrors 为按排名排列的 [{name, url, speed}, ...]，第一个用作解析依赖的索引。
+    """
+    dest = download_dir or tempfile.mkdtemp(prefix="tpip-")
+    os.makedirs(dest, exist_ok=True)
+    try:
+        return _install(requirement_args, mirrors, dest, jobs, from_report, user_agent)
+    finally:
+        if not download_dir:
+            shutil.rmtree(dest, ignore_errors=True)
+
+
+def _install(requirement_args, mirrors, dest, jobs, from_report, user_agent):
+    index_url = mirrors[0]["url"]
+    if from_report:
+        report_path = from_report
+    else:
+        report_path = os.path.join(dest, "pip-report.json")
+        print(f"正在解析依赖（{mirrors[0]['name']}）...")
+        start = time.monotonic()
+        code = resolve_requirements(requirement_args, index_url, report_path)
+        if code != 0:
+            print("错误: 依赖解析失败")
+            return code
+        print(f"依赖解析完成，耗时 {round(time.monotonic() - start, 2)} 秒")
+
+    items, skipped = load_report(report_path)
+    if skipped:
+        print(f"以下依赖不是可下载的文件，将由pip处理: {', '.join(skipped)}")
+    print(f"共 {len(items)} 个文件，使用 {len(mirrors)} 个镜像源并发下载: "
+          + ", ".join(f"{name}×{n}" for name, n in plan_workers(mirrors, jobs).items()))
+
+    start = time.monotonic()
+    failed, stats = asyncio.run(prefetch(items, mirrors, dest, jobs, user_agent))
+    elapsed = time.monotonic() - start
+    total = sum(s["bytes"] for s in stats.values())
+    print(f"预下载完成: {round(total / 1024 / 1024, 2)} MB，耗时 {round(elapsed, 2)} 秒")
+    for name, s in stats.items():
+        if s["files"]:
+            print(f"  {name}: {s['files']} 个文件，{round(s['bytes'] / 1024 / 1024, 2)} MB")
+
+    cmd = [sys.executable, "-m", "pip", "install", "--find-links", dest]
+    if failed or skipped:
+        # 仍有文件需要从镜像源获取
+        cmd += ["--index-url", index_url]
+    else:
+        cmd += ["--no-index"]
+    if from_report and not requirement_args:
+        # 只提供了报告时，按报告中的名称和版本安装
+        requirement_args = [f"{item['name']}=={item['version']}" for item in items]
+    with tracing.span("pip_install") as span:
+        code = subprocess.call(cmd + requirement_args)
+        span.set(exit_code=code)
+    return code
@@ -0,0 +1,473 @@
+# tpip/proxy.py
+# tpip serve：以最快的镜像源为上游、带磁盘缓存的本地 PEP 503 索引代理
+
+import asyncio
+import hashlib
+import html
+import json
+import os
+import re
+import tempfile
+import time
+from collections import OrderedDict
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import aiohttp
+from aiohttp import web
+from yarl import URL
+
+from .cache import get_cache_dir
+from .failover import (CircuitBreaker, HedgedFetcher, NoMirrorAvailable, mirror_file_base, relocate_file_url,
+                       split_file_url)
+from .index import INDEX_ACCEPT, iter_index_files
+from .mirrors import redact_url
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 3141
+# 磁盘缓存的默认容量（MB）
+DEFAULT_CACHE_SIZE = 10 * 1024
+# 索引页在该时间（秒）内直接使用缓存，超过后用 ETag 向上游验证
+DEFAULT_INDEX_TTL = 600
+# 代理转发时每次读取的字节数
+PROXY_READ_SIZE = 256 * 1024
+
+
+def get_proxy_cache_dir():
+    return get_cache_dir() / "proxy"
+
+
+def canonical_name(name):
+    """PEP 503 规范化项目名"""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def cache_key(kind, url):
+    return hashlib.sha256(f"{kind}|{url}".encode()).hexdigest()
+
+
+def proxy_path(url):
+    """将上游文件地址改写为代理地址 /packages/<scheme>/<host>/<path>"""
+    parts = urlsplit(url)
+    path = f"/packages/{parts.scheme}/{parts.netloc}{parts.path}"
+    return f"{path}?{parts.query}" if parts.query else path
+
+
+def render_index(project, files):
+    """将索引文件列表渲染为指向代理地址的 PEP 503 HTML 页面"""
+    lines = [
+        "<!DOCTYPE html>",
+        "<html>",
+        "<head>",
+        '<meta name="pypi:repository-version" content="1.0">',
+        f"<title>Links for {html.escape(project)}</title>",
+        "</head>",
+        "<body>",
+        f"<h1>Links for {html.escape(project)}</h1>",
+    ]
+    for package_file in files:
+        href = proxy_path(package_file["url"])
+        hashes = package_file["hashes"]
+        if hashes:
+            name = "sha256" if "sha256" in hashes else next(iter(hashes))
+            href += f"#{name}={hashes[name]}"
+        attrs = f' href="{html.escape(href)}"'
+        if package_file["requires_python"]:
+            attrs += f' data-requires-python="{html.escape(package_file["requires_python"])}"'
+        if package_file["yanked"]:
+            attrs += ' data-yanked=""'
+        lines.append(f"<a{attrs}>{html.escape(package_file['filename'])}</a><br/>")
+    lines.extend(["</body>", "</html>", ""])
+    return "\n".join(lines).encode("utf-8")
+
+
+class DiskCache:
+    """
+    按总大小做LRU淘汰的磁盘缓存。
+    每个条目由数据文件和同名的 .json 元数据文件组成，元数据文件最后写入，
+    没有元数据的数据文件视为未完成的下载，启动时清理。
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.size = 0
+        # key -> 数据大小，按最近访问时间从旧到新排列
+        self.entries = OrderedDict()
+        # 正在写入的条目不会被淘汰
+        self.pinned = set()
+        self._load()
+
+    def _meta_path(self, key):
+        return self.directory / key[:2] / f"{key}.json"
+
+    def data_path(self, key):
+        return self.directory / key[:2] / key
+
+    def _load(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        found = []
+        for data_path in self.directory.glob("??/*"):
+            if data_path.suffix:
+                continue
+            meta_path = data_path.with_name(f"{data_path.name}.json")
+            try:
+                stat = data_path.stat()
+                if not meta_path.exists():
+                    data_path.unlink()
+                    continue
+            except OSError:
+                continue
+            found.append((stat.st_mtime, data_path.name, stat.st_size))
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.size += size
+
+    def get(self, key):
+        """返回条目的元数据并标记为最近使用，不存在时返回None"""
+        if key not in self.entries:
+            return None
+        try:
+            with open(self._meta_path(key), encoding="utf-8") as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            self.remove(key)
+            return None
+        self.entries.move_to_end(key)
+        try:
+            # 用数据文件的修改时间记录访问顺序，重启后恢复LRU顺序
+            os.utime(self.data_path(key))
+        except OSError:
+            pass
+        return metadata
+
+    def begin(self, key):
+        """开始写入条目，返回数据文件路径"""
+        self.pinned.add(key)
+        if key in self.entries:
+            self.remove(key)
+        path = self.data_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def commit(self, key, metadata):
+        """数据文件写入完成后写入元数据，条目生效"""
+        self.pinned.discard(key)
+        size = self.data_path(key).stat().st_size
+        self.write_metadata(key, metadata)
+        self.size += size - self.entries.pop(key, 0)
+        self.entries[key] = size
+        self.evict()
+
+    def abort(self, key):
+        self.pinned.discard(key)
+        try:
+            self.data_path(key).unlink()
+        except OSError:
+            pass
+
+    def store(self, key, data, metadata):
+        with open(self.begin(key), "wb") as f:
+            f.write(data)
+        self.commit(key, metadata)
+
+    def write_metadata(self, key, metadata):
+        """原子地写入元数据文件"""
+        path = self._meta_path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), prefix=".tmp-", suffix=".json")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(metadata, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def remove(self, key):
+        self.size -= self.entries.pop(key, 0)
+        for path in (self._meta_path(key), self.data_path(key)):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def evict(self):
+        """淘汰最久未使用的条目，直到总大小不超过上限"""
+        for key in list(self.entries):
+            if self.size <= self.max_bytes:
+                break
+            if key not in self.pinned:
+                self.remove(key)
+
+
+class _Transfer:
+    """一个正在进行的上游下载，同一文件的并发请求共享该下载，边下载边转发"""
+
+    def __init__(self):
+        self.status = None
+        self.content_type = "application/octet-stream"
+        self.length = None
+        self.size = 0
+        self.finished = False
+        self.error = None
+        self.task = None
+        self._changed = asyncio.Event()
+
+    def notify(self):
+        event, self._changed = self._changed, asyncio.Event()
+        event.set()
+
+    async def wait(self):
+        await self._changed.wait()
+
+
+class ProxyServer:
+    """
+    缓存索引页和包文件的索引代理。
+    upstreams 为按排名排列的上游镜像源 [{name, url, latency_p90}, ...]，
+    请求发往排名最高的健康镜像源，响应慢时对冲到下一个镜像源，失败时自动故障转移。
+    routes 为按包路由表 {规范化包名: 镜像源名称}，路由表中的包优先从对应的镜像源获取。
+    """
+
+    def __init__(self, upstreams, cache, index_ttl=DEFAULT_INDEX_TTL, user_agent=None,
+                 hedge_delay=None, breaker=None, routes=None):
+        self.upstreams = [dict(u, url=u["url"].rstrip("/")) for u in upstreams]
+        self.routes = routes or {}
+        self.mirror_url = self.upstreams[0]["url"]
+        self.cache = cache
+        self.index_ttl = index_ttl
+        self.user_agent = user_agent
+        self.hedge_delay = hedge_delay
+        self.breaker = breaker or CircuitBreaker()
+        # 只转发上游镜像源和索引页中出现过的主机，避免成为开放代理
+        self.allowed_hosts = {urlsplit(mirror_file_base(u["url"])).netloc for u in self.upstreams}
+        self.allowed_hosts.update(urlsplit(u["url"]).netloc for u in self.upstreams)
+        self.session = None
+        self.fetcher = None
+        self.transfers = {}
+        self.index_tasks = {}
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "index_hits": 0,
+                      "index_revalidated": 0, "index_fetched": 0, "index_routed": 0, "upstream_bytes": 0}
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_get("/simple/", self.handle_root)
+        app.router.add_get("/simple/{project}", self.handle_redirect)
+        app.router.add_get("/simple/{project}/", self.handle_index)
+        app.router.add_get("/packages/{tail:.*}", self.handle_package)
+        app.router.add_get("/-/stats", self.handle_stats)
+        app.on_startup.append(self._start)
+        app.on_cleanup.append(self._stop)
+        return app
+
+    async def _start(self, app):
+        # 包文件原样转发（auto_decompress=False），此时aiohttp不再解压响应，因此要求上游不压缩，
+        # 否则压缩后的索引页无法解析，压缩后的包文件也会因缺少 Content-Encoding 而损坏
+        headers = {"Accept-Encoding": "identity"}
+        if self.user_agent:
+            headers["User-Agent"] = self.user_agent
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=60)
+        self.session = aiohttp.ClientSession(headers=headers, timeout=timeout, auto_decompress=False)
+        self.fetcher = HedgedFetcher(self.session, self.upstreams, self.hedge_delay, self.breaker)
+
+    async def _stop(self, app):
+        await self.session.close()
+
+    async def handle_root(self, request):
+        # 项目列表页很大且pip安装时不会用到，直接重定向到上游
+        raise web.HTTPFound(f"{self.mirror_url}/")
+
+    async def handle_redirect(self, request):
+        raise web.HTTPMovedPermanently(f"/simple/{canonical_name(request.match_info['project'])}/")
+
+    async def handle_stats(self, request):
+        upstreams = [{"name": u["name"], "url": redact_url(u["url"]), "state": self.breaker.state(u["name"]),
+                      "failures": self.breaker.failures.get(u["name"], 0)} for u in self.upstreams]
+        return web.json_response(dict(self.stats, upstreams=upstreams, failover=self.fetcher.stats,
+                                      cache_bytes=self.cache.size, cache_entries=len(self.cache.entries)))
+
+    def _index_response(self, key, metadata):
+        self.allowed_hosts.update(metadata.get("hosts", []))
+        return web.FileResponse(self.cache.data_path(key),
+                                headers={"Content-Type": "text/html; charset=utf-8"})
+
+    async def handle_index(self, request):
+        project = request.match_info["project"]
+        if canonical_name(project) != project:
+            raise web.HTTPMovedPermanently(f"/simple/{canonical_name(project)}/")
+        # 索引页按项目缓存，与最终由哪个上游镜像源提供无关
+        key = cache_key("index", project)
+        metadata = self.cache.get(key)
+        if metadata and time.time() - metadata["fetched"] < self.index_ttl:
+            self.stats["index_hits"] += 1
+            return self._index_response(key, metadata)
+
+        # 同一项目的并发请求只向上游请求一次
+        task = self.index_tasks.get(key)
+        if task is None:
+            task = self.index_tasks[key] = asyncio.ensure_future(self._refresh_index(project, key, metadata))
+            task.add_done_callback(lambda _: self.index_tasks.pop(key, None))
+        metadata = await asyncio.shield(task)
+        return self._index_response(key, metadata)
+
+    async def _refresh_index(self, project, key, metadata):
+        """向上游获取索引页，有缓存时用 ETag 验证，返回新的元数据"""
+        headers = {"Accept": INDEX_ACCEPT}
+        if metadata and metadata.get("etag"):
+            headers["If-None-Match"] = metadata["etag"]
+        prefer = self.routes.get(project)
+        if prefer is not None:
+            self.stats["index_routed"] += 1
+        try:
+            mirror, response = await self.fetcher.get(lambda m: f"{m['url']}/{project}/", prefer=prefer,
+                                                      headers=headers)
+            async with response:
+                url = str(response.url)
+                if response.status == 304 and metadata:
+                    self.stats["index_revalidated"] += 1
+                    metadata["fetched"] = time.time()
+                    self.cache.write_metadata(key, metadata)
+                    return metadata
+                if response.status == 404:
+                    raise web.HTTPNotFound(text=f"上游镜像源中没有 {project}")
+                response.raise_for_status()
+                files = [f async for f in iter_index_files(response, str(response.url))]
+                etag = response.headers.get("ETag")
+        except (aiohttp.ClientError, asyncio.TimeoutError, NoMirrorAvailable) as e:
+            # 上游不可用（包括所有镜像源都已熔断、没有可以发送请求的镜像源）时使用过期的缓存
+            if metadata:
+                return metadata
+            raise web.HTTPBadGateway(text=f"获取上游索引页失败: {e}")
+
+        self.stats["index_fetched"] += 1
+        hosts = sorted({urlsplit(f["url"]).netloc for f in files})
+        metadata = {"url": redact_url(url), "mirror": mirror["name"], "etag": etag, "fetched": time.time(), "hosts": hosts}
+        self.cache.store(key, render_index(project, files), metadata)
+        return metadata
+
+    async def handle_package(self, request):
+        # 使用原始路径，保留上游地址中的百分号编码（如本地版本号中的 %2B）
+        tail = request.raw_path[len("/packages/"):].split("?", 1)[0]
+        scheme, _, rest = tail.partition("/")
+        host = rest.split("/", 1)[0]
+        if scheme not in ("http", "https") or not host:
+            raise web.HTTPNotFound()
+        url = f"{scheme}://{rest}"
+        if request.query_string:
+            url += f"?{request.query_string}"
+
+        # 各镜像源上的同一文件共用一个缓存条目，按去掉镜像源根地址后的相对路径索引
+        _, relative = split_file_url(url, self.upstreams)
+        alternates = relocate_file_url(url, self.upstreams)
+        key = cache_key("file", relative or url)
+        metadata = self.cache.get(key)
+        if metadata:
+            self.stats["hits"] += 1
+            return web.FileResponse(self.cache.data_path(key),
+                                    headers={"Content-Type": metadata["content_type"]})
+        if host not in self.allowed_hosts:
+            raise web.HTTPForbidden(text=f"不代理未在索引页中出现的主机: {host}")
+
+        transfer = self.transfers.get(key)
+        if transfer is None:
+            self.stats["misses"] += 1
+            transfer = self.transfers[key] = _Transfer()
+            transfer.task = asyncio.ensure_future(self._download(key, url, alternates, transfer))
+        else:
+            self.stats["coalesced"] += 1
+        return await self._stream_transfer(request, key, transfer)
+
+    async def _open_upstream(self, url, alternates):
+        """请求上游文件，能在镜像源之间互换的文件使用对冲请求和故障转移"""
+        if not alternates:
+            return await self.session.get(URL(url, encoded=True))
+        # 使用按包路由时优先请求索引页所指向的镜像源，使路由同样作用于文件下载
+        prefer = None
+        if self.routes:
+            prefer = next((name for name, alternate in alternates.items() if alternate == url), None)
+        _, response = await self.fetcher.get(lambda m: URL(alternates[m["name"]], encoded=True)
+                                             if m["name"] in alternates else None, prefer=prefer)
+        return response
+
+    async def _download(self, key, url, alternates, transfer):
+        """从上游下载文件到缓存，每收到一块数据就通知等待中的请求"""
+        path = self.cache.begin(key)
+        try:
+            async with await self._open_upstream(url, alternates) as response:
+                transfer.status = response.status
+                if response.status != 200:
+                    return
+                transfer.content_type = response.headers.get("Content-Type", transfer.content_type)
+                transfer.length = response.content_length
+                with open(path, "wb") as f:
+                    transfer.notify()
+                    async for chunk in response.content.iter_chunked(PROXY_READ_SIZE):
+                        f.write(chunk)
+                        f.flush()
+                        transfer.size += len(chunk)
+                        self.stats["upstream_bytes"] += len(chunk)
+                        transfer.notify()
+            if transfer.length is not None and transfer.size != transfer.length:
+                raise aiohttp.ClientPayloadError(f"下载不完整: {transfer.size}/{transfer.length} 字节")
+            self.cache.commit(key, {"url": redact_url(str(response.url)), "content_type": transfer.content_type,
+                                    "stored": time.time()})
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError, NoMirrorAvailable) as e:
+            transfer.error = str(e) or type(e).__name__
+            print(f"下载 {redact_url(url)} 失败: {transfer.error}")
+        finally:
+            if transfer.error or transfer.status != 200:
+                self.cache.abort(key)
+            transfer.finished = True
+            self.transfers.pop(key, None)
+            transfer.notify()
+
+    async def _stream_transfer(self, request, key, transfer):
+        """将正在进行的下载转发给客户端，数据追上下载进度时等待新数据"""
+        while transfer.status is None and not transfer.finished:
+            await transfer.wait()
+        if transfer.status != 200:
+            if transfer.status is None:
+                raise web.HTTPBadGateway(text=f"上游下载失败: {transfer.error}")
+            return web.Response(status=transfer.status)
+
+        response = web.StreamResponse(headers={"Content-Type": transfer.content_type})
+        if transfer.length is not None:
+            response.content_length = transfer.length
+        await response.prepare(request)
+        sent = 0
+        with open(self.cache.data_path(key), "rb") as f:
+            while True:
+                if sent < transfer.size:
+                    data = f.read(min(transfer.size - sent, PROXY_READ_SIZE))
+                    sent += len(data)
+                    await response.write(data)
+                elif transfer.finished:
+                    break
+                else:
+                    await transfer.wait()
+        if transfer.error:
+            # 上游中断时断开连接，让客户端发现响应不完整
+            raise ConnectionResetError(transfer.error)
+        await response.write_eof()
+        return response
+
+
+def serve(upstreams, host=DEFAULT_HOST, port=DEFAULT_PORT, cache_dir=None, cache_size=DEFAULT_CACHE_SIZE,
+          index_ttl=DEFAULT_INDEX_TTL, user_agent=None, hedge_delay=None, breaker=None, routes=None):
+    """启动代理服务，upstreams 为按排名排列的上游镜像源，cache_size 的单位为MB，routes 为按包路由表"""
+    cache = DiskCache(cache_dir or get_proxy_cache_dir(), cache_size * 1024 * 1024)
+    server = ProxyServer(upstreams, cache, index_ttl=index_ttl, user_agent=user_agent,
+                         hedge_delay=hedge_delay, breaker=breaker, routes=routes)
+    print(f"上游镜像源: {redact_url(server.mirror_url)}")
+    if len(upstreams) > 1:
+        print(f"故障转移顺序: {' -> '.join(u['name'] for u in upstreams)}")
+    if server.routes:
+        print(f"按包路由: {len(server.routes)} 个包使用各自最快的镜像源")
+    print(f"缓存目录: {cache.directory}（已缓存 {len(cache.entries)} 个文件，"
+          f"{cache.size / 1024 / 1024:.1f}/{cache_size} MB）")
+    print(f"索引地址: http://{host}:{port}/simple/")
+    print(f">\tpip install [package_name] -i http://{host}:{port}/simple")
+    web.run_app(server.make_app(), host=host, port=port, access_log=None, print=None)
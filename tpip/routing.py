@@ -0,0 +1,189 @@
+# tpip/routing.py
+# 按包选择镜像源：对一组包分别探测各镜像源的索引页和文件下载，生成每个包的路由表
+
+import asyncio
+import json
+import os
+import re
+import time
+from dataclasses import replace
+from pathlib import Path
+
+from . import tracing
+from .benchmark import DNS_CACHE_TTL, MirrorBenchmark, MirrorResult, create_latency_trace_config, probe_file
+from .cache import CACHE_VERSION, _write_json_atomic, get_cache_dir
+from .tags import file_version
+from .versions import version_key
+
+# 每个镜像源上每个包下载的字节数，小于该大小的文件会被完整下载
+DEFAULT_PROBE_BYTES = 1024 * 1024
+# 同时探测的包数量，同一个包的各镜像源总是同时探测
+DEFAULT_PACKAGE_JOBS = 4
+ROUTES_FILE_NAME = "routes.json"
+
+_REQUIREMENT_NAME = re.compile(r"^\s*([A-Za-z0-9][A-Za-z0-9._-]*)")
+
+
+def canonical_name(name):
+    """PEP 503 规范化项目名"""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def read_requirements(path, seen=None):
+    """
+    从需求文件中读取包名，支持 -r 引用其他需求文件，忽略注释、选项、版本约束、extras 和环境标记。
+    返回按出现顺序排列、去重后的包名列表。
+    """
+    path = Path(path)
+    seen = set() if seen is None else seen
+    names = []
+    with open(path, encoding="utf-8") as f:
+        text = f.read().replace("\\\n", " ")
+    for line in text.splitlines():
+        line = line.split(" #", 1)[0].strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith(("-r ", "--requirement ", "-r", "--requirement=")):
+            nested = re.sub(r"^(-r|--requirement)[=\s]*", "", line)
+            names += read_requirements(path.parent / nested, seen)
+            continue
+        if line.startswith("-"):
+            # -e、-i、--hash 等选项
+            continue
+        match = _REQUIREMENT_NAME.match(line)
+        if match and canonical_name(match.group(1)) not in seen:
+            seen.add(canonical_name(match.group(1)))
+            names.append(match.group(1))
+    return names
+
+
+def estimate_fetch_ms(index_ms, probe, size):
+    """估计pip从该镜像源获取这个包的耗时：索引页 + 首字节 + 按探测吞吐量下载完整文件"""
+    if probe["bytes"] >= (size or 0) or not probe["speed"]:
+        return round(index_ms + probe["duration_ms"], 2)
+    transfer_ms = size / (probe["speed"] * 1024 * 1024) * 1000
+    return round(index_ms + probe["ttfb_ms"] + transfer_ms, 2)
+
+
+async def probe_package(benchmark, session, package, mirrors, probe_bytes):
+    """对一个包同时探测所有镜像源，返回按估计耗时排列的结果列表（落后于最新版本的镜像源排在后面）"""
+    package_benchmark = MirrorBenchmark(replace(benchmark.config, package=package), session=session)
+
+    async def probe(name, url):
+        with tracing.span("probe", track=f"{package} @ {name}") as span:
+            entry = await _probe(name, url)
+            span.set(version=entry["version"], bytes=(entry["probe"] or {}).get("bytes"),
+                     estimate_ms=entry["estimate_ms"], error=entry["error"])
+        return entry
+
+    async def _probe(name, url):
+        result = MirrorResult(name, url)
+        entry = {"name": name, "url": url, "version": None, "filename": None, "size": None,
+                 "index_ms": None, "estimate_ms": None, "probe": None, "error": None}
+        package_file = await package_benchmark.fetch_package_file(session, name, url, result)
+        if result.index:
+            entry["index_ms"] = result.index["duration_ms"]
+        if not package_file:
+            entry["error"] = "; ".join(result.errors) or "未找到适合的包文件"
+            return entry
+        entry.update(filename=package_file["filename"], size=package_file["size"],
+                     version=file_version(package_file["filename"], package))
+        try:
+            entry["probe"] = await probe_file(session, package_file["url"], probe_bytes, benchmark.user_agent)
+        except Exception as e:
+            entry["error"] = f"下载失败: {e}"
+            return entry
+        entry["size"] = entry["size"] or entry["probe"]["size"]
+        entry["estimate_ms"] = estimate_fetch_ms(entry["index_ms"], entry["probe"], entry["size"])
+        return entry
+
+    entries = await asyncio.gather(*(probe(name, url) for name, url in mirrors.items()))
+    versions = [version_key(e["version"]) for e in entries if e["version"] and e["estimate_ms"] is not None]
+    newest = max(versions) if versions else None
+    for entry in entries:
+        entry["stale"] = bool(entry["version"] and newest is not None and version_key(entry["version"]) < newest)
+    return sorted(entries, key=lambda e: (e["estimate_ms"] is None, e["stale"], e["estimate_ms"] or 0))
+
+
+async def build_routes_async(config, packages, probe_bytes=DEFAULT_PROBE_BYTES, jobs=DEFAULT_PACKAGE_JOBS,
+                             max_mirrors=0, on_log=None, on_package=None):
+    """
+    生成按包路由表。先做一次延迟测试排除不可用的镜像源（max_mirrors 大于0时只保留延迟最低的几个），
+    再以 jobs 个包为一批同时探测各包在每个镜像源上的索引页和文件下载。
+    返回路由表字典，on_package(包名, 路由) 在每个包探测完成后调用。
+    """
+    import aiohttp
+
+    # 只做延迟测试，结果不写入缓存，以免覆盖完整测速得到的镜像源排名
+    benchmark = MirrorBenchmark(replace(config, download_test=False, save_results=False), on_log=on_log)
+    connector = aiohttp.TCPConnector(limit=config.concurrency + jobs * len(config.mirrors),
+                                     limit_per_host=config.per_host_limit, ttl_dns_cache=DNS_CACHE_TTL)
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60), connector=connector,
+                                     trace_configs=[create_latency_trace_config()]) as session:
+        benchmark.session = session
+        with tracing.span("latency_pass"):
+            latency = await benchmark.run_async()
+        reachable = [m for m in latency.mirrors if m.latency_ms is not None]
+        reachable.sort(key=lambda m: m.latency_ms)
+        if max_mirrors > 0:
+            reachable = reachable[:max_mirrors]
+        mirrors = {m.name: m.url for m in reachable}
+        if not mirrors:
+            raise RuntimeError("无法连接到任何镜像源")
+
+        semaphore = asyncio.Semaphore(max(1, jobs))
+        routes = {}
+
+        async def route(package):
+            async with semaphore:
+                entries = await probe_package(benchmark, session, package, mirrors, probe_bytes)
+            best = entries[0] if entries and entries[0]["estimate_ms"] is not None else None
+            routes[canonical_name(package)] = {
+                "package": package,
+                "mirror": best["name"] if best else None,
+                "index_url": best["url"] if best else None,
+                "version": best["version"] if best else None,
+                "estimate_ms": best["estimate_ms"] if best else None,
+                "mirrors": entries,
+            }
+            if on_package:
+                on_package(package, routes[canonical_name(package)])
+
+        await asyncio.gather(*(route(package) for package in packages))
+
+    return {"version": CACHE_VERSION, "timestamp": time.time(), "package_count": len(packages),
+            "mirrors": mirrors, "routes": {canonical_name(p): routes[canonical_name(p)] for p in packages}}
+
+
+def get_routes_path():
+    return get_cache_dir() / ROUTES_FILE_NAME
+
+
+def save_routes(table, path=None):
+    """原子地写入路由表，默认保存在tpip缓存目录下，供 tpip serve --routes 使用"""
+    _write_json_atomic(table, Path(path) if path else get_routes_path())
+
+
+def load_routes(path=None):
+    """读取路由表，返回 {规范化包名: 镜像源名称}，文件不存在或格式不对时返回空字典"""
+    path = Path(path) if path else get_routes_path()
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    routes = data.get("routes") if isinstance(data, dict) else None
+    if not isinstance(routes, dict):
+        return {}
+    return {canonical_name(name): route["mirror"] for name, route in routes.items()
+            if isinstance(route, dict) and route.get("mirror")}
+
+
+def format_pip_commands(table, pip="pip"):
+    """将路由表导出为按镜像源分组的pip安装命令，每个镜像源一行"""
+    groups = {}
+    for route in table["routes"].values():
+        if route["mirror"]:
+            groups.setdefault(route["index_url"], []).append(route["package"])
+    lines = [f"{pip} install --index-url {url} {' '.join(packages)}" for url, packages in groups.items()]
+    return os.linesep.join(lines)
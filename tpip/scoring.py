@@ -0,0 +1,180 @@
+# tpip/scoring.py
+# 按安装负载估计各镜像源的安装耗时：综合延迟分布、吞吐量采样、失败率和历史测速结果，
+# 对所有镜像源按列批量计算（每个输入量为一列，逐列运算），得到可比较的预计耗时及其分解
+
+import math
+import re
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+from .cache import get_history
+
+# 安装负载中的文件大小类别（字节）
+SIZE_CLASSES = {
+    "small": 256 * 1024,
+    "medium": 4 * 1024 * 1024,
+    "large": 100 * 1024 * 1024,
+}
+_UNITS = {"b": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+# pip 安装每个文件需要的请求数：索引页和文件本身
+REQUESTS_PER_FILE = 2
+# 标准正态分布的90%分位数，预计耗时按P90计：期望耗时加上延迟和吞吐量波动的余量
+Z_P90 = 1.2816
+# 没有吞吐量采样时假定的速度变异系数，实测和历史结果分别取值
+MEASURED_SPEED_CV = 0.25
+HISTORY_SPEED_CV = 0.5
+# 每次失败的请求在重试前额外耗费的时间（毫秒），包括发现失败和 pip 的退避等待
+RETRY_COST_MS = 1000
+# 失败率上限，避免失败率接近1时估计值发散
+MAX_ERROR_RATE = 0.9
+# 监控统计的失败率作为先验时相当于的请求数
+PRIOR_REQUESTS = 10
+
+_TERM = re.compile(r"(?:(?P<count>\d+)\s*[x×*]?\s*)?"
+                   r"(?P<size>small|medium|large|(?P<number>\d+(?:\.\d+)?)\s*(?P<unit>[kmg]i?b?|b))"
+                   r"(?:\s+[^\d\s]+)*", re.IGNORECASE)
+
+
+@dataclass
+class Workload:
+    """安装负载: 若干组 (文件数, 每个文件的字节数)"""
+    files: List[Tuple[int, int]] = field(default_factory=list)
+    text: str = ""
+
+    @property
+    def count(self):
+        return sum(count for count, _ in self.files)
+
+    @property
+    def total_bytes(self):
+        return sum(count * size for count, size in self.files)
+
+    @property
+    def sum_squares(self):
+        """各文件大小的平方和，用于计算传输时间的方差"""
+        return sum(count * size * size for count, size in self.files)
+
+
+def parse_workload(text):
+    """
+    解析安装负载描述，各项以 + 或逗号分隔，每项为 [数量[x]] 大小，大小为 small/medium/large 或带单位的字节数，
+    其后的说明文字被忽略，如 "200 small wheels + 2 large"、"50x64KB, 1x1.5GB"。格式错误时抛出 ValueError。
+    """
+    files = []
+    for term in re.split(r"[+,]", text):
+        term = term.strip()
+        match = _TERM.fullmatch(term)
+        if not match:
+            raise ValueError(f"无法解析安装负载 '{term}'，格式如 \"200 small wheels + 2 large\" 或 \"50x64KB\"")
+        count = int(match.group("count") or 1)
+        if match.group("number"):
+            size = int(float(match.group("number")) * _UNITS[match.group("unit")[0].lower()])
+        else:
+            size = SIZE_CLASSES[match.group("size").lower()]
+        if count <= 0 or size <= 0:
+            raise ValueError(f"安装负载 '{term}' 的数量和大小必须大于0")
+        files.append((count, size))
+    return Workload(files, text.strip())
+
+
+def load_history(network_id, mirrors):
+    """
+    各镜像源的历史数据，返回 {名称: {speed, speed_sd, error_rate, error_weight, source}}。
+    速度优先取本网络下最近一次测速的结果（source 为 cache），没有时取 tpip monitor 的EWMA吞吐量（source 为 monitor）；
+    失败率只来自监控统计，error_weight 为其作为先验时相当于的请求数。
+    """
+    from .monitor import load_state
+
+    history = {}
+    for name, entry in get_history(network_id, mirrors).items():
+        history[name] = {"speed": entry["speed"], "speed_sd": entry.get("speed_sd"), "source": "cache"}
+    for name, stats in load_state()["mirrors"].items():
+        if name not in mirrors:
+            continue
+        item = history.setdefault(name, {"source": None})
+        if item.get("speed") is None and stats.get("throughput"):
+            item.update(speed=stats["throughput"], speed_sd=None, source="monitor")
+        if stats.get("error_rate") is not None:
+            item.update(error_rate=stats["error_rate"], error_weight=min(stats.get("samples", 0), PRIOR_REQUESTS))
+    return history
+
+
+def _columns(mirrors, history):
+    """
+    把各镜像源的测速结果整理为列: 每个请求的固定开销及其标准差（毫秒）、单连接速度及其标准差（MB/s）、
+    失败率、同步延迟的得分系数和速度来源。没有本次测得的下载速度时使用历史数据，本次延迟测试失败时各列为None。
+    """
+    columns = {key: [] for key in ("overhead", "overhead_sd", "speed", "speed_sd", "error_rate", "factor", "source")}
+    for m in mirrors:
+        past = history.get(m.name) or {}
+        download, latency, reuse = m.download or {}, m.latency or {}, m.reuse or {}
+        # 有连接复用测试时使用测得的每个请求的固定开销，否则使用延迟（新建连接上的请求耗时）
+        if reuse.get("overhead_ms") is not None:
+            overhead = reuse["overhead_ms"]
+            spread = (reuse.get("p90_ms") or 0) - (reuse.get("median_ms") or 0)
+        else:
+            overhead = m.latency_ms
+            spread = (latency.get("p90") or 0) - (latency.get("p50") or 0)
+        speed = download.get("single_speed") or download.get("speed")
+        if speed is not None:
+            if download.get("effective_speed"):
+                speed = min(speed, download["effective_speed"])
+            speed_sd = download.get("speed_sd")
+            if speed_sd is None:
+                speed_sd = speed * MEASURED_SPEED_CV
+            source = "measured"
+        else:
+            speed, source = past.get("speed"), past.get("source")
+            speed_sd = past.get("speed_sd")
+            if speed_sd is None:
+                speed_sd = (speed or 0) * HISTORY_SPEED_CV
+        # 失败率: 本次延迟测试和连接复用测试中失败的请求比例，以监控统计的失败率为先验
+        failed = (latency.get("errors") or 0) + (reuse.get("errors") or 0)
+        total = failed + len(latency.get("samples") or []) + (reuse.get("requests") or 0)
+        weight = past.get("error_weight") or 0
+        error_rate = (failed + (past.get("error_rate") or 0) * weight) / (total + weight) if total + weight else 0.0
+        if m.latency_ms is None or not speed:
+            overhead = speed = None
+        columns["overhead"].append(overhead)
+        columns["overhead_sd"].append(max(spread, 0) / Z_P90)
+        columns["speed"].append(speed)
+        columns["speed_sd"].append(speed_sd)
+        columns["error_rate"].append(min(error_rate, MAX_ERROR_RATE))
+        columns["factor"].append((m.freshness or {}).get("factor", 1.0))
+        columns["source"].append(source)
+    return columns
+
+
+def estimate_install_times(mirrors, workload, history=None):
+    """
+    按安装负载批量估计各镜像源的安装耗时，返回与 mirrors 一一对应的列表，每项为
+    {total_s, request_s, transfer_s, variance_s, retry_s, speed, error_rate, source}，无法估计时为None。
+    request_s 为每个文件 REQUESTS_PER_FILE 个请求的固定开销；transfer_s 为按单连接速度传输所有文件的时间；
+    variance_s 为延迟和吞吐量波动的P90余量（各请求和各文件独立，标准差按平方和开方合计）；
+    retry_s 为按失败率估计的重试耗时。total_s 为四项之和除以同步延迟的得分系数，排名按 total_s 从低到高。
+    """
+    c = _columns(mirrors, history or {})
+    requests = workload.count * REQUESTS_PER_FILE
+    mb = 1024 * 1024
+    valid = [o is not None for o in c["overhead"]]
+    request_ms = [o * requests if ok else 0.0 for o, ok in zip(c["overhead"], valid)]
+    transfer_ms = [workload.total_bytes / (v * mb) * 1000 if ok else 0.0 for v, ok in zip(c["speed"], valid)]
+    # 单个文件传输时间的标准差与文件大小成正比: 大小 / 速度 * 速度的变异系数
+    transfer_var = [(sd / v * 1000 / (v * mb)) ** 2 * workload.sum_squares if ok else 0.0
+                    for v, sd, ok in zip(c["speed"], c["speed_sd"], valid)]
+    variance_ms = [Z_P90 * math.sqrt(requests * osd ** 2 + tv) for osd, tv in zip(c["overhead_sd"], transfer_var)]
+    retry_ms = [requests * p / (1 - p) * (o + RETRY_COST_MS) if ok else 0.0
+                for p, o, ok in zip(c["error_rate"], c["overhead"], valid)]
+    totals = [(r + t + v + e) / max(f, 0.01)
+              for r, t, v, e, f in zip(request_ms, transfer_ms, variance_ms, retry_ms, c["factor"])]
+
+    estimates = []
+    for i, ok in enumerate(valid):
+        if not ok:
+            estimates.append(None)
+            continue
+        estimates.append({"total_s": round(totals[i] / 1000, 3), "request_s": round(request_ms[i] / 1000, 3),
+                          "transfer_s": round(transfer_ms[i] / 1000, 3), "variance_s": round(variance_ms[i] / 1000, 3),
+                          "retry_s": round(retry_ms[i] / 1000, 3), "speed": c["speed"][i],
+                          "error_rate": round(c["error_rate"][i], 4), "source": c["source"][i]})
+    return estimates
@@ -0,0 +1,159 @@
+# tpip/stats.py
+# 测速用到的统计工具
+
+import math
+import threading
+
+from . import tracing
+
+# 95% 置信度下 t 分布的双侧临界值（按自由度），自由度超过30时使用正态近似
+_T_CRITICAL_95 = {
+    1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306,
+    9: 2.262, 10: 2.228, 12: 2.179, 15: 2.131, 20: 2.086, 30: 2.042,
+}
+
+
+def _t_critical(df):
+    if df > 30:
+        return 1.96
+    # 表中没有的自由度取较小的相邻值，区间略宽，结论更保守
+    return _T_CRITICAL_95[max(k for k in _T_CRITICAL_95 if k <= df)]
+
+
+def percentile(values, q):
+    """使用线性插值计算百分位数，q 取值 0~100"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * q / 100
+    low, high = math.floor(k), math.ceil(k)
+    if low == high:
+        return ordered[low]
+    return ordered[low] + (ordered[high] - ordered[low]) * (k - low)
+
+
+def median(values):
+    return percentile(values, 50)
+
+
+def stdev(samples):
+    """样本标准差，少于两个样本时返回None"""
+    n = len(samples)
+    if n < 2:
+        return None
+    mean = sum(samples) / n
+    return math.sqrt(sum((x - mean) ** 2 for x in samples) / (n - 1))
+
+
+def mean_confidence_interval(samples):
+    """计算样本均值及其95%置信区间，返回 (均值, 下限, 上限)"""
+    n = len(samples)
+    if n == 0:
+        return None, None, None
+    mean = sum(samples) / n
+    if n == 1:
+        return mean, 0.0, math.inf
+    variance = sum((x - mean) ** 2 for x in samples) / (n - 1)
+    half_width = _t_critical(n - 1) * math.sqrt(variance / n)
+    return mean, max(mean - half_width, 0.0), mean + half_width
+
+
+class ThroughputEstimator:
+    """
+    按固定时间间隔对下载字节数采样，估计吞吐量（字节/秒）及其置信区间。
+    第一个采样区间包含TCP慢启动，默认作为预热丢弃。
+    label 不为None时，每个采样（包括预热区间）都记录到性能跟踪的吞吐量时间线中。
+    """
+
+    def __init__(self, interval=0.25, warmup=1, label=None):
+        self.interval = interval
+        self.warmup = warmup
+        self.label = label
+        self.samples = []
+        self.finished = False
+        self._intervals = 0
+        self._interval_start = None
+        self._interval_bytes = 0
+
+    def start(self, now):
+        self._interval_start = now
+        self._interval_bytes = 0
+
+    def update(self, total_bytes, now):
+        """记录已下载的总字节数，若完成了一个采样区间则返回True"""
+        if self._interval_start is None:
+            self.start(now)
+            return False
+        elapsed = now - self._interval_start
+        if elapsed < self.interval:
+            return False
+        rate = (total_bytes - self._interval_bytes) / elapsed
+        self._interval_start = now
+        self._interval_bytes = total_bytes
+        self._intervals += 1
+        if self.label is not None:
+            tracing.counter("下载速度(MB/s)", round(rate / 1024 / 1024, 3), track=self.label)
+        if self._intervals > self.warmup:
+            self.samples.append(rate)
+        return True
+
+    def confidence_interval(self):
+        """返回吞吐量的 (均值, 下限, 上限)，单位字节/秒"""
+        return mean_confidence_interval(self.samples)
+
+
+class LinkMeter:
+    """
+    汇总所有并发下载的字节数，按固定时间间隔采样本地链路的总吞吐量（字节/秒），记录最高值。
+    多个线程可以同时调用 add()。
+    """
+
+    def __init__(self, interval=0.25):
+        self.interval = interval
+        self.total = 0
+        self.peak = 0.0
+        self._interval_start = None
+        self._interval_bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, nbytes, now):
+        """记录新下载的字节数"""
+        with self._lock:
+            if self._interval_start is None:
+                self._interval_start = now
+                self._interval_bytes = self.total
+            self.total += nbytes
+            elapsed = now - self._interval_start
+            if elapsed >= self.interval:
+                rate = (self.total - self._interval_bytes) / elapsed
+                self.peak = max(self.peak, rate)
+                tracing.counter("链路吞吐量(MB/s)", round(rate / 1024 / 1024, 3), track="link")
+                self._interval_start = now
+                self._interval_bytes = self.total
+
+
+def is_settled(name, estimators, min_samples=4, precision=0.05, fail_rate=50 * 1024):
+    """
+    判断某个镜像源的吞吐量测试是否可以提前结束：
+    1. 置信区间已足够窄（相对半宽小于 precision）；
+    2. 置信区间与其他所有镜像源的区间都不重叠，排名已确定；
+    3. 吞吐量上限低于 fail_rate（字节/秒），明显失败。
+    """
+    own = estimators[name]
+    if len(own.samples) < min_samples:
+        return False
+    mean, low, high = own.confidence_interval()
+    if high < fail_rate:
+        return True
+    if mean > 0 and (high - low) / 2 / mean < precision:
+        return True
+    others = [e for n, e in estimators.items() if n != name]
+    if not others:
+        return False
+    for other in others:
+        if len(other.samples) < min_samples:
+            return False
+        _, other_low, other_high = other.confidence_interval()
+        if not (high < other_low or low > other_high):
+            return False
+    return True
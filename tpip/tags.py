@@ -0,0 +1,279 @@
+# tpip/tags.py
+# wheel 兼容性标签（PEP 425）的生成、匹配，以及按pip的规则选择下载文件
+
+import functools
+import glob
+import os
+import platform
+import re
+import sys
+
+from .versions import is_prerelease, parse_version, specifier_contains
+
+# 旧版manylinux标签与 manylinux_2_X 的对应关系
+_LEGACY_MANYLINUX = {(2, 17): "manylinux2014", (2, 12): "manylinux2010", (2, 5): "manylinux1"}
+
+_WHEEL_RE = re.compile(
+    r"^(?P<name>[^-]+)-(?P<version>[^-]+)(?:-(?P<build>\d[^-]*))?"
+    r"-(?P<py>[^-]+)-(?P<abi>[^-]+)-(?P<plat>[^-]+)\.whl$", re.IGNORECASE)
+_SDIST_EXTENSIONS = (".tar.gz", ".zip", ".tar.bz2", ".tar.xz", ".tgz", ".tar")
+
+
+def _normalize(arch):
+    return re.sub(r"[-. ]", "_", arch)
+
+
+def _glibc_version():
+    """返回glibc版本 (major, minor)，非glibc系统返回None"""
+    try:
+        version = os.confstr("CS_GNU_LIBC_VERSION")  # 形如 "glibc 2.31"
+        if version:
+            major, minor = version.split()[1].split(".")[:2]
+            return int(major), int(re.match(r"\d+", minor).group())
+    except (AttributeError, OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _musl_version():
+    """返回musl版本 (major, minor)，非musl系统返回None"""
+    if not glob.glob("/lib/ld-musl-*.so.1"):
+        return None
+    # 无法廉价地获取musl的精确版本，使用当前主流的 1.2
+    return 1, 2
+
+
+def _linux_platforms(arch):
+    if arch == "x86_64" and sys.maxsize <= 2 ** 32:
+        arch = "i686"  # 64位内核上的32位Python
+    platforms = []
+    glibc = _glibc_version()
+    if glibc and glibc[0] == 2:
+        # x86 架构从 manylinux1 (glibc 2.5) 开始，其余架构从 manylinux2014 (glibc 2.17) 开始
+        lowest = 5 if arch in ("x86_64", "i686") else 17
+        for minor in range(glibc[1], lowest - 1, -1):
+            platforms.append(f"manylinux_2_{minor}_{arch}")
+            legacy = _LEGACY_MANYLINUX.get((2, minor))
+            if legacy:
+                platforms.append(f"{legacy}_{arch}")
+    musl = _musl_version()
+    if musl:
+        for minor in range(musl[1], -1, -1):
+            platforms.append(f"musllinux_{musl[0]}_{minor}_{arch}")
+    platforms.append(f"linux_{arch}")
+    return platforms
+
+
+def _mac_binary_formats(version, arch):
+    formats = [arch]
+    if arch == "x86_64":
+        if version < (10, 4):
+            return []
+        formats.extend(["intel", "fat64", "fat32"])
+    if arch in ("arm64", "x86_64"):
+        formats.append("universal2")
+    if arch == "x86_64":
+        formats.append("universal")
+    return formats
+
+
+def _mac_platforms(arch):
+    release = platform.mac_ver()[0] or "10.16"
+    version = tuple(int(x) for x in (release.split(".") + ["0"])[:2])
+    arch = "arm64" if arch in ("arm64", "aarch64") else arch
+    platforms = []
+    if version < (11, 0):
+        for minor in range(version[1], -1, -1):
+            for fmt in _mac_binary_formats((10, minor), arch):
+                platforms.append(f"macosx_10_{minor}_{fmt}")
+        return platforms
+    for major in range(version[0], 10, -1):
+        for fmt in _mac_binary_formats((major, 0), arch):
+            platforms.append(f"macosx_{major}_0_{fmt}")
+    # macOS 11 的 x86_64 兼容旧版本的二进制包；arm64 从 11.0 开始支持，旧版本只有 universal2 包可用
+    for minor in range(16, 3, -1):
+        formats = _mac_binary_formats((10, minor), arch) if arch == "x86_64" else ["universal2"]
+        for fmt in formats:
+            platforms.append(f"macosx_10_{minor}_{fmt}")
+    return platforms
+
+
+def _windows_platforms(arch):
+    arch = arch.lower()
+    if arch in ("amd64", "x86_64"):
+        return ["win_amd64"] if sys.maxsize > 2 ** 32 else ["win32"]
+    if arch == "arm64":
+        return ["win_arm64"]
+    return ["win32"]
+
+
+def get_platform_tags():
+    """当前系统支持的平台标签，按优先级从高到低排列"""
+    arch = _normalize(platform.machine() or "x86_64")
+    if sys.platform.startswith("linux"):
+        return _linux_platforms(arch)
+    if sys.platform == "darwin":
+        return _mac_platforms(arch)
+    if sys.platform == "win32":
+        return _windows_platforms(arch)
+    return [_normalize(f"{sys.platform}_{arch}")]
+
+
+def _interpreter_abbr():
+    name = sys.implementation.name
+    return {"cpython": "cp", "pypy": "pp", "ironpython": "ip", "jython": "jy"}.get(name, name)
+
+
+def _cpython_abi(major, minor):
+    # Python 3.8 之前的ABI标签带有 pymalloc 的 "m" 后缀
+    debug = "d" if hasattr(sys, "gettotalrefcount") else ""
+    pymalloc = "m" if (major, minor) < (3, 8) else ""
+    return f"cp{major}{minor}{debug}{pymalloc}"
+
+
+def iter_supported_tags():
+    """按pip的优先级顺序产出当前解释器支持的全部 (python, abi, platform) 标签"""
+    major, minor = sys.version_info[:2]
+    interp = _interpreter_abbr()
+    platforms = get_platform_tags()
+    interpreter = f"{interp}{major}{minor}"
+
+    if interp == "cp":
+        abis = [_cpython_abi(major, minor)]
+        for abi in abis + ["abi3", "none"]:
+            for plat in platforms:
+                yield interpreter, abi, plat
+        # 旧版本CPython的稳定ABI
+        for older in range(minor - 1, 1, -1):
+            for plat in platforms:
+                yield f"cp{major}{older}", "abi3", plat
+    else:
+        abi = sys.implementation.cache_tag.replace("-", "_").replace(".", "_") if sys.implementation.cache_tag else "none"
+        for abi_tag in (abi, "none"):
+            for plat in platforms:
+                yield interpreter, abi_tag, plat
+
+    # 通用的纯Python标签
+    py_versions = [f"py{major}{minor}", f"py{major}"] + [f"py{major}{m}" for m in range(minor - 1, -1, -1)]
+    for version in py_versions:
+        for plat in platforms:
+            yield version, "none", plat
+    yield interpreter, "none", "any"
+    for version in py_versions:
+        yield version, "none", "any"
+
+
+@functools.lru_cache(maxsize=None)
+def get_tag_ranks():
+    """预先计算的 标签 -> 优先级 字典（数值越小越优先），用于O(1)查找"""
+    ranks = {}
+    for tag in iter_supported_tags():
+        ranks.setdefault("-".join(tag), len(ranks))
+    return ranks
+
+
+def parse_wheel_filename(filename):
+    """解析wheel文件名，返回 (名称, 版本, 构建号, 展开后的标签集合)，非法文件名返回None"""
+    match = _WHEEL_RE.match(filename)
+    if not match:
+        return None
+    tags = {f"{py}-{abi}-{plat}"
+            for py in match.group("py").split(".")
+            for abi in match.group("abi").split(".")
+            for plat in match.group("plat").split(".")}
+    build = match.group("build")
+    build_tag = ()
+    if build:
+        number = re.match(r"\d+", build)
+        build_tag = (int(number.group()), build[number.end():])
+    return match.group("name"), match.group("version"), build_tag, tags
+
+
+def wheel_tag_rank(filename):
+    """wheel文件在当前环境中的最优标签优先级，不兼容时返回None"""
+    parsed = parse_wheel_filename(filename)
+    if not parsed:
+        return None
+    ranks = get_tag_ranks()
+    matched = [ranks[tag] for tag in parsed[3] if tag in ranks]
+    return min(matched) if matched else None
+
+
+def _canonical_name(name):
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def sdist_version(filename, project=None):
+    """从源码包文件名中解析版本号"""
+    lower = filename.lower()
+    for ext in _SDIST_EXTENSIONS:
+        if lower.endswith(ext):
+            stem = filename[:-len(ext)]
+            break
+    else:
+        return None
+    if project:
+        # 项目名本身可能包含 "-"，按规范化后的项目名前缀切分
+        canonical = _canonical_name(project)
+        for i, char in enumerate(stem):
+            if char == "-" and _canonical_name(stem[:i]) == canonical:
+                return stem[i + 1:]
+    if "-" not in stem:
+        return None
+    return stem.rsplit("-", 1)[1]
+
+
+def file_version(filename, project=None):
+    """从wheel或源码包文件名中解析版本号"""
+    parsed = parse_wheel_filename(filename)
+    if parsed:
+        return parsed[1]
+    return sdist_version(filename, project)
+
+
+def python_version():
+    return ".".join(str(x) for x in sys.version_info[:3])
+
+
+def candidate_sort_key(package_file, project=None):
+    """
+    与pip的 CandidateEvaluator 相同的排序键：版本号越新越优先，
+    同一版本中标签优先级越高的wheel越优先，源码包排在所有兼容wheel之后。
+    不兼容的文件和版本号不符合 PEP 440 的文件（pip 同样跳过）返回None。
+    """
+    filename = package_file["filename"]
+    parsed = parse_wheel_filename(filename)
+    if parsed:
+        rank = wheel_tag_rank(filename)
+        key = parse_version(parsed[1])
+        if rank is None or key is None:
+            return None
+        return key, -rank, parsed[2]
+    version = sdist_version(filename, project)
+    key = parse_version(version) if version is not None else None
+    if key is None:
+        return None
+    return key, -len(get_tag_ranks()), ()
+
+
+def select_package_file(files, project=None):
+    """
+    按pip的规则从索引文件列表中选出会被安装的文件：
+    跳过已撤回（yanked）和 requires-python 不满足的文件，
+    存在正式版本时忽略预发布版本，然后选择排序键最大的文件。
+    """
+    current_python = python_version()
+    candidates = []
+    for package_file in files:
+        if package_file.get("yanked"):
+            continue
+        if not specifier_contains(package_file.get("requires_python"), current_python):
+            continue
+        key = candidate_sort_key(package_file, project)
+        if key is None:
+            continue
+        candidates.append((key, package_file))
+    if not candidates:
+        return None
+    finals = [c for c in candidates if not is_prerelease(file_version(c[1]["filename"], project) or "")]
+    return max(finals or candidates, key=lambda c: c[0])[1]
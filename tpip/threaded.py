@@ -0,0 +1,478 @@
+# tpip/threaded.py
+# 线程池测速引擎：没有aiohttp时使用，用 requests.Session 复用连接、线程池并发测试各镜像源，
+# 测速流程、提前结束规则和结果格式与异步引擎相同
+
+import contextlib
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+from . import tracing
+from .benchmark import (DOWNLOAD_HEADERS, INDEX_HEADERS, PROBE_READ_SIZE, SAMPLE_INTERVAL, MirrorResult,
+                        _add_chunk, _latency_stats, _multiplex_stats, _probe_stats, _quiet, _range_headers,
+                        _range_segments, _register_estimator, _response_file_size, add_error, fill_latency,
+                        latency_attrs, reuse_attrs, reuse_stats, stage_span)
+from .freshness import fetch_snapshot_sync
+from .index import iter_index_files_sync
+from .stats import LinkMeter, median
+
+
+def new_session(user_agent, pool_size=1):
+    """创建单个镜像源使用的 requests.Session，pool_size 为该镜像源的最大并发连接数"""
+    import requests
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, 1))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = user_agent
+    _count_connects(session, adapter)
+    return session
+
+
+def _count_connects(session, adapter):
+    """
+    让 adapter 的连接池每次建立连接（包括断开后重新建立）时累加 session.connects，用于连接复用测试。
+    urllib3 会重用已断开的连接对象，连接池自己的 num_connections 计数不包括重新建立的连接。
+    """
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    session.connects = 0
+    pool_classes = {}
+    for scheme, pool_cls in (("http", HTTPConnectionPool), ("https", HTTPSConnectionPool)):
+        class CountingConnection(pool_cls.ConnectionCls):
+            def connect(self):
+                session.connects += 1
+                return super().connect()
+
+        pool_classes[scheme] = type(pool_cls.__name__, (pool_cls,), {"ConnectionCls": CountingConnection})
+    adapter.poolmanager.pool_classes_by_scheme = pool_classes
+
+
+def _measure_connect(url, dns_cache=None):
+    """
+    单独测量DNS解析和TCP连接的耗时（毫秒），失败时返回 (None, None)。
+    dns_cache 为 {(主机, 端口): (地址族, 地址, 解析耗时)} 字典，多个镜像源位于同一主机时只解析一次。
+    """
+    parsed = urlparse(url)
+    port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    try:
+        cached = dns_cache.get((parsed.hostname, port)) if dns_cache is not None else None
+        if cached is None:
+            start = time.perf_counter()
+            infos = socket.getaddrinfo(parsed.hostname, port, type=socket.SOCK_STREAM)
+            cached = infos[0][0], infos[0][4], (time.perf_counter() - start) * 1000
+            if dns_cache is not None:
+                dns_cache[(parsed.hostname, port)] = cached
+        family, address, dns = cached
+        with socket.socket(family, socket.SOCK_STREAM) as sock:
+            sock.settimeout(5)
+            start = time.perf_counter()
+            sock.connect(address)
+            return dns, (time.perf_counter() - start) * 1000
+    except (OSError, IndexError):
+        return None, None
+
+
+def measure_latency(benchmark, session, name, url, samples=None, eliminate=False, host_limits=None):
+    """
+    MirrorBenchmark.measure_latency 的同步版本，返回 (名称, 延迟中位数ms, 地址, 详细统计)。
+    requests 不提供请求各阶段的时间点：首次请求包含建立连接的耗时，之后的请求复用连接，
+    其中位数作为首字节时间；DNS和TCP连接耗时另行测量，TLS握手耗时由首次请求多出的时间估算。
+    host_limits 为 {主机: 信号量}，限制同一主机的并发请求数。
+    """
+    import requests
+
+    if samples is None:
+        samples = benchmark.config.latency_samples
+    host_limit = (host_limits or {}).get(urlparse(url).netloc) or contextlib.nullcontext()
+    latencies = []
+    error = None
+    errors = 0
+    start_time = time.monotonic()
+    for i in range(samples):
+        cutoff = benchmark._latency_cutoff() if eliminate and i == 0 else None
+        try:
+            with host_limit:
+                start = time.perf_counter()
+                response = session.head(url, timeout=min(10, cutoff / 1000) if cutoff else 10)
+                elapsed = (time.perf_counter() - start) * 1000
+                response.close()
+        except Exception as e:
+            if cutoff and isinstance(e, requests.Timeout):
+                return benchmark._eliminated(name, url, cutoff)
+            error = e
+            errors += 1
+            continue
+        if not 200 <= response.status_code < 400:
+            error = f"HTTP {response.status_code}"
+            errors += 1
+            continue
+        latencies.append(elapsed)
+        if eliminate and len(latencies) == 1 and benchmark._check_first_latency(elapsed):
+            return benchmark._eliminated(name, url, benchmark._latency_cutoff())
+
+    if not latencies:
+        return benchmark._latency_failed(name, url, error)
+
+    ttfb = median(latencies[1:] or latencies)
+    dns, connect = _measure_connect(url, benchmark.dns_cache)
+    tls = None
+    if connect is not None and urlparse(url).scheme == "https":
+        tls = max(latencies[0] - ttfb - dns - connect, 0.0)
+
+    stats = _latency_stats(latencies, ttfb, dns, connect, tls, errors, start_time)
+    return name, stats["p50"], url, stats
+
+
+def fetch_package_file(benchmark, session, name, url, result=None):
+    """MirrorBenchmark.fetch_package_file 的同步版本，返回选中的文件信息字典，失败时返回None"""
+    package_name = benchmark.config.package
+    index_url = f"{url}/{package_name}/"
+    try:
+        index_stats = {}
+        start_time = time.monotonic()
+        with session.get(index_url, headers=INDEX_HEADERS, timeout=10, stream=True) as response:
+            if response.status_code != 200:
+                return benchmark._index_failed(name, result, "无法访问包信息页面",
+                                               f"索引页 HTTP {response.status_code}")
+            # 与异步引擎相同，解析完整的索引页后再按pip的规则选择文件
+            files = list(iter_index_files_sync(response, response.url, index_stats))
+        return benchmark._index_done(name, index_url, files, index_stats, start_time, result)
+    except Exception as e:
+        return benchmark._index_failed(name, result, str(e), f"获取包链接失败: {e}")
+
+
+def probe_file(session, url, probe_bytes, end_time=None, meter=None):
+    """benchmark.probe_file 的同步版本，session 为 requests.Session"""
+    headers = _range_headers({}, 0, probe_bytes - 1)
+    received = 0
+    start = time.perf_counter()
+    with session.get(url, headers=headers, timeout=15, stream=True) as response:
+        if response.status_code not in (200, 206):
+            raise RuntimeError(f"HTTP {response.status_code}")
+        length = response.headers.get("Content-Length", "")
+        size = _response_file_size(response.status_code, int(length) if length.isdigit() else None,
+                                   response.headers.get("Content-Range", ""))
+        first_byte = None
+        for chunk in response.iter_content(PROBE_READ_SIZE):
+            if first_byte is None:
+                first_byte = time.perf_counter()
+            received += len(chunk)
+            if meter is not None:
+                meter.add(len(chunk), time.monotonic())
+            if received >= probe_bytes or (end_time is not None and time.monotonic() >= end_time):
+                break
+    return _probe_stats(start, first_byte, time.perf_counter(), received, size)
+
+
+def test_reuse(benchmark, session, name, result):
+    """MirrorBenchmark.test_reuse 的同步版本，新建连接数由 new_session() 安装的连接计数得到"""
+    config = benchmark.config
+    headers = _range_headers({}, 0, config.reuse_bytes - 1)
+    file_url = result.artifact["url"]
+    durations, sizes, errors = [], [], 0
+    connects = session.connects
+    for _ in range(max(config.reuse_requests, 1)):
+        start = time.perf_counter()
+        received = 0
+        try:
+            with session.get(file_url, headers=headers, timeout=10, stream=True) as response:
+                if response.status_code not in (200, 206):
+                    errors += 1
+                    continue
+                # 206 响应完整读取，连接回到连接池；不支持Range请求的镜像源返回完整文件，读够字节数后断开
+                for chunk in response.iter_content(config.read_size):
+                    received += len(chunk)
+                    if response.status_code == 200 and received >= config.reuse_bytes:
+                        break
+        except Exception:
+            errors += 1
+            continue
+        durations.append((time.perf_counter() - start) * 1000)
+        sizes.append(received)
+    result.reuse = reuse_stats(durations, sizes, session.connects - connects, errors, benchmark._reuse_speed(result))
+    if benchmark._http2:
+        try:
+            result.reuse["http2"] = multiplex_test(file_url, config.reuse_bytes, config.reuse_requests,
+                                                   benchmark.user_agent)
+        except Exception as e:
+            result.reuse["http2"] = {"error": str(e) or type(e).__name__}
+
+
+def multiplex_test(url, nbytes, count, user_agent):
+    """benchmark.multiplex_test_async 的同步版本，并发请求由线程池发出，共享同一个 httpx.Client 的连接"""
+    import httpx
+
+    headers = _range_headers({"User-Agent": user_agent}, 0, nbytes - 1)
+    with httpx.Client(http2=True, timeout=10) as client:
+        with client.stream("GET", url, headers=headers) as response:
+            if response.status_code != 206:
+                return {"error": "不支持Range请求" if response.status_code == 200 else f"HTTP {response.status_code}"}
+            version = response.http_version
+            response.read()
+
+        def fetch(_):
+            try:
+                return client.get(url, headers=headers).status_code == 206
+            except Exception:
+                return False
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(count, 1)) as pool:
+            ok = list(pool.map(fetch, range(count)))
+        elapsed = time.perf_counter() - start
+    return _multiplex_stats(version, elapsed, count, ok.count(False))
+
+
+def _download_stream(session, name, package_url, headers, end_time, read_size, estimator, estimators,
+                     adaptive, log=_quiet, meter=None):
+    """
+    单连接下载测试，直到文件结束、到达 end_time 或排名已确定。
+    返回 (下载字节数, 是否提前结束, 文件大小, 是否支持Range请求)，无法下载时返回None。
+    """
+    total_size = 0
+    early_stopped = False
+    with session.get(package_url, headers=headers, timeout=30, stream=True) as response:
+        if response.status_code != 200:
+            log(f"下载测试失败: {name} - 无法下载包文件，状态码: {response.status_code}")
+            return None
+        estimator.start(time.monotonic())
+        try:
+            for chunk in response.iter_content(read_size):
+                total_size += len(chunk)
+                if _add_chunk(name, total_size, len(chunk), estimator, estimators, adaptive, meter):
+                    early_stopped = True
+                    break
+                if time.monotonic() >= end_time:
+                    break
+        except Exception as e:
+            log(f"下载过程中出错: {e}")
+        length = response.headers.get("Content-Length", "")
+        accept_ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+        return total_size, early_stopped, int(length) if length.isdigit() else None, accept_ranges
+
+
+def _download_ranges(session, name, package_url, headers, file_size, connections, end_time, read_size,
+                     estimator, estimators, adaptive, meter=None):
+    """
+    将文件按HTTP Range切分为 connections 段，用多个线程并发下载直到到达 end_time 或排名已确定。
+    返回 (下载字节数, 是否提前结束)，镜像源不支持Range请求时返回None。
+    """
+    progress = {"bytes": 0, "ranged": True}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def fetch_segment(first, last):
+        with session.get(package_url, headers=_range_headers(headers, first, last), timeout=30,
+                         stream=True) as response:
+            if response.status_code != 206:
+                progress["ranged"] = False
+                stop.set()
+                return
+            for chunk in response.iter_content(read_size):
+                if stop.is_set() or time.monotonic() >= end_time:
+                    break
+                with lock:
+                    progress["bytes"] += len(chunk)
+                    if _add_chunk(name, progress["bytes"], len(chunk), estimator, estimators, adaptive, meter):
+                        stop.set()
+
+    estimator.start(time.monotonic())
+    with ThreadPoolExecutor(max_workers=connections) as pool:
+        for future in [pool.submit(fetch_segment, first, last)
+                       for first, last in _range_segments(file_size, connections)]:
+            try:
+                future.result()
+            except Exception:
+                pass
+    if not progress["ranged"]:
+        return None
+    return progress["bytes"], stop.is_set()
+
+
+def test_download(benchmark, session, name, url, package_url, estimators=None, deadline=None,
+                  aggregate_estimators=None, result=None):
+    """MirrorBenchmark.test_download 的同步版本，返回 (名称, 速度MB/s, 地址, 详细信息)"""
+    config = benchmark.config
+    # 只在顺序模式下输出详细信息
+    detail = benchmark.log if config.sequential else _quiet
+    headers = dict(DOWNLOAD_HEADERS)
+    try:
+        start_time, end_time, single_end = benchmark._download_window(deadline)
+        if config.probe_bytes:
+            try:
+                probe = probe_file(session, package_url, config.probe_bytes, end_time, benchmark.link_meter)
+            except Exception as e:
+                probe = None
+                add_error(result, f"下载测试失败: {e}")
+            return benchmark._probe_done(name, url, probe, start_time, result)
+
+        detail(f"测试 {name} 下载 {config.package} 包的速度（限时{config.test_time}秒）...")
+        estimators = {} if estimators is None else estimators
+        estimator = _register_estimator(estimators, name, name)
+        try:
+            stream = _download_stream(session, name, package_url, headers, single_end, config.read_size,
+                                      estimator, estimators, config.adaptive, detail, benchmark.link_meter)
+        except Exception as e:
+            detail(f"下载测试失败: {name} - {e}")
+            add_error(result, f"下载测试失败: {e}")
+            return name, None, url, None
+        finally:
+            estimator.finished = True
+        details = benchmark._single_done(name, stream, estimator, start_time, detail, result)
+        if details is None:
+            return name, None, url, None
+
+        # 多连接Range并发下载测试
+        if benchmark._wants_ranges(name, stream, end_time, detail):
+            aggregate_estimators = {} if aggregate_estimators is None else aggregate_estimators
+            aggregate = _register_estimator(aggregate_estimators, name, f"{name} x{config.connections}")
+            aggregate_start = time.monotonic()
+            try:
+                ranged = _download_ranges(session, name, package_url, headers, stream[2], config.connections,
+                                          end_time, config.read_size, aggregate, aggregate_estimators,
+                                          config.adaptive, benchmark.link_meter)
+            except Exception as e:
+                ranged = None
+                add_error(result, f"多连接下载测试失败: {e}")
+                detail(f"多连接下载测试失败: {name} - {e}")
+            finally:
+                aggregate.finished = True
+            benchmark._aggregate_done(name, details, ranged, aggregate, aggregate_start, detail)
+        return benchmark._download_done(name, url, details, start_time, result)
+    except Exception as e:
+        return benchmark._download_failed(name, url, e, result)
+
+
+def _pipeline(benchmark, session, name, url, estimators, deadline, download_lock, aggregate_estimators, result):
+    """已通过延迟测试的镜像源的后续阶段：获取包链接 -> 下载测试"""
+    with stage_span("index", name, result):
+        package_file = fetch_package_file(benchmark, session, name, url, result)
+    if not package_file:
+        return None
+    if benchmark.config.probe_bytes:
+        # 与异步引擎相同，按字节预算测速在其他请求都结束后逐个进行
+        return None
+    with download_lock or contextlib.nullcontext():
+        with stage_span("download", name, result):
+            test_download(benchmark, session, name, url, package_file["url"], estimators, deadline,
+                          aggregate_estimators, result)
+    return result
+
+
+def _traced_latency(benchmark, session, name, url, host_limits):
+    with tracing.span("latency", track=name) as span:
+        latency_result = measure_latency(benchmark, session, name, url, eliminate=True, host_limits=host_limits)
+        span.set(**latency_attrs(latency_result))
+    return latency_result
+
+
+def check_freshness(benchmark, sessions, host_limits):
+    """用线程池并发获取各镜像源的同步延迟快照（优先使用缓存），返回 {名称: 同步状态}"""
+    config = benchmark.config
+    start_time = time.monotonic()
+    cached, pending = benchmark._freshness_pending()
+    if pending:
+        benchmark.log(f"正在检测 {len(config.mirrors)} 个镜像源的同步延迟...")
+
+    def fetch(name, url, package):
+        with host_limits[urlparse(url).netloc]:
+            return (url, package), fetch_snapshot_sync(sessions[name], url, package, benchmark.user_agent)
+
+    with ThreadPoolExecutor(max_workers=max(min(config.concurrency, len(pending)), 1)) as pool:
+        fetched = dict(pool.map(lambda item: fetch(*item), pending))
+    return benchmark._freshness_done(cached, fetched, start_time)
+
+
+def run_threaded(benchmark):
+    """
+    用线程池运行测速流程，返回 BenchmarkResult。
+    每个镜像源使用独立的 requests.Session，延迟测试、索引页和下载测试复用同一组连接；
+    延迟最低的 top_count 个镜像源进入后续阶段，放行的时机与异步引擎相同（见 MirrorBenchmark._admit）。
+    """
+    config = benchmark.config
+    start_time = time.monotonic()
+    results = {name: MirrorResult(name, url) for name, url in config.mirrors.items()}
+    sessions = {name: new_session(benchmark.user_agent, config.connections) for name in config.mirrors}
+    host_limits = {host: threading.BoundedSemaphore(max(config.per_host_limit, 1))
+                   for host in {urlparse(url).netloc for url in config.mirrors.values()}}
+    benchmark._first_latencies = []
+    benchmark.link_meter = LinkMeter(interval=SAMPLE_INTERVAL)
+
+    benchmark.log(f"正在使用线程池测试 {len(config.mirrors)} 个镜像源的延迟，请稍候...")
+    estimators = {}
+    aggregate_estimators = {}
+    deadline = None
+    download_lock = None
+    if config.download_test:
+        deadline = benchmark._start_downloads()
+        download_lock = threading.Lock() if config.sequential else None
+
+    try:
+        # 延迟测试和下载测试使用各自的线程池，下载测试不必排在大量延迟测试之后
+        with ThreadPoolExecutor(max_workers=max(min(config.concurrency, len(config.mirrors)), 1)) as latency_pool, \
+                ThreadPoolExecutor(max_workers=max(config.top_count, 1)) as pool:
+            latency_futures = [latency_pool.submit(tracing.bind(_traced_latency), benchmark, sessions[name], name, url,
+                                                   host_limits)
+                               for name, url in config.mirrors.items()]
+            pipeline_futures = []
+            admitted = []
+            latencies = {}
+
+            def admit(done):
+                for name in benchmark._admit(latencies, admitted, done):
+                    admitted.append(name)
+                    pipeline_futures.append(pool.submit(tracing.bind(_pipeline), benchmark, sessions[name], name,
+                                                        config.mirrors[name], estimators, deadline, download_lock,
+                                                        aggregate_estimators, results[name]))
+
+            for future in as_completed(latency_futures):
+                name, latency, url, _ = latency_result = future.result()
+                fill_latency(results[name], latency_result)
+                benchmark.emit("latency", results[name])
+                if config.download_test and latency is not None:
+                    latencies[name] = latency
+                    admit(done=False)
+            if config.download_test:
+                admit(done=True)
+            benchmark._latency_done(results, start_time)
+
+            for future in as_completed(pipeline_futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    benchmark.log(f"下载测试出错: {e}")
+                    continue
+                if result is not None:
+                    benchmark.emit("download", result)
+            if config.download_test and config.probe_bytes:
+                for name in admitted:
+                    if results[name].artifact:
+                        with stage_span("download", name, results[name], probe_bytes=config.probe_bytes):
+                            test_download(benchmark, sessions[name], name, results[name].url,
+                                          results[name].artifact["url"], deadline=deadline, result=results[name])
+                        benchmark.emit("download", results[name])
+            if config.download_test and config.reuse_requests:
+                names = benchmark._start_reuse(results, admitted)
+                reuse_start = time.monotonic()
+
+                def reuse(name):
+                    with tracing.span("reuse", track=name) as span:
+                        test_reuse(benchmark, sessions[name], name, results[name])
+                        span.set(**reuse_attrs(results[name]))
+
+                for future in [pool.submit(tracing.bind(reuse), name) for name in names]:
+                    future.result()
+                benchmark._reuse_done(results, names, reuse_start)
+        # 与异步引擎相同，在测速之后检测同步延迟
+        if config.freshness:
+            with tracing.span("freshness"):
+                benchmark._apply_freshness(results, check_freshness(benchmark, sessions, host_limits))
+    finally:
+        for session in sessions.values():
+            session.close()
+    return benchmark._finish(results, start_time)
+
@@ -1,23 +1,28 @@
-import subprocess
 import sys
 import argparse
 import time
 import asyncio
 from urllib.parse import urlparse
 import os
-import tempfile
-import re
-import random
-import platform
-import requests
 import json
-import shutil
-import configparser
-from pathlib import Path
-import aiohttp
-from prettytable import PrettyTable
+import importlib.util
+import contextlib
+import atexit
+# aiohttp、requests、prettytable 导入较慢，仅在需要时于函数内导入
 
-from .mirrors import MIRRORS
+from .mirrors import MIRRORS, load_registry, redact_url, select_mirrors
+from . import pip_config, tracing
+from .tags import file_version
+from .versions import INVALID_VERSION_KEY, version_key
+from .cache import DEFAULT_CACHE_TTL, get_network_identity, load_ranking, url_id
+from .benchmark import (DEFAULT_CONCURRENCY, DEFAULT_ELIMINATE_FACTOR, DEFAULT_LATENCY_SAMPLES,
+                        DEFAULT_PER_HOST_LIMIT, DEFAULT_READ_SIZE, DEFAULT_REUSE_BYTES, DEFAULT_REUSE_REQUESTS,
+                        DEFAULT_TEST_PACKAGE, TYPICAL_FILE_SIZE, BenchmarkConfig, MirrorBenchmark, compute_score,
+                        create_latency_trace_config, get_pip_like_user_agent)
+from .routing import DEFAULT_PACKAGE_JOBS, DEFAULT_PROBE_BYTES
+from .freshness import DEFAULT_LAG_HALF_LIFE, FRESHNESS_PACKAGES, format_lag
+from .fleet import DEFAULT_FLEET_PORT, DEFAULT_FLEET_WAIT, FLEET_ENV
+from .scoring import REQUESTS_PER_FILE, parse_workload
 # from mirrors import MIRRORS
 
 MIN_PYTHON_VERSION = (3, 6)
@@ -27,573 +32,804 @@ if sys.version_info < MIN_PYTHON_VERSION:
     sys.stderr.write(">\tpip install [package_name] -i https://pypi.tuna.tsinghua.edu.cn/simple \n")
     sys.exit(1)
 
-# 默认测试包
-DEFAULT_TEST_PACKAGE = "torch"  # 默认使用torch包，几乎所有镜像源都有
+# 监控模式下每次吞吐量探测下载的字节数
+MONITOR_PROBE_BYTES = 256 * 1024
 
-# 常用的大型包列表，用于测试下载速度
+# 常用的包列表，用于测试下载速度，也是 tpip route 默认探测的包
 POPULAR_PACKAGES = [
     "torch", "pandas", "matplotlib", "scikit-learn", "tensorflow",
     "numpy", "django", "flask", "requests", "pillow"
 ]
 
 def extract_version(url):
-    """提取URL中的版本号并转换为可比较的格式"""
-    # 提取版本号
-    version_match = re.search(r'[-_](\d+\.\d+\.\d+[^-_]*)', url)
-    if version_match:
-        version_str = version_match.group(1)
-        # 将版本号转换为元组以便比较
-        try:
-            # 处理像 '2.0.0' 这样的标准版本号
-            parts = version_str.split('.')
-            # 确保至少有三个部分
-            while len(parts) < 3:
-                parts.append('0')
-            # 处理像 '2.0.0rc1' 这样的后缀
-            last_part = parts[-1]
-            numeric_part = re.match(r'^\d+', last_part)
-            suffix_part = re.search(r'[a-zA-Z].*$', last_part)
-            
-            if numeric_part and suffix_part:
-                parts[-1] = numeric_part.group(0)
-                parts.append(suffix_part.group(0))
-            
-            # 转换为整数进行比较
-            version_tuple = []
-            for part in parts:
-                try:
-                    version_tuple.append(int(part))
-                except ValueError:
-                    # 非数字部分（如 'rc1'）放在最后，按字母顺序排序
-                    # 预发布版本（如rc, alpha, beta）应该排在正式版本之前
-                    if part.startswith(('a', 'alpha')):
-                        version_tuple.append(-3)  # alpha 最低
-                    elif part.startswith(('b', 'beta')):
-                        version_tuple.append(-2)  # beta 次之
-                    elif part.startswith(('rc', 'c')):
-                        version_tuple.append(-1)  # rc 接近正式版
-                    else:
-                        version_tuple.append(0)  # 正式版本
-                    version_tuple.append(part)
-            
-            return tuple(version_tuple)
-        except Exception:
-            # 如果解析失败，返回一个很小的值
-            return (-999,)
-    return (-999,)  # 没有找到版本号
-
-def sort_package_links(links):
-    """对包链接按版本号排序，最新版本在前"""
+    """提取URL中文件名的版本号，返回按PEP 440规则可比较的排序键"""
+    filename = urlparse(url).path.rsplit('/', 1)[-1] or url
+    version = file_version(filename)
+    return version_key(version) if version else INVALID_VERSION_KEY
+
+def sort_package_links(links, key=None):
+    """对包链接按版本号排序，最新版本在前；key 用于从链接对象中取出文件名"""
     if links and len(links) > 1:
-        links.sort(key=extract_version, reverse=True)
+        links.sort(key=lambda link: extract_version(key(link) if key else link), reverse=True)
         print(f"找到 {len(links)} 个包版本，选择最新版本")
     return links
 
-def get_system_info():
-    """获取系统信息，用于构建User-Agent"""
-    python_version = f"{sys.version_info.major}.{sys.version_info.minor}.{sys.version_info.micro}"
-    system = platform.system()
-    machine = platform.machine()
-    return f"Python/{python_version} ({system}; {machine})"
+def has_aiohttp():
+    """检查aiohttp是否可用"""
+    try:
+        import aiohttp  # noqa: F401
+        return True
+    except ImportError:
+        return False
 
-def get_pip_like_user_agent():
-    """构建类似pip的User-Agent"""
-    system_info = get_system_info()
-    return f"pip/{pip_version} {system_info}"
+def config_from_args(args):
+    """根据命令行参数构建测速配置"""
+    return BenchmarkConfig(
+        mirrors=dict(MIRRORS),
+        package=args.package or DEFAULT_TEST_PACKAGE,
+        download_test=not args.no_download_test,
+        top_count=args.top_count,
+        early_admit=not args.no_early_admit,
+        test_time=args.test_time,
+        sequential=args.sequential,
+        latency_samples=args.latency_samples,
+        connections=args.connections,
+        read_size=args.read_size,
+        time_budget=args.time_budget,
+        probe_bytes=args.probe_bytes,
+        reuse_requests=args.reuse_test or (DEFAULT_REUSE_REQUESTS if args.http2 else 0),
+        reuse_bytes=args.reuse_bytes,
+        http2=args.http2,
+        adaptive=not args.fixed_time,
+        use_cache=not args.refresh,
+        cache_ttl=args.cache_ttl,
+        concurrency=args.concurrency,
+        per_host_limit=args.per_host_limit,
+        eliminate_factor=args.eliminate_factor,
+        freshness=args.freshness,
+        freshness_packages=[p for p in args.freshness_packages.split(",") if p],
+        lag_half_life=args.lag_half_life,
+        fleet=args.fleet or None,
+        fleet_segment=args.fleet_segment,
+        fleet_wait=args.fleet_wait,
+        workload=args.workload,
+        user_agent=get_pip_like_user_agent(),
+    )
 
-# 获取pip版本
-def get_pip_version():
+def load_mirrors():
+    """加载镜像源注册表（内置、entry points、配置文件、TPIP_MIRRORS），返回按 --tag / --exclude-tag 筛选后的镜像源列表"""
     try:
-        result = subprocess.run(
-            [sys.executable, "-m", "pip", "--version"],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        # 输出格式类似: "pip 21.3.1 from /path/to/pip (python 3.9)"
-        version_str = result.stdout.split()[1]
-        return version_str
-    except Exception:
-        return "21.0.1"  # 默认版本
-
-# 获取pip版本
-pip_version = get_pip_version()
-
-async def measure_mirror_speed_async(session, name, url):
-    """异步测速函数"""
-    try:
-        start_time = time.time()
-        async with session.head(url, timeout=10) as response:
-            if 200 <= response.status < 400:
-                end_time = time.time()
-                return name, round((end_time - start_time) * 1000, 2), url
-            else:
-                print(f"异步测速失败: {name} ({url}) - HTTP {response.status}")
-                return name, None, url
-    except Exception as e:
-        print(f"异步测速失败: {name} ({url}) - {e}")
-        return name, None, url
+        registry, errors = load_registry()
+    except ValueError as e:
+        print(f"错误: {e}")
+        sys.exit(1)
+    for error in errors:
+        sys.stderr.write(f"警告: 加载镜像源失败: {error}\n")
+    tags = args.tag if hasattr(args, 'tag') else []
+    exclude_tags = args.exclude_tag if hasattr(args, 'exclude_tag') else []
+    selected = select_mirrors(registry, tags, exclude_tags)
+    if not selected:
+        print("错误: 没有符合条件的镜像源")
+        sys.exit(1)
+    return [m for m in registry if m.name in selected]
 
-async def test_download_speed_async(session, name, url, package_url=None):
-    """测试镜像源的实际下载速度（异步版本）"""
-    try:
-        # 使用用户指定的包或默认测试包
-        test_package = DEFAULT_TEST_PACKAGE
-        if hasattr(args, 'package') and args.package:
-            test_package = args.package
-        
-        # 获取测试时间
-        test_time = 5  # 默认值
-        if hasattr(args, 'test_time'):
-            test_time = args.test_time
-            
-        # 是否使用顺序测试模式
-        sequential_mode = False
-        if hasattr(args, 'sequential'):
-            sequential_mode = args.sequential
-            
-            # 构建类似pip的请求头
-            headers = {
-                "User-Agent": get_pip_like_user_agent(),
-                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-                "Accept-Language": "en-US,en;q=0.5",
-                "Accept-Encoding": "gzip, deflate, br",
-                "Connection": "keep-alive",
-                "Cache-Control": "max-age=0",
-                "Upgrade-Insecure-Requests": "1"
-            }
-            
-        if sequential_mode:
-            print(f"测试 {name} 下载 {test_package} 包的速度（限时{test_time}秒）...")
-            
-        # 如果已经提供了包链接，直接使用
-        if package_url:
-            # 开始下载测试
-            start_time = time.time()
-            total_size = 0
-            
-            try:
-                async with session.get(package_url, headers=headers, timeout=30) as response:
-                    if response.status != 200:
-                        if sequential_mode:  # 只在顺序模式下输出详细信息
-                            print(f"下载测试失败: {name} - 无法下载包文件，状态码: {response.status}")
-                        return name, None, url
-                    
-                    # 读取数据块并计算大小
-                    while True:
-                        if time.time() - start_time >= test_time:
-                            break
-                    
-                        try:
-                            chunk = await response.content.read(8192)
-                            if not chunk:
-                                break
-                            total_size += len(chunk)
-                        except Exception as e:
-                            if sequential_mode:  # 只在顺序模式下输出详细信息
-                                print(f"下载过程中出错: {e}")
-                            break
-            except asyncio.CancelledError:
-                if sequential_mode:  # 只在顺序模式下输出详细信息
-                    print(f"下载测试被取消: {name}")
-                raise
-            except Exception as e:
-                if sequential_mode:  # 只在顺序模式下输出详细信息
-                    print(f"下载测试失败: {name} - {e}")
-                return name, None, url
-            
-            # 计算下载时间和速度
-            download_time = time.time() - start_time
-            if download_time > test_time:
-                download_time = test_time  # 限制最大时间为测试时间
-            
-            if sequential_mode:  # 只在顺序模式下输出详细信息
-                print(f"下载完成: {round(download_time, 2)}秒内下载了 {round(total_size/1024/1024, 2)} MB")
-            
-            # 计算下载速度 (MB/s)
-            if download_time > 0 and total_size > 0:
-                speed = (total_size / 1024 / 1024) / download_time
-                # 确保速度不为0，最小显示0.01
-                if speed < 0.01:
-                    speed = 0.01
-                
-                if sequential_mode:  # 只在顺序模式下输出详细信息
-                    print(f"{name} 下载速度: {round(speed, 2)} MB/s ({test_time}秒内下载: {round(total_size/1024/1024, 2)} MB)")
-                return name, round(speed, 2), url
-            else:
-                if sequential_mode:  # 只在顺序模式下输出详细信息
-                    print(f"下载测试失败: {name} - 下载时间过短或文件大小为0")
-                return name, None, url
+def print_registry(registry):
+    """打印镜像源注册表，地址中的凭据会被隐藏"""
+    if machine_output():
+        json.dump([{"name": m.name, "url": redact_url(m.url), "tags": sorted(m.tags), "source": m.source}
+                   for m in registry], sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write("\n")
+        return
+    from prettytable import PrettyTable
+
+    table = PrettyTable()
+    table.field_names = ["镜像名称", "地址", "标签", "来源"]
+    table.align = "l"
+    for m in registry:
+        table.add_row([m.name, redact_url(m.url), ", ".join(sorted(m.tags)), m.source])
+    print(table)
+
+def print_benchmark_progress(event, data):
+    """命令行测速的进度回调：延迟测试完成后打印延迟表格，测速结束后打印下载速度表格"""
+    if event == "latency_done":
+        print_mirror_results([(m.name, m.latency_ms, m.url, m.latency) for m in data], "耗时 (ms)")
+    elif event == "done" and not data.from_cache:
+        final_results = [(m.name, m.latency_ms, m.speed, m.url, m.download, m.freshness, m.reuse, m.estimate)
+                         for m in data.mirrors if m.speed is not None or m.estimate]
+        if final_results:
+            print_final_results(final_results)
+
+def run_benchmark():
+    """按命令行参数测速，优先使用未过期的缓存测速结果，返回 BenchmarkResult，测速出错时返回None"""
+    benchmark = MirrorBenchmark(config_from_args(args), on_log=print, on_progress=print_benchmark_progress)
+    cached = benchmark.cached_result()
+    if cached is not None:
+        if cached.shared_by:
+            print(f"使用 {cached.shared_by} 在 {int(cached.cache_age_s)} 秒前共享的测速结果（使用 --refresh 重新测速）")
         else:
-            # 如果没有提供包链接，尝试使用pip命令下载
-            try:
-                return await _download_with_pip_async(session, name, url, test_package)
-            except Exception as e:
-                if sequential_mode:
-                    print(f"pip下载测试失败: {name} - {e}")
-                return name, None, url
-            
-    except KeyboardInterrupt:
-        print(f"下载测试被用户中断: {name}")
-        raise
-    except Exception as e:
-        print(f"下载测试失败: {name} ({url}) - {e}")
-        return name, None, url
+            print(f"使用 {int(cached.cache_age_s)} 秒前缓存的测速结果（使用 --refresh 重新测速）")
+        print_cached_results(cached)
+        return cached
 
-async def list_mirrors_async():
-    """改进的异步测速主函数"""
+    # 已安装aiohttp时使用异步引擎，否则使用线程池引擎
+    if sys.platform == 'win32':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
     try:
-        start_time = time.monotonic()
-        timeout = aiohttp.ClientTimeout(total=30)
-        connector = aiohttp.TCPConnector(limit=5)  # 限制并发连接数
-
-        async with aiohttp.ClientSession(timeout=timeout,
-                                         connector=connector) as session:
-            print("正在异步测试镜像源延迟，请稍候...")
-            tasks = [measure_mirror_speed_async(session, name, url)
-                     for name, url in MIRRORS.items()]
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-
-            # 过滤掉异常结果
-            valid_results = [r for r in results if isinstance(r, tuple) and r[1] is not None]
-            valid_results.sort(key=lambda x: x[1])
-            
-            print_mirror_results(valid_results, "耗时 (ms)")
-            print(f"异步延迟测试总耗时: {round((time.monotonic() - start_time) * 1000, 2)} ms")
-            
-            # 检查是否需要跳过下载测试
-            if hasattr(args, 'no_download_test') and args.no_download_test:
-                print("\n已跳过下载速度测试")
-                return valid_results[0][0] if valid_results else None
-            
-            # 选择延迟最低的几个镜像源进行下载速度测试
-            top_count = 3  # 默认值
-            if hasattr(args, 'top_count'):
-                top_count = args.top_count
-            top_count = min(top_count, len(valid_results))
-            top_mirrors = valid_results[:top_count]
-                
-            print(f"\n正在对延迟最低的{top_count}个镜像源进行下载速度测试...")
-            
-            # 获取并显示每个镜像源的包链接
-            package_links = {}  # 存储每个镜像源的包链接
-            for name, _, url in top_mirrors:
-                try:
-                    package_name = DEFAULT_TEST_PACKAGE
-                    if hasattr(args, 'package') and args.package:
-                        package_name = args.package
-                    package_url = f"{url}/{package_name}/"
-                    
-                    # 构建类似pip的请求头
-                    headers = {
-                        "User-Agent": get_pip_like_user_agent(),
-                        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-                        "Accept-Language": "en-US,en;q=0.5",
-                        "Accept-Encoding": "gzip, deflate, br",
-                        "Connection": "keep-alive",
-                        "Cache-Control": "max-age=0",
-                        "Upgrade-Insecure-Requests": "1"
-                    }
-                    
-                    # 获取包信息页面
-                    async with session.get(package_url, headers=headers, timeout=10) as response:
-                        if response.status != 200:
-                            print(f"{name} 的包链接获取失败: 无法访问包信息页面")
-                            continue
-                        html = await response.text()
-                    
-                    # 查找包文件链接
-                    py_version = f"cp{sys.version_info.major}{sys.version_info.minor}"
-                    platform_tag = "manylinux1_x86_64" if platform.system() == "Linux" else "win_amd64" if platform.system() == "Windows" else "macosx_10_15_x86_64"
-                    
-                    # 首先尝试找到适合当前系统的wheel包
-                    wheel_pattern = fr'href=[\'"]?([^\'" >]+{py_version}[^\'" >]*{platform_tag}[^\'" >]*\.whl)'
-                    whl_links = re.findall(wheel_pattern, html)
-                    
-                    # 如果没找到特定版本，尝试任何wheel包
-                    if not whl_links:
-                        whl_links = re.findall(r'href=[\'"]?([^\'" >]+\.whl)', html)
-                    
-                    # 对找到的包进行版本排序
-                    whl_links = sort_package_links(whl_links)
-                    
-                    if not whl_links:
-                        # 如果没有wheel包，尝试找任何包格式
-                        all_links = re.findall(r'href=[\'"]?([^\'" >]+\.(tar\.gz|zip|whl))', html)
-                        if all_links and len(all_links) > 0:
-                            # 检查all_links的结构
-                            if isinstance(all_links[0], tuple) and len(all_links[0]) > 0:
-                                whl_links = [all_links[0][0]]
-                            else:
-                                whl_links = [all_links[0]]
-                    
-                    if whl_links:
-                        package_file = whl_links[0]
-                        # 确保链接是完整的URL
-                        if package_file.startswith('http'):
-                            package_url = package_file
-                        else:
-                            # 处理相对路径
-                            if package_file.startswith('/'):
-                                base_url = url.split('//', 1)[0] + '//' + url.split('//', 1)[1].split('/', 1)[0]
-                                package_url = base_url + package_file
-                            else:
-                                package_url = f"{url}/{package_name}/{package_file}"
-                        print(f"{name} 的包链接: @{package_url}")
-                        package_links[name] = package_url
-                    else:
-                        print(f"{name} 的包链接获取失败: 未找到适合的包文件")
-                except Exception as e:
-                    print(f"{name} 的包链接获取失败: {str(e)}")
-            
-            print("\n开始进行下载速度测试...")
-            
-            # 下载速度测试
-            if hasattr(args, 'sequential') and args.sequential:
-                print("使用顺序测试模式...")
-                download_results = []
-                for name, _, url in top_mirrors:
-                    if name in package_links:
-                        # 使用已获取的包链接
-                        result = await test_download_speed_async(session, name, url, package_links.get(name))
-                        download_results.append(result)
-            else:
-                print("使用并行测试模式...")
-                download_tasks = []
-                for name, _, url in top_mirrors:
-                    if name in package_links:
-                        # 使用已获取的包链接
-                        task = asyncio.create_task(test_download_speed_async(session, name, url, package_links.get(name)))
-                        download_tasks.append(task)
-                
-                download_results = await asyncio.gather(*download_tasks, return_exceptions=True)
-                download_results = [r for r in download_results if isinstance(r, tuple)]
-            
-            # 过滤掉失败的结果
-            valid_download_results = [r for r in download_results if r[1] is not None]
-            
-            if not valid_download_results:
-                print("所有镜像源下载测试失败")
-                return valid_results[0][0] if valid_results else None
-            
-            # 按下载速度排序
-            valid_download_results.sort(key=lambda x: x[1] if x[1] is not None else 0, reverse=True)
-            
-            # 合并延迟和下载速度结果
-            final_results = []
-            for name, speed, url in valid_download_results:
-                # 查找对应的延迟结果
-                latency = next((r[1] for r in valid_results if r[0] == name), None)
-                final_results.append((name, latency, speed, url))
-            
-            # 打印最终结果
-            print_final_results(final_results)
-            
-            # 返回下载速度最快的镜像源
-            return valid_download_results[0][0]
+        with tracing.span("benchmark") as span:
+            span.set(engine="async" if has_aiohttp() else "threads")
+            return benchmark.run()
     except Exception as e:
         print(f"测试过程中出错: {e}")
         return None
 
-def measure_mirror_speed_sync(name, url):
-    """同步测速函数"""
+def find_best_mirror():
+    """查找速度最佳的镜像源，优先使用未过期的缓存测速结果"""
+    result = run_benchmark()
+    return result.best if result else None
+
+async def probe_mirror_once_async(benchmark, session, name, url, artifacts):
+    """
+    监控模式的低开销探测：一次HEAD请求测延迟，再用Range请求下载测试文件的前 MONITOR_PROBE_BYTES 字节测吞吐量。
+    artifacts 缓存各镜像源测试文件的地址，只在首次探测或下载失败后重新解析索引页。
+    返回 (延迟ms, 吞吐量MB/s, 错误信息)，延迟测试失败时延迟为None。
+    """
+    _, latency, _, stats = await benchmark.measure_latency(session, name, url, samples=1)
+    if latency is None:
+        return None, None, stats.get("error")
+    if name not in artifacts:
+        package_file = await benchmark.fetch_package_file(session, name, url)
+        if not package_file:
+            return latency, None, "未找到测试文件"
+        artifacts[name] = package_file["url"]
+
+    headers = {"User-Agent": benchmark.user_agent, "Range": f"bytes=0-{MONITOR_PROBE_BYTES - 1}"}
+    received = 0
+    start = time.perf_counter()
     try:
-        start_time = time.monotonic()
-        response = requests.head(url, timeout=10)
-        response.raise_for_status()
-        return name, round((time.monotonic() - start_time) * 1000, 2), url
-    except requests.RequestException as e:
-        print(f"同步测速失败: {name} ({url}) - {e}")
-        return name, None, url
-
-def test_download_speed_sync(name, url, package_url=None):
-    """测试镜像源的实际下载速度（同步版本）"""
+        async with session.get(artifacts[name], headers=headers, timeout=15) as response:
+            if response.status not in (200, 206):
+                artifacts.pop(name, None)
+                return latency, None, f"HTTP {response.status}"
+            async for chunk in response.content.iter_chunked(DEFAULT_READ_SIZE):
+                received += len(chunk)
+                if received >= MONITOR_PROBE_BYTES:
+                    break
+    except Exception as e:
+        artifacts.pop(name, None)
+        return latency, None, str(e)
+    elapsed = time.perf_counter() - start
+    return latency, round(received / elapsed / 1024 / 1024, 3) if elapsed > 0 else None, None
+
+async def run_monitor_async(policy, on_switch):
+    """监控模式主函数，使用一个长期复用连接的会话周期性探测所有镜像源"""
+    import aiohttp
+    from .monitor import monitor_loop
+
+    artifacts = {}
+    # 以pip配置中当前的镜像源作为切换的基准
     try:
-        # 使用用户指定的包或默认测试包
-        test_package = DEFAULT_TEST_PACKAGE
-        if hasattr(args, 'package') and args.package:
-            test_package = args.package
-        
-        # 获取测试时间
-        test_time = 5  # 默认值
-        if hasattr(args, 'test_time'):
-            test_time = args.test_time
-        
-        print(f"测试 {name} 下载 {test_package} 包的速度（限时{test_time}秒）...")
-        
-        # 构建类似pip的请求头
-        headers = {
-            "User-Agent": get_pip_like_user_agent(),
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-            "Accept-Language": "en-US,en;q=0.5",
-            "Accept-Encoding": "gzip, deflate, br",
-            "Connection": "keep-alive",
-            "Cache-Control": "max-age=0",
-            "Upgrade-Insecure-Requests": "1"
-        }
-        
-        # 如果已经提供了包链接，直接使用
-        if package_url:
-            # 开始下载测试
-            start_time = time.time()
-            total_size = 0
-            
-            try:
-                with requests.get(package_url, headers=headers, timeout=30, stream=True) as response:
-                    if response.status_code != 200:
-                        print(f"下载测试失败: {name} - 无法下载包文件，状态码: {response.status_code}")
-                        return name, None, url
-                    
-                    # 读取数据块并计算大小
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if time.time() - start_time >= test_time:
-                            break
-                        if chunk:
-                            total_size += len(chunk)
-            except Exception as e:
-                print(f"下载测试失败: {name} - {e}")
-                return name, None, url
-            
-            # 计算下载时间和速度
-            download_time = time.time() - start_time
-            if download_time > test_time:
-                download_time = test_time  # 限制最大时间为测试时间
-            
-            print(f"下载完成: {round(download_time, 2)}秒内下载了 {round(total_size/1024/1024, 2)} MB")
-            
-            # 计算下载速度 (MB/s)
-            if download_time > 0 and total_size > 0:
-                speed = (total_size / 1024 / 1024) / download_time
-                # 确保速度不为0，最小显示0.01
-                if speed < 0.01:
-                    speed = 0.01
-                
-                print(f"{name} 下载速度: {round(speed, 2)} MB/s ({test_time}秒内下载: {round(total_size/1024/1024, 2)} MB)")
-                return name, round(speed, 2), url
-            else:
-                print(f"下载测试失败: {name} - 下载时间过短或文件大小为0")
-                return name, None, url
-        else:
-            # 如果没有提供包链接，获取包信息页面
-            package_url = f"{url}/{test_package}/"
-            
-            # 这里应该有获取包链接的代码，但是在当前函数中缺少这部分代码
-            # 为了修复缩进错误，我们暂时返回一个错误结果
-            print(f"下载测试失败: {name} - 未提供包链接且无法自动获取")
-            return name, None, url
+        configured = (pip_config.get_index(args.scope) or "").rstrip("/")
+    except ValueError:
+        configured = ""
+    current = next((name for name, url in MIRRORS.items() if url.rstrip("/") == configured), None)
+    if configured and current is None and on_switch is not None:
+        # 自定义的镜像源（如公司内部源）不参与比较，不能被自动切换覆盖
+        print(f"当前pip配置的镜像源 {redact_url(configured)} 不在内置镜像源列表中，不自动切换")
+        on_switch = None
+    # 探测不输出日志，每轮只打印一行汇总
+    benchmark = MirrorBenchmark(BenchmarkConfig(package=args.package or DEFAULT_TEST_PACKAGE,
+                                                user_agent=get_pip_like_user_agent()))
+    connector = aiohttp.TCPConnector(limit=len(MIRRORS) * 2)
+    async with aiohttp.ClientSession(connector=connector, trace_configs=[create_latency_trace_config()],
+                                     headers={"User-Agent": benchmark.user_agent}) as session:
+        async def probe(name, url):
+            return await probe_mirror_once_async(benchmark, session, name, url, artifacts)
+
+        return await monitor_loop(dict(MIRRORS), probe, interval=args.interval, count=args.count,
+                                  alpha=args.alpha, policy=policy, on_switch=on_switch,
+                                  ring_size=args.ring_size, current=current)
+
+def print_monitor_summary(summary, window):
+    """打印监控时间序列的汇总结果"""
+    from prettytable import PrettyTable
+
+    if not summary:
+        print("没有监控数据，请先运行 tpip monitor")
+        return
+    table = PrettyTable()
+    table.title = f"最近 {window // 60} 分钟的监控统计"
+    table.field_names = ["镜像名称", "探测次数", "错误率", "延迟P50(ms)", "延迟P90(ms)", "吞吐量(MB/s)"]
+
+    def fmt(value, digits=2):
+        return f"{value:.{digits}f}" if value is not None else "-"
+
+    for name, s in sorted(summary.items(), key=lambda x: (x[1]["latency_p50"] is None, x[1]["latency_p50"] or 0)):
+        table.add_row([name, s["probes"], f"{s['error_rate'] * 100:.0f}%", fmt(s["latency_p50"]),
+                       fmt(s["latency_p90"]), fmt(s["throughput"], 3)])
+    print(table)
+
+def get_route_packages():
+    """tpip route 要探测的包：命令行中的包和需求文件中的包，都没有指定时使用 POPULAR_PACKAGES"""
+    from .routing import canonical_name, read_requirements
+
+    packages = list(args.packages)
+    for path in args.requirement:
+        try:
+            packages += read_requirements(path)
+        except OSError as e:
+            print(f"错误: 无法读取需求文件 {path}: {e}")
+            sys.exit(1)
+    if args.popular or not packages:
+        packages += POPULAR_PACKAGES
+    unique = {}
+    for package in packages:
+        unique.setdefault(canonical_name(package), package)
+    return list(unique.values())
+
+def print_route_progress(package, route):
+    if route["mirror"]:
+        print(f"{package}: {route['mirror']}（{route['version']}，预计 {route['estimate_ms']:.0f} ms）")
+    else:
+        errors = "; ".join(f"{m['name']}: {m['error']}" for m in route["mirrors"] if m["error"])
+        print(f"{package}: 没有可用的镜像源 - {errors}")
+
+def print_routes(table):
+    """打印按包路由表：每个包的最快镜像源、次快镜像源和版本落后的镜像源"""
+    from prettytable import PrettyTable
+
+    result = PrettyTable()
+    result.field_names = ["包名", "最快镜像源", "版本", "预计耗时(ms)", "次快镜像源", "版本落后的镜像源"]
+    result.align = "l"
+    for route in table["routes"].values():
+        usable = [m for m in route["mirrors"] if m["estimate_ms"] is not None]
+        runner_up = f"{usable[1]['name']} ({usable[1]['estimate_ms']:.0f})" if len(usable) > 1 else "-"
+        stale = ", ".join(f"{m['name']} ({m['version']})" for m in usable if m["stale"]) or "-"
+        estimate = f"{route['estimate_ms']:.0f}" if route["estimate_ms"] is not None else "-"
+        result.add_row([route["package"], route["mirror"] or "-", route["version"] or "-", estimate,
+                        runner_up, stale])
+    print(result)
+    counts = {}
+    for route in table["routes"].values():
+        if route["mirror"]:
+            counts[route["mirror"]] = counts.get(route["mirror"], 0) + 1
+    print("各镜像源最快的包数: " + ", ".join(f"{name} {count}" for name, count in
+                                      sorted(counts.items(), key=lambda x: -x[1])))
+
+def run_route():
+    """tpip route：生成按包路由表，保存到缓存目录供 tpip serve --routes 使用，并按 --format 输出"""
+    from .routing import build_routes_async, format_pip_commands, get_routes_path, save_routes
+
+    packages = get_route_packages()
+    config = BenchmarkConfig(mirrors=dict(MIRRORS), latency_samples=args.latency_samples,
+                             concurrency=args.concurrency, per_host_limit=args.per_host_limit,
+                             use_cache=False, user_agent=get_pip_like_user_agent())
+    print(f"探测 {len(packages)} 个包在 {len(MIRRORS)} 个镜像源上的索引页和下载速度"
+          f"（每个文件下载 {args.probe_bytes // 1024} KB）")
+    if sys.platform == 'win32':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    try:
+        table = asyncio.run(build_routes_async(config, packages, probe_bytes=args.probe_bytes, jobs=args.jobs,
+                                               max_mirrors=args.mirrors, on_package=print_route_progress))
     except Exception as e:
-        print(f"下载测试失败: {name} - {e}")
-        return name, None, url
+        print(f"生成路由表出错: {e}")
+        return None
+    try:
+        save_routes(table)
+        print(f"路由表已保存到 {get_routes_path()}（tpip serve --routes 会使用它）")
+    except OSError as e:
+        print(f"保存路由表失败: {e}")
+    if args.output and args.format != "pip":
+        save_routes(table, args.output)
+        print(f"路由表已导出到 {args.output}")
+    elif args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(format_pip_commands(table) + "\n")
+        print(f"pip命令已导出到 {args.output}")
+    return table
 
-def list_mirrors_sync():
-    """同步测速主函数"""
-    # ... existing code ...
+def get_upstream_mirrors(primary_name, primary_url, failover=True):
+    """
+    返回代理使用的上游镜像源列表：主镜像源在前，其余按最近一次测速保存的排名排列，
+    排名中没有的镜像源按 MIRRORS 中的顺序排在最后。failover 为False时只返回主镜像源。
+    """
+    # 排名中只保存了地址摘要，按摘要从 MIRRORS 取回完整地址（包括凭据），已不在 MIRRORS 中的镜像源被跳过
+    urls = {url_id(url): url for url in MIRRORS.values()}
+    ranking = [dict(m, url=urls[m.get("url_id")])
+               for m in load_ranking(get_network_identity()) or load_ranking() if m.get("url_id") in urls]
+    known = {m["url"] for m in ranking}
+    ranking += [{"name": name, "url": url} for name, url in MIRRORS.items() if url not in known]
+    primary_url = primary_url.rstrip("/")
+    primary = next((m for m in ranking if m["url"].rstrip("/") == primary_url),
+                   {"name": primary_name, "url": primary_url})
+    if not failover:
+        return [primary]
+    return [primary] + [m for m in ranking if m is not primary]
+
+# CSV 输出的列: (列名, 从测速记录中取值的函数)
+CSV_COLUMNS = [
+    ("rank", lambda r: r.get("rank")),
+    ("name", lambda r: r["name"]),
+    ("url", lambda r: r["url"]),
+    ("latency_ms", lambda r: r["latency_ms"]),
+    ("latency_p90_ms", lambda r: (r["latency"] or {}).get("p90")),
+    ("latency_min_ms", lambda r: (r["latency"] or {}).get("min")),
+    ("dns_ms", lambda r: (r["latency"] or {}).get("dns")),
+    ("connect_ms", lambda r: (r["latency"] or {}).get("connect")),
+    ("tls_ms", lambda r: (r["latency"] or {}).get("tls")),
+    ("ttfb_ms", lambda r: (r["latency"] or {}).get("ttfb")),
+    ("speed_mb_s", lambda r: (r["download"] or {}).get("speed")),
+    ("single_speed_mb_s", lambda r: (r["download"] or {}).get("single_speed")),
+    ("aggregate_speed_mb_s", lambda r: (r["download"] or {}).get("aggregate_speed")),
+    ("connections", lambda r: (r["download"] or {}).get("connections")),
+    ("download_bytes", lambda r: (r["download"] or {}).get("bytes")),
+    ("link_limited", lambda r: (r["download"] or {}).get("link_limited", False)),
+    ("request_overhead_ms", lambda r: (r["reuse"] or {}).get("overhead_ms")),
+    ("reuse_median_ms", lambda r: (r["reuse"] or {}).get("median_ms")),
+    ("new_connections", lambda r: (r["reuse"] or {}).get("new_connections")),
+    ("http_version", lambda r: ((r["reuse"] or {}).get("http2") or {}).get("http_version")),
+    ("multiplexed_ms", lambda r: ((r["reuse"] or {}).get("http2") or {}).get("multiplexed_ms")),
+    ("estimate_s", lambda r: (r["estimate"] or {}).get("total_s")),
+    ("estimate_source", lambda r: (r["estimate"] or {}).get("source")),
+    ("index_bytes", lambda r: (r["index"] or {}).get("bytes")),
+    ("lag_s", lambda r: (r["freshness"] or {}).get("lag_s")),
+    ("packages_behind", lambda r: (r["freshness"] or {}).get("behind")),
+    ("serial_lag", lambda r: (r["freshness"] or {}).get("serial_lag")),
+    ("freshness_factor", lambda r: (r["freshness"] or {}).get("factor")),
+    ("artifact_url", lambda r: (r["artifact"] or {}).get("url")),
+    ("errors", lambda r: "; ".join(r["errors"])),
+]
+
+def emit_report(report, output_format, stream=None):
+    """以 json 或 csv 格式输出测速报告"""
+    stream = stream or sys.stdout
+    if output_format == "json":
+        json.dump(report, stream, ensure_ascii=False, indent=2)
+        stream.write("\n")
+    elif output_format == "csv":
+        import csv
+
+        writer = csv.writer(stream)
+        writer.writerow([column for column, _ in CSV_COLUMNS])
+        for record in report.get("mirrors", []):
+            writer.writerow(["" if value is None else value for value in (get(record) for _, get in CSV_COLUMNS)])
+
+def machine_output():
+    """是否以 json / csv 格式输出（此时日志输出到stderr，不打印表格）"""
+    return hasattr(args, 'format') and args.format != "table"
+
+def print_cached_results(result):
+    """打印缓存中的测速结果"""
+    latency_results = sorted([(m.name, m.latency_ms, m.url, m.latency)
+                              for m in result.mirrors if m.latency_ms is not None],
+                             key=lambda x: x[1])
+    print_mirror_results(latency_results, "耗时 (ms)")
+    final_results = [(m.name, m.latency_ms, m.speed, m.url, m.download, m.freshness, m.reuse, m.estimate)
+                     for m in result.mirrors if m.speed is not None or m.estimate]
+    if final_results:
+        print_final_results(final_results)
 
 def print_mirror_results(results, header_text="测试结果"):
+    """打印延迟测试结果，results 中每项为 (名称, 延迟中位数, 地址[, 详细统计])"""
+    if machine_output():
+        return
+    from prettytable import PrettyTable
+
     print(f"\n{header_text}:")
     
     # 使用PrettyTable创建表格
     table = PrettyTable()
-    table.field_names = ["镜像名称", "耗时(ms)", "地址"]
+    detail_fields = [("p90", "P90"), ("min", "最小"), ("dns", "DNS"),
+                     ("connect", "连接"), ("tls", "TLS"), ("ttfb", "首字节")]
+    table.field_names = ["镜像名称", "耗时(ms)"] + [label for _, label in detail_fields] + ["地址"]
     
     # 设置列对齐方式
+    table.align = "r"
     table.align["镜像名称"] = "l"
-    table.align["耗时(ms)"] = "r"
     table.align["地址"] = "l"
     
+    def fmt(value):
+        return f"{value:.2f}" if value is not None else "-"
+
     # 添加数据行
-    for name, value, url in results:
+    for result in results:
+        name, value, url = result[:3]
+        stats = (result[3] if len(result) > 3 else None) or {}
+        details = [fmt(stats.get(key)) for key, _ in detail_fields]
         if value is not None:
-            table.add_row([name, f"{value:.2f}", url])
+            table.add_row([name, f"{value:.2f}"] + details + [redact_url(url)])
         else:
-            table.add_row([name, "未测试", url])
+            table.add_row([name, "未测试"] + details + [redact_url(url)])
 
     # 打印表格
     print(table)
+    print("耗时为多次请求的中位数（不含连接池排队时间）；DNS/连接/TLS为首次建立连接的耗时，TLS为估算值")
 
 def print_final_results(results):
+    """
+    打印最终结果，results 中每项为 (名称, 延迟, 速度, 地址[, 下载详细信息[, 同步状态[, 连接复用测试结果[, 预计安装耗时]]]])
+    """
+    if machine_output():
+        return
+    from prettytable import PrettyTable
+
+    # 多连接测试时额外显示单连接和聚合速度
+    details = [(r[4] if len(r) > 4 else None) or {} for r in results]
+    multi = any(d.get("connections", 1) > 1 for d in details)
+    # 检测了同步延迟时显示落后时间和折算后的得分
+    freshness = [r[5] if len(r) > 5 else None for r in results]
+    fresh = any(freshness)
+    # 测试了连接复用时显示每个请求的固定开销、新建连接数和HTTP/2多路复用结果
+    reuses = [r[6] if len(r) > 6 else None for r in results]
+    reuse = any(reuses)
+    http2 = any((r or {}).get("http2") for r in reuses)
+    # 设置了安装负载时显示预计耗时的分解
+    estimates = [r[7] if len(r) > 7 else None for r in results]
+    estimated = any(estimates)
+    link_limited = [d.get("effective_speed") for d in details if d.get("link_limited")]
+
     # 使用PrettyTable创建表格
     table = PrettyTable()
-    table.field_names = ["镜像名称", "耗时(ms)", "下载速度(MB/s)", "地址"]
+    table.field_names = (["镜像名称", "耗时(ms)", "下载速度(MB/s)"] + (["单连接(MB/s)", "聚合(MB/s)"] if multi else [])
+                         + (["同步延迟"] if fresh else [])
+                         + (["请求开销(ms)", "新建连接"] + (["HTTP/2"] if http2 else []) if reuse else [])
+                         + (["得分"] if fresh or reuse else [])
+                         + (["请求(s)", "传输(s)", "波动(s)", "重试(s)", "预计耗时(s)"] if estimated else []) + ["地址"])
     
     # 设置列对齐方式
+    table.align = "r"
     table.align["镜像名称"] = "l"
-    table.align["耗时(ms)"] = "r"
-    table.align["下载速度(MB/s)"] = "r"
     table.align["地址"] = "l"
     
     # 添加数据行
-    for name, latency, speed, url in results:
-        # 处理速度值
+    for (name, latency, speed, url, *_), detail, status, reuse_result, estimate in zip(results, details, freshness,
+                                                                                       reuses, estimates):
+        # 处理速度值，速度受本地链路限制的镜像源以*标记
         if speed is not None:
-            speed_str = f"{speed:.2f}"
+            speed_str = f"{speed:.2f}" + ("*" if detail.get("link_limited") else "")
         else:
             speed_str = "未测试"
+        latency_str = f"{latency:.2f}" if latency is not None else "-"
         
-        table.add_row([name, f"{latency:.2f}", speed_str, url])
+        row = [name, latency_str, speed_str]
+        if multi:
+            single, aggregate = detail.get("single_speed"), detail.get("aggregate_speed")
+            row += [f"{single:.2f}" if single is not None else "-",
+                    f"{aggregate:.2f}" if aggregate is not None else "-"]
+        if fresh:
+            row.append(format_lag(status))
+        if reuse:
+            reuse_result = reuse_result or {}
+            overhead, created = reuse_result.get("overhead_ms"), reuse_result.get("new_connections")
+            row += [f"{overhead:.1f}" if overhead is not None else "-",
+                    f"{created}/{reuse_result['requests']}" if created is not None else "-"]
+            if http2:
+                row.append(format_http2(reuse_result.get("http2")))
+        if fresh or reuse:
+            score = compute_score(dict(detail, speed=speed), status, reuse_result)
+            row.append(f"{score:.2f}" if score is not None else "-")
+        if estimated:
+            row += format_estimate(estimate)
+        table.add_row(row + [redact_url(url)])
     
     # 打印表格
     print(table)
+    if fresh or reuse:
+        adjustments = (["按同步延迟"] if fresh else []) + ([f"按每个请求的固定开销（以 {TYPICAL_FILE_SIZE // 1024} KB 的包文件计）"]
+                                                         if reuse else [])
+        print(f"得分为{'、'.join(adjustments)}折算后的下载速度" + ("" if estimated else "，排名按得分从高到低排列"))
+    if estimated:
+        workload = getattr(args, "workload", None)
+        print(f"预计耗时为按安装负载“{workload}”估计的耗时（P90），排名按预计耗时从低到高排列："
+              f"请求为每个文件{REQUESTS_PER_FILE}个请求的固定开销，传输为按单连接速度下载所有文件的时间，"
+              "波动为延迟和吞吐量波动的余量，重试为按失败率估计的重试耗时")
+        sources = {e["source"] for e in estimates if e and e["source"] != "measured"}
+        if sources:
+            labels = {"cache": "之前的测速结果", "monitor": "tpip monitor 的统计"}
+            print(f"† 未进行下载测试，按{'或'.join(labels[s] for s in sorted(sources))}中的下载速度估计")
+    if http2:
+        print("HTTP/2 列为在一个连接上同时发送相同请求时平均每个请求的耗时（pip 只使用HTTP/1.1，仅供参考）")
+    if link_limited:
+        print(f"* 下载速度达到本地链路容量（约 {link_limited[0]:.2f} MB/s），瓶颈在本机网络，这些镜像源按延迟排名")
+
+def format_estimate(estimate):
+    """预计安装耗时的分解，用于表格显示，速度不是本次测得的以†标记"""
+    if not estimate:
+        return ["-"] * 5
+    mark = "" if estimate["source"] == "measured" else "†"
+    return [f"{estimate[key]:.2f}" for key in ("request_s", "transfer_s", "variance_s", "retry_s")] + \
+        [f"{estimate['total_s']:.2f}{mark}"]
+
+def format_http2(result):
+    """HTTP/2 多路复用测试结果的简短描述，用于表格显示"""
+    if not result:
+        return "-"
+    if result.get("error"):
+        return "失败"
+    if result["http_version"] != "HTTP/2":
+        return f"不支持({result['http_version']})"
+    return f"{result['multiplexed_ms']:.1f} ms"
 
 def is_pip_installed():
-    """检查 pip 是否安装"""
-    try:
-        subprocess.run([sys.executable, '-m', 'pip', '--version'],
-                       check=True,
-                       stdout=subprocess.PIPE,
-                       stderr=subprocess.PIPE)
-        return True
-    except subprocess.CalledProcessError:
-        return False
+    """检查 pip 是否安装（只查找模块，不启动pip子进程）"""
+    return importlib.util.find_spec("pip") is not None
 
-def update_pip_config(mirror_url):
-    # 提取主机名
-    host = urlparse(mirror_url).netloc
+def update_pip_config(mirror_url, extra_index_urls=(), scope="auto"):
+    """直接写入pip配置文件，设置 index-url、trusted-host 及可选的 extra-index-url"""
     try:
-        subprocess.run([sys.executable, '-m', 'pip', 'config', 'set', 'global.index-url', mirror_url], check=True)
-        subprocess.run([sys.executable, '-m', 'pip', 'config', 'set', 'global.trusted-host', host], check=True)
-        print(f"成功设置 pip 镜像源为 '{mirror_url}'，并添加 trusted-host '{host}'")
-    except subprocess.CalledProcessError as e:
+        with tracing.span("pip_config_write", scope=scope):
+            config_file = pip_config.set_index(mirror_url, extra_index_urls, scope=scope)
+        hosts = ", ".join(dict.fromkeys(pip_config.trusted_host(u) for u in [mirror_url, *extra_index_urls]))
+        print(f"成功设置 pip 镜像源为 '{redact_url(mirror_url)}'，并添加 trusted-host '{hosts}'")
+        if extra_index_urls:
+            print(f"已添加 extra-index-url: {', '.join(redact_url(u) for u in extra_index_urls)}")
+        print(f"配置文件: {config_file}")
+    except (OSError, ValueError) as e:
         print(f"更新 pip 配置时出错: {e}, 详细报错如下：")
         raise e
 
-def unset_pip_mirror() -> None:
+def unset_pip_mirror(scope="auto") -> None:
     """取消pip镜像源设置"""
     try:
-        subprocess.run([sys.executable, '-m', 'pip', 'config', 'unset', 'global.index-url'], check=True)
-        subprocess.run([sys.executable, '-m', 'pip', 'config', 'unset', 'global.trusted-host'], check=True)
+        config_file = pip_config.unset_index(scope=scope)
         print("成功取消 pip 镜像源设置，已恢复为默认源")
-    except subprocess.CalledProcessError as e:
+        if config_file:
+            print(f"配置文件: {config_file}")
+    except (OSError, ValueError) as e:
         print(f"取消 pip 镜像源设置时出错: {e}, 详细报错如下：")
         raise e
 
+def resolve_mirror_url(value):
+    """将镜像源名称或地址解析为地址"""
+    if value in MIRRORS:
+        return MIRRORS[value]
+    if urlparse(value).scheme in ("http", "https"):
+        return value.rstrip("/")
+    print(f"错误: 未找到镜像源 '{value}'")
+    sys.exit(1)
+
+def add_benchmark_arguments(parser):
+    """为需要测速的子命令添加公共参数"""
+    parser.add_argument("--no-download-test", action="store_true", help="跳过下载速度测试")
+    parser.add_argument("--top-count", type=int, default=3, help="测试下载速度的镜像源数量")
+    parser.add_argument("--no-early-admit", action="store_true",
+                        help="等所有镜像源的延迟测试结束后再开始下载测试，只测试 --top-count 个镜像源"
+                             "（默认已知 --top-count 个延迟后立即开始，最多测试 2 × --top-count 个）")
+    parser.add_argument("--package", type=str, help="指定用于测试的包名")
+    parser.add_argument("--test-time", type=int, default=5, help="下载测试的时间限制（秒）")
+    parser.add_argument("--sequential", action="store_true", help="使用顺序测试模式")
+    parser.add_argument("--latency-samples", type=positive_int, default=DEFAULT_LATENCY_SAMPLES,
+                        help=f"每个镜像源的延迟测试请求次数，默认{DEFAULT_LATENCY_SAMPLES}")
+    parser.add_argument("--connections", type=int, default=1,
+                        help="多连接下载测试的并发连接数，大于1时用HTTP Range分段并发下载，同时报告单连接和聚合速度")
+    parser.add_argument("--read-size", type=int, default=DEFAULT_READ_SIZE,
+                        help=f"下载测试每次读取的字节数，默认{DEFAULT_READ_SIZE}")
+    parser.add_argument("--time-budget", type=float, help="所有下载测试的总时间预算（秒）")
+    parser.add_argument("--probe-bytes", type=int, metavar="BYTES",
+                        help="按字节预算测速：每个镜像源用Range请求只下载测试文件的前BYTES字节，按顺序逐个测试"
+                             "（仍受 --test-time 限制），适合按流量计费的网络，如 1048576")
+    parser.add_argument("--reuse-test", nargs="?", type=int, const=DEFAULT_REUSE_REQUESTS, default=0, metavar="N",
+                        help="连接复用测试：下载测试后在保持的连接上依次发送N个小文件请求（默认"
+                             f"{DEFAULT_REUSE_REQUESTS}个），测出每个请求的固定开销并计入排名，适合依赖较多的环境")
+    parser.add_argument("--reuse-bytes", type=int, default=DEFAULT_REUSE_BYTES,
+                        help=f"连接复用测试每个请求下载的字节数，默认{DEFAULT_REUSE_BYTES}")
+    parser.add_argument("--http2", action="store_true",
+                        help="同时测试HTTP/2多路复用（需要 pip install httpx[http2]，只报告，不影响排名），隐含 --reuse-test")
+    parser.add_argument("--workload", type=workload_argument, metavar="PROFILE",
+                        help="按安装负载估计各镜像源的安装耗时并据此排名，如 \"200 small wheels + 2 large\"、\"50x64KB\""
+                             "（small/medium/large 约为 256KB/4MB/100MB），未测试下载速度的镜像源按历史测速结果估计")
+    parser.add_argument("--fixed-time", action="store_true",
+                        help="关闭自适应提前结束，每个镜像源都下载满 --test-time 秒")
+    parser.add_argument("--format", choices=["table", "json", "csv"], default="table",
+                        help="测速结果的输出格式，json/csv 输出到stdout，日志输出到stderr")
+    parser.add_argument("--json", dest="format", action="store_const", const="json",
+                        help="以JSON格式输出测速结果，等同于 --format json")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"同时进行延迟测试的镜像源数量上限，默认{DEFAULT_CONCURRENCY}")
+    parser.add_argument("--per-host-limit", type=int, default=DEFAULT_PER_HOST_LIMIT,
+                        help=f"同一主机的并发连接数上限，默认{DEFAULT_PER_HOST_LIMIT}")
+    parser.add_argument("--eliminate-factor", type=float, default=DEFAULT_ELIMINATE_FACTOR,
+                        help="首次请求的延迟超过第 --top-count 快的镜像源的该倍数时淘汰该镜像源，"
+                             f"0表示不淘汰，默认{DEFAULT_ELIMINATE_FACTOR:g}")
+    parser.add_argument("--freshness", action="store_true",
+                        help="检测各镜像源的同步延迟（与PyPI官方源比较常更新的包的最新版本），并按落后时间折算排名得分")
+    parser.add_argument("--freshness-packages", default=",".join(FRESHNESS_PACKAGES), metavar="PKG[,PKG...]",
+                        help=f"用于检测同步延迟的包，以逗号分隔，默认{','.join(FRESHNESS_PACKAGES)}")
+    parser.add_argument("--lag-half-life", type=float, default=DEFAULT_LAG_HALF_LIFE,
+                        help=f"同步延迟达到该小时数时得分减半，默认{DEFAULT_LAG_HALF_LIFE:g}")
+    parser.add_argument("--refresh", action="store_true", help="忽略缓存，强制重新测速")
+    parser.add_argument("--cache-ttl", type=int, default=DEFAULT_CACHE_TTL,
+                        help=f"测速结果缓存的有效期（秒），0表示不使用缓存，默认{DEFAULT_CACHE_TTL}")
+    parser.add_argument("--fleet", default=os.environ.get(FLEET_ENV), metavar="PATH|URL",
+                        help="与同一网段的其他主机共享测速结果：共享文件系统上的文件路径，或 tpip fleet 服务的地址"
+                             f"（如 http://10.0.0.2:{DEFAULT_FLEET_PORT}），默认读取 {FLEET_ENV} 环境变量")
+    parser.add_argument("--fleet-segment", metavar="NAME",
+                        help="共享测速结果的网段标识，默认按默认网关和 /24 网段自动生成")
+    parser.add_argument("--fleet-wait", type=float, default=DEFAULT_FLEET_WAIT,
+                        help=f"其他主机正在测速时等待它共享结果的最长时间（秒），默认{DEFAULT_FLEET_WAIT}")
+
+def positive_int(value):
+    """必须大于0的整数参数的类型检查"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"必须大于0: {value}")
+    return number
+
+def workload_argument(value):
+    """--workload 参数的类型检查，格式错误时由 argparse 报错"""
+    try:
+        parse_workload(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+def add_mirror_arguments(parser):
+    """添加按标签筛选镜像源的参数"""
+    parser.add_argument("--tag", action="append", default=[], metavar="TAG",
+                        help="只使用带有该标签的镜像源（如 internal、region=cn-east、source=config），可多次指定")
+    parser.add_argument("--exclude-tag", action="append", default=[], metavar="TAG",
+                        help="排除带有该标签的镜像源，可多次指定")
+
+def start_tracing(start_ns):
+    """--trace / --profile：从 start_ns 开始记录本次命令各阶段的耗时，进程退出时写入跟踪文件或打印汇总"""
+    if not (args.trace or args.profile):
+        return
+    tracing.start(start_ns)
+    root = tracing.span(f"tpip {args.command}", track="main")
+    root.__enter__()
+    root.start = start_ns
+    atexit.register(finish_tracing, root)
+
+def finish_tracing(root):
+    """结束记录，写入跟踪文件并打印各阶段的耗时汇总（输出到stderr，不影响 json/csv 输出）"""
+    root.__exit__(None, None, None)
+    tracer = tracing.stop()
+    if args.trace:
+        try:
+            tracing.write(tracer, args.trace, args.trace_format)
+            viewer = "chrome://tracing 或 https://ui.perfetto.dev" if args.trace_format == "chrome" \
+                else "OpenTelemetry Collector 的 otlpjsonfile 接收器"
+            sys.stderr.write(f"性能跟踪已写入 {args.trace}（可用 {viewer} 打开）\n")
+        except OSError as e:
+            sys.stderr.write(f"写入性能跟踪失败: {e}\n")
+    if args.profile:
+        from prettytable import PrettyTable
+
+        table = PrettyTable()
+        table.field_names = ["阶段", "次数", "总耗时(ms)", "最长(ms)"]
+        table.align = "r"
+        table.align["阶段"] = "l"
+        for row in tracing.summarize(tracer):
+            table.add_row(row)
+        sys.stderr.write(f"\n各阶段耗时（并发阶段的总耗时可能超过运行时间）:\n{table}\n")
+
+def add_scope_argument(parser):
+    """添加pip配置作用域参数"""
+    parser.add_argument("--scope", choices=pip_config.SCOPES, default="auto",
+                        help="写入的pip配置文件作用域，默认与 `pip config set` 一致"
+                             "（虚拟环境中已有配置文件时为site，否则为user；设置了 PIP_CONFIG_FILE 时为该文件）")
+
 def main():
     """主函数，解析命令行参数并执行相应操作"""
-    global args
+    global args, MIRRORS
+    start_ns = time.perf_counter_ns()
 
     # 解析命令行参数
     parser = argparse.ArgumentParser(description="快速切换pip镜像源的工具")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="记录启动、测速各阶段、写入配置等的耗时区间和下载速度时间线，写入跟踪文件")
+    parser.add_argument("--trace-format", choices=tracing.TRACE_FORMATS, default="chrome",
+                        help="跟踪文件格式：chrome 为 Chrome trace-event JSON，otel 为 OpenTelemetry OTLP/JSON，默认chrome")
+    parser.add_argument("--profile", action="store_true", help="命令结束时在stderr打印各阶段的耗时汇总")
     subparsers = parser.add_subparsers(dest="command", help="子命令")
 
     # list 子命令
     list_parser = subparsers.add_parser("list", help="列出所有可用的镜像源")
-    list_parser.add_argument("--no-download-test", action="store_true", help="跳过下载速度测试")
-    list_parser.add_argument("--top-count", type=int, default=3, help="测试下载速度的镜像源数量")
-    list_parser.add_argument("--package", type=str, help="指定用于测试的包名")
-    list_parser.add_argument("--test-time", type=int, default=5, help="下载测试的时间限制（秒）")
-    list_parser.add_argument("--sequential", action="store_true", help="使用顺序测试模式")
+    add_mirror_arguments(list_parser)
+    add_benchmark_arguments(list_parser)
+
+    # mirrors 子命令
+    mirrors_parser = subparsers.add_parser("mirrors", help="显示镜像源注册表（地址、标签和来源），不进行测速")
+    add_mirror_arguments(mirrors_parser)
+    mirrors_parser.add_argument("--format", choices=["table", "json"], default="table", help="输出格式")
 
     # set 子命令
     set_parser = subparsers.add_parser("set", help="设置pip镜像源")
     set_parser.add_argument("mirror", nargs="?", help="镜像源名称")
-    set_parser.add_argument("--no-download-test", action="store_true", help="跳过下载速度测试")
-    set_parser.add_argument("--top-count", type=int, default=3, help="测试下载速度的镜像源数量")
-    set_parser.add_argument("--package", type=str, help="指定用于测试的包名")
-    set_parser.add_argument("--test-time", type=int, default=5, help="下载测试的时间限制（秒）")
-    set_parser.add_argument("--sequential", action="store_true", help="使用顺序测试模式")
+    set_parser.add_argument("--extra-index-url", action="append", default=[], metavar="MIRROR",
+                            help="额外的镜像源名称或地址，写入 extra-index-url，可多次指定")
+    add_scope_argument(set_parser)
+    add_mirror_arguments(set_parser)
+    add_benchmark_arguments(set_parser)
 
     # unset 子命令
-    subparsers.add_parser("unset", help="取消pip镜像源设置")
+    unset_parser = subparsers.add_parser("unset", help="取消pip镜像源设置")
+    add_scope_argument(unset_parser)
+
+    # serve 子命令
+    serve_parser = subparsers.add_parser("serve", help="启动带缓存的本地索引代理，转发到最快的镜像源")
+    serve_parser.add_argument("mirror", nargs="?", help="上游镜像源名称或地址，默认自动选择最快的镜像源")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="监听地址，默认127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=3141, help="监听端口，默认3141")
+    serve_parser.add_argument("--cache-dir", help="包文件和索引页的缓存目录，默认为tpip缓存目录下的proxy")
+    serve_parser.add_argument("--cache-size", type=int, default=10240, help="磁盘缓存容量（MB），超过后淘汰最久未使用的文件，默认10240")
+    serve_parser.add_argument("--index-ttl", type=int, default=600,
+                              help="索引页缓存的有效期（秒），过期后用ETag向上游验证，默认600")
+    serve_parser.add_argument("--no-failover", action="store_true", help="只使用一个上游镜像源，不做故障转移和对冲请求")
+    serve_parser.add_argument("--hedge-delay", type=float,
+                              help="上游超过该时间（毫秒）仍未响应时同时请求下一个镜像源，默认为延迟P90的3倍")
+    serve_parser.add_argument("--failure-threshold", type=int, default=3, help="镜像源连续失败多少次后熔断，默认3")
+    serve_parser.add_argument("--cooldown", type=float, default=30, help="镜像源熔断的时间（秒），默认30")
+    serve_parser.add_argument("--routes", nargs="?", const="", metavar="FILE",
+                              help="使用 tpip route 生成的按包路由表，路由表中的包优先从各自最快的镜像源获取，"
+                                   "不指定文件时使用最近一次 tpip route 保存的路由表")
+    add_mirror_arguments(serve_parser)
+    add_benchmark_arguments(serve_parser)
+
+    # install 子命令
+    install_parser = subparsers.add_parser("install", help="解析依赖后从多个最快的镜像源并发预下载，再用pip安装")
+    install_parser.add_argument("requirements", nargs="*", help="要安装的包（与pip install的写法相同）")
+    install_parser.add_argument("-r", "--requirement", action="append", default=[], metavar="FILE",
+                                help="从需求文件安装，可多次指定")
+    install_parser.add_argument("-c", "--constraint", action="append", default=[], metavar="FILE",
+                                help="约束文件，可多次指定")
+    install_parser.add_argument("--from-report", metavar="FILE",
+                                help="使用已有的 `pip install --report` 报告（锁定文件），跳过依赖解析")
+    install_parser.add_argument("--jobs", type=int, default=8, help="并发下载数，默认8")
+    install_parser.add_argument("--mirrors", type=int, default=3, help="分担下载的镜像源数量，默认3")
+    install_parser.add_argument("--download-dir", help="预下载目录，指定后可重复使用已下载的文件，默认为临时目录")
+    install_parser.add_argument("--pip-arg", action="append", default=[], metavar="ARG",
+                                help="额外传给pip的参数，如 --pip-arg=--upgrade，可多次指定")
+    add_mirror_arguments(install_parser)
+    add_benchmark_arguments(install_parser)
+
+    # route 子命令
+    route_parser = subparsers.add_parser("route", help="分别为每个包选出最快的镜像源，生成按包路由表")
+    route_parser.add_argument("packages", nargs="*", help="要探测的包名，默认使用常用包列表")
+    route_parser.add_argument("-r", "--requirement", action="append", default=[], metavar="FILE",
+                              help="探测需求文件中的包，可多次指定")
+    route_parser.add_argument("--popular", action="store_true", help="同时探测常用包列表中的包")
+    route_parser.add_argument("--probe-bytes", type=int, default=DEFAULT_PROBE_BYTES,
+                              help=f"每个包在每个镜像源上下载的字节数，较小的文件会被完整下载，默认{DEFAULT_PROBE_BYTES}")
+    route_parser.add_argument("--jobs", type=int, default=DEFAULT_PACKAGE_JOBS,
+                              help=f"同时探测的包数量，默认{DEFAULT_PACKAGE_JOBS}")
+    route_parser.add_argument("--mirrors", type=int, default=0,
+                              help="只探测延迟最低的N个镜像源，0表示探测所有可用的镜像源")
+    route_parser.add_argument("--latency-samples", type=positive_int, default=DEFAULT_LATENCY_SAMPLES,
+                              help=f"每个镜像源的延迟测试请求次数，默认{DEFAULT_LATENCY_SAMPLES}")
+    route_parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                              help=f"同时进行延迟测试的镜像源数量上限，默认{DEFAULT_CONCURRENCY}")
+    route_parser.add_argument("--per-host-limit", type=int, default=DEFAULT_PER_HOST_LIMIT,
+                              help=f"同一主机的并发连接数上限，默认{DEFAULT_PER_HOST_LIMIT}")
+    route_parser.add_argument("--format", choices=["table", "json", "pip"], default="table",
+                              help="输出格式：table为表格，json为完整路由表，pip为按镜像源分组的pip安装命令")
+    route_parser.add_argument("-o", "--output", metavar="FILE",
+                              help="将路由表（json/table）或pip命令（pip）写入文件")
+    add_mirror_arguments(route_parser)
+
+    # monitor 子命令
+    monitor_parser = subparsers.add_parser("monitor", help="周期性探测所有镜像源，维护滚动统计，可自动切换镜像源")
+    monitor_parser.add_argument("--interval", type=float, default=60, help="探测间隔（秒），默认60")
+    monitor_parser.add_argument("--count", type=int, default=0, help="探测轮数，0表示一直运行")
+    monitor_parser.add_argument("--alpha", type=float, default=0.3, help="EWMA平滑系数，越大越重视最近的结果，默认0.3")
+    monitor_parser.add_argument("--ring-size", type=int, default=10080,
+                                help="磁盘时间序列最多保存的探测记录数，写满后覆盖最旧的记录，默认10080")
+    monitor_parser.add_argument("--auto-set", action="store_true",
+                                help="有镜像源持续明显更快时自动更新pip配置")
+    monitor_parser.add_argument("--margin", type=float, default=0.2,
+                                help="自动切换要求新镜像源的得分比当前镜像源高出的比例，默认0.2")
+    monitor_parser.add_argument("--confirmations", type=int, default=3,
+                                help="自动切换要求新镜像源连续领先的轮数，默认3")
+    monitor_parser.add_argument("--show", action="store_true", help="只显示已记录的监控统计，不进行探测")
+    monitor_parser.add_argument("--window", type=int, default=3600, help="--show 汇总的时间范围（秒），默认3600")
+    monitor_parser.add_argument("--package", type=str, help="指定用于吞吐量探测的包名")
+    add_mirror_arguments(monitor_parser)
+    add_scope_argument(monitor_parser)
+
+    # fleet 子命令
+    fleet_parser = subparsers.add_parser("fleet", help="启动共享测速结果的HTTP服务，供同一网段的主机使用 --fleet URL")
+    fleet_parser.add_argument("--host", default="127.0.0.1", help="监听地址，默认127.0.0.1（供其他主机访问时使用0.0.0.0）")
+    fleet_parser.add_argument("--port", type=int, default=DEFAULT_FLEET_PORT, help=f"监听端口，默认{DEFAULT_FLEET_PORT}")
+    fleet_parser.add_argument("--store", metavar="FILE", help="保存共享测速结果的文件，默认为tpip缓存目录下的 fleet.json")
 
     args = parser.parse_args()
 
@@ -602,22 +838,30 @@ def main():
         parser.print_help()
         sys.exit(0)
 
+    start_tracing(start_ns)
+    # 需要镜像源列表的子命令加载完整的镜像源注册表
+    if args.command not in ("unset", "fleet"):
+        registry = load_mirrors()
+        MIRRORS = {m.name: m.url for m in registry}
+    tracing.record("startup", start_ns, time.perf_counter_ns())
+
     # 执行相应的子命令
-    if args.command == "list":
+    if args.command == "mirrors":
+        print_registry(registry)
+    elif args.command == "list":
         # 检查Python版本
         if sys.version_info < MIN_PYTHON_VERSION:
             print(f"错误: 需要Python {MIN_PYTHON_VERSION[0]}.{MIN_PYTHON_VERSION[1]}或更高版本")
             sys.exit(1)
 
-        # 使用异步或同步方式测试镜像源
-        if asyncio and 'aiohttp' in sys.modules:
-            # 使用异步方式测试
-            if sys.platform == 'win32':
-                asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-            best_mirror = asyncio.run(list_mirrors_async())
-        else:
-            # 使用同步方式测试
-            best_mirror = list_mirrors_sync()
+        if machine_output():
+            # 日志输出到stderr，stdout只输出结构化结果
+            with contextlib.redirect_stdout(sys.stderr):
+                result = run_benchmark()
+            emit_report(result.to_dict() if result else {}, args.format)
+            sys.exit(0)
+
+        best_mirror = find_best_mirror()
 
         # 返回最佳镜像源
         print(f"\n速度最佳的镜像源: {best_mirror}")
@@ -629,16 +873,13 @@ def main():
             sys.exit(1)
 
         # 如果没有指定镜像源，自动选择最快的镜像源
+        report = {} if machine_output() else None
         if not args.mirror:
-            # 使用异步或同步方式测试镜像源
-            if asyncio and 'aiohttp' in sys.modules:
-                # 使用异步方式测试
-                if sys.platform == 'win32':
-                    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-                best_mirror = asyncio.run(list_mirrors_async())
-            else:
-                # 使用同步方式测试
-                best_mirror = list_mirrors_sync()
+            with contextlib.redirect_stdout(sys.stderr) if report is not None else contextlib.nullcontext():
+                result = run_benchmark()
+            best_mirror = result.best if result else None
+            if report is not None and result:
+                report.update(result.to_dict())
 
             if not best_mirror:
                 print("错误: 无法连接到任何镜像源")
@@ -654,10 +895,136 @@ def main():
             sys.exit(1)
 
         mirror_url = MIRRORS[mirror_name]
-        update_pip_config(mirror_url)
+        extra_index_urls = [resolve_mirror_url(m) for m in args.extra_index_url]
+        if report is None:
+            update_pip_config(mirror_url, extra_index_urls, scope=args.scope)
+        else:
+            with contextlib.redirect_stdout(sys.stderr):
+                update_pip_config(mirror_url, extra_index_urls, scope=args.scope)
+            report["selected"] = mirror_name
+            emit_report(report, args.format)
     elif args.command == "unset":
-        unset_pip_mirror()
+        unset_pip_mirror(scope=args.scope)
         sys.exit(0)
+    elif args.command == "fleet":
+        from .fleet import make_server
+
+        server = make_server(args.store, args.host, args.port)
+        print(f"共享测速结果保存在: {server.store.path}")
+        print(f"其他主机使用: tpip list --fleet http://{args.host}:{args.port}（或设置 {FLEET_ENV} 环境变量）")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    elif args.command == "serve":
+        if not has_aiohttp():
+            print("错误: tpip serve 需要安装 aiohttp")
+            sys.exit(1)
+        from .proxy import serve
+        from .failover import CircuitBreaker
+
+        if args.mirror:
+            primary_name, primary_url = args.mirror, resolve_mirror_url(args.mirror)
+        else:
+            best_mirror = find_best_mirror()
+            if not best_mirror:
+                print("错误: 无法连接到任何镜像源")
+                sys.exit(1)
+            print(f"\n自动选择最佳的镜像源: {best_mirror}")
+            primary_name, primary_url = best_mirror, MIRRORS[best_mirror]
+        upstreams = get_upstream_mirrors(primary_name, primary_url, failover=not args.no_failover)
+        hedge_delay = args.hedge_delay / 1000 if args.hedge_delay is not None else None
+        routes = None
+        if args.routes is not None:
+            from .routing import load_routes
+
+            names = {u["name"] for u in upstreams}
+            routes = {package: name for package, name in load_routes(args.routes or None).items() if name in names}
+            if not routes:
+                print("警告: 路由表为空或其中的镜像源都不在上游列表中，请先运行 tpip route")
+        serve(upstreams, host=args.host, port=args.port, cache_dir=args.cache_dir,
+              cache_size=args.cache_size, index_ttl=args.index_ttl, user_agent=get_pip_like_user_agent(),
+              hedge_delay=hedge_delay, breaker=CircuitBreaker(args.failure_threshold, args.cooldown),
+              routes=routes)
+
+    elif args.command == "install":
+        if not is_pip_installed():
+            print("错误: 未找到pip，请先安装pip")
+            sys.exit(1)
+        if not has_aiohttp():
+            print("错误: tpip install 需要安装 aiohttp")
+            sys.exit(1)
+        if not (args.requirements or args.requirement or args.from_report):
+            print("错误: 请指定要安装的包、需求文件（-r）或报告文件（--from-report）")
+            sys.exit(1)
+        from .prefetch import build_requirement_args, install
+
+        best_mirror = find_best_mirror()
+        if not best_mirror:
+            print("错误: 无法连接到任何镜像源")
+            sys.exit(1)
+        mirrors = get_upstream_mirrors(best_mirror, MIRRORS[best_mirror])[:max(1, args.mirrors)]
+        requirement_args = build_requirement_args(args.requirements, args.requirement, args.constraint,
+                                                  args.pip_arg)
+        sys.exit(install(requirement_args, mirrors, jobs=args.jobs, download_dir=args.download_dir,
+                         from_report=args.from_report, user_agent=get_pip_like_user_agent()))
+
+    elif args.command == "route":
+        if not has_aiohttp():
+            print("错误: tpip route 需要安装 aiohttp")
+            sys.exit(1)
+        if args.format in ("json", "pip") and not args.output:
+            # 日志输出到stderr，stdout只输出路由表或pip命令
+            with contextlib.redirect_stdout(sys.stderr):
+                table = run_route()
+            if table is None:
+                sys.exit(1)
+            if args.format == "json":
+                json.dump(table, sys.stdout, ensure_ascii=False, indent=2)
+                sys.stdout.write("\n")
+            else:
+                from .routing import format_pip_commands
+                print(format_pip_commands(table))
+            sys.exit(0)
+        table = run_route()
+        if table is None:
+            sys.exit(1)
+        print_routes(table)
+
+    elif args.command == "monitor":
+        from .monitor import SwitchPolicy, load_summary
+
+        if args.show:
+            print_monitor_summary(load_summary(args.window), args.window)
+            sys.exit(0)
+        if not has_aiohttp():
+            print("错误: tpip monitor 需要安装 aiohttp")
+            sys.exit(1)
+
+        on_switch = None
+        if args.auto_set:
+            if not is_pip_installed():
+                print("错误: 未找到pip，请先安装pip")
+                sys.exit(1)
+
+            def on_switch(name):
+                try:
+                    update_pip_config(MIRRORS[name], scope=args.scope)
+                except (OSError, ValueError):
+                    # update_pip_config 已输出错误信息
+                    return False
+                return True
+
+        policy = SwitchPolicy(margin=args.margin, confirmations=args.confirmations)
+        if sys.platform == 'win32':
+            asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+        print(f"每 {args.interval:g} 秒探测一次 {len(MIRRORS)} 个镜像源（Ctrl+C 退出）")
+        try:
+            asyncio.run(run_monitor_async(policy, on_switch))
+        except KeyboardInterrupt:
+            pass
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,238 @@
+# tpip/tracing.py
+# 性能跟踪：记录命令各阶段的耗时区间（span）和下载吞吐量的时间线（counter），
+# 导出为 Chrome trace-event JSON（chrome://tracing、Perfetto）或 OpenTelemetry OTLP/JSON 文件。
+# 未启用时 span() 返回共享的空对象，counter() 直接返回，开销只有一次全局变量读取
+
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+
+TRACE_FORMATS = ("chrome", "otel")
+
+_tracer = None
+# 当前所在的 (span编号, 轨道名)，asyncio任务会复制创建时的上下文，子区间因此与父区间位于同一轨道
+_current = contextvars.ContextVar("tpip_trace_current", default=(None, None))
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """收集一次运行中的所有区间和计数器，线程安全"""
+
+    def __init__(self, start_ns=None):
+        now = time.perf_counter_ns()
+        self.start_ns = start_ns or now
+        self.wall_start_ns = time.time_ns() - (now - self.start_ns)
+        self.spans = []
+        self.counters = []
+        self._ids = 0
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        with self._lock:
+            self._ids += 1
+            return self._ids
+
+    def add_span(self, record):
+        with self._lock:
+            self.spans.append(record)
+
+    def add_counter(self, name, value, track):
+        with self._lock:
+            self.counters.append({"name": name, "track": track, "ts": time.perf_counter_ns(), "value": value})
+
+
+class _Span:
+    """一个耗时区间，作为上下文管理器使用，退出时记录结束时间；出现异常时记录在 error 属性中"""
+
+    def __init__(self, tracer, name, track, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.track = track
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        """补充区间的属性，如下载的字节数、解析的文件数"""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        parent, parent_track = _current.get()
+        self.id = self.tracer.next_id()
+        self.parent = parent
+        self.track = self.track or parent_track or threading.current_thread().name
+        self._token = _current.set((self.id, self.track))
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.attrs["error"] = f"{exc_type.__name__}: {exc}"
+        self.tracer.add_span({"id": self.id, "parent": self.parent, "name": self.name, "track": self.track,
+                              "start": self.start, "end": end, "attrs": self.attrs})
+        return False
+
+
+def enabled():
+    return _tracer is not None
+
+
+def start(start_ns=None):
+    """开始记录，返回 Tracer；start_ns 为记录的起点（time.perf_counter_ns()），可以早于调用时间"""
+    global _tracer
+    _tracer = Tracer(start_ns)
+    return _tracer
+
+
+def stop():
+    """停止记录，返回记录到的 Tracer，未启用时返回None"""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def span(name, track=None, **attrs):
+    """
+    记录一个耗时区间: with span("download", track=镜像源名称, url=...) as s: ...; s.set(bytes=...)。
+    track 为显示的轨道（Chrome trace 中的线程），默认继承父区间的轨道，没有父区间时为当前线程名。
+    """
+    if _tracer is None:
+        return _NULL_SPAN
+    return _Span(_tracer, name, track, attrs)
+
+
+def record(name, start_ns, end_ns, track=None, **attrs):
+    """记录一个已经结束的区间，用于开始记录之前的阶段（如命令行启动）"""
+    if _tracer is None:
+        return
+    parent, parent_track = _current.get()
+    _tracer.add_span({"id": _tracer.next_id(), "parent": parent, "name": name,
+                      "track": track or parent_track or threading.current_thread().name,
+                      "start": start_ns, "end": end_ns, "attrs": attrs})
+
+
+def counter(name, value, track=None):
+    """记录计数器的一个采样值（如吞吐量 MB/s），track 相同的采样构成一条时间线"""
+    if _tracer is None:
+        return
+    _tracer.add_counter(name, value, track or _current.get()[1] or threading.current_thread().name)
+
+
+def bind(func):
+    """返回在当前上下文的副本中运行 func 的函数，提交到线程池后区间仍以当前区间为父区间"""
+    return functools.partial(contextvars.copy_context().run, func)
+
+
+def to_chrome(tracer):
+    """转换为 Chrome trace-event JSON，时间单位为微秒，每个轨道对应一个线程"""
+    tracks = {}
+    events = [{"name": "process_name", "ph": "M", "pid": 1, "tid": 0, "args": {"name": "tpip"}}]
+
+    def tid(track):
+        if track not in tracks:
+            tracks[track] = len(tracks) + 1
+            events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tracks[track], "args": {"name": track}})
+        return tracks[track]
+
+    for record in sorted(tracer.spans, key=lambda r: r["start"]):
+        events.append({"name": record["name"], "cat": "tpip", "ph": "X", "pid": 1, "tid": tid(record["track"]),
+                       "ts": (record["start"] - tracer.start_ns) / 1000,
+                       "dur": (record["end"] - record["start"]) / 1000, "args": record["attrs"]})
+    for sample in tracer.counters:
+        events.append({"name": f"{sample['name']} {sample['track']}", "cat": "tpip", "ph": "C", "pid": 1,
+                       "ts": (sample["ts"] - tracer.start_ns) / 1000, "args": {sample["name"]: sample["value"]}})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def _otel_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otel_attributes(attrs):
+    return [{"key": key, "value": _otel_value(value)} for key, value in attrs.items() if value is not None]
+
+
+def to_otel(tracer):
+    """
+    转换为 OpenTelemetry OTLP/JSON 的 ExportTraceServiceRequest，可由 OpenTelemetry Collector 的 otlpjsonfile 接收器读取。
+    所有区间属于同一个 trace，轨道记录在 tpip.track 属性中；计数器采样作为其所属轨道的最外层区间的事件。
+    """
+    trace_id = os.urandom(16).hex()
+    span_ids = {record["id"]: os.urandom(8).hex() for record in tracer.spans}
+
+    def wall(ns):
+        return str(tracer.wall_start_ns + ns - tracer.start_ns)
+
+    roots = {}
+    for record in tracer.spans:
+        if record["parent"] is None or record["parent"] not in span_ids:
+            roots.setdefault(record["track"], record["id"])
+    events = {}
+    for sample in tracer.counters:
+        owner = roots.get(sample["track"]) or next(iter(roots.values()), None)
+        events.setdefault(owner, []).append({"timeUnixNano": wall(sample["ts"]), "name": sample["name"],
+                                             "attributes": _otel_attributes({"value": sample["value"]})})
+    spans = []
+    for record in tracer.spans:
+        item = {
+            "traceId": trace_id,
+            "spanId": span_ids[record["id"]],
+            "name": record["name"],
+            "kind": 1,
+            "startTimeUnixNano": wall(record["start"]),
+            "endTimeUnixNano": wall(record["end"]),
+            "attributes": _otel_attributes(dict(record["attrs"], **{"tpip.track": record["track"]})),
+            "status": {"code": 2, "message": record["attrs"]["error"]} if "error" in record["attrs"] else {},
+        }
+        if record["parent"] in span_ids:
+            item["parentSpanId"] = span_ids[record["parent"]]
+        if events.get(record["id"]):
+            item["events"] = events[record["id"]]
+        spans.append(item)
+
+    from . import __version__
+
+    return {"resourceSpans": [{
+        "resource": {"attributes": _otel_attributes({"service.name": "tpip", "service.version": __version__})},
+        "scopeSpans": [{"scope": {"name": "tpip", "version": __version__}, "spans": spans}],
+    }]}
+
+
+def write(tracer, path, trace_format="chrome"):
+    """将记录写入文件"""
+    data = to_otel(tracer) if trace_format == "otel" else to_chrome(tracer)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def summarize(tracer):
+    """按区间名称汇总耗时，返回按总耗时降序排列的 [(名称, 次数, 总耗时ms, 最长耗时ms)]"""
+    totals = {}
+    for record in tracer.spans:
+        duration = (record["end"] - record["start"]) / 1e6
+        count, total, longest = totals.get(record["name"], (0, 0.0, 0.0))
+        totals[record["name"]] = (count + 1, total + duration, max(longest, duration))
+    rows = [(name, count, round(total, 2), round(longest, 2)) for name, (count, total, longest) in totals.items()]
+    return sorted(rows, key=lambda row: -row[2])
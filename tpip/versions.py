@@ -0,0 +1,153 @@
+# tpip/versions.py
+# PEP 440 版本号解析、排序和 requires-python 版本约束判断
+
+import re
+
+# PEP 440 附录中的版本号正则表达式
+VERSION_PATTERN = r"""
+    v?
+    (?:
+        (?:(?P<epoch>[0-9]+)!)?
+        (?P<release>[0-9]+(?:\.[0-9]+)*)
+        (?P<pre>
+            [-_\.]?
+            (?P<pre_l>alpha|a|beta|b|preview|pre|c|rc)
+            [-_\.]?
+            (?P<pre_n>[0-9]+)?
+        )?
+        (?P<post>
+            (?:-(?P<post_n1>[0-9]+))
+            |
+            (?:
+                [-_\.]?
+                (?P<post_l>post|rev|r)
+                [-_\.]?
+                (?P<post_n2>[0-9]+)?
+            )
+        )?
+        (?P<dev>
+            [-_\.]?
+            (?P<dev_l>dev)
+            [-_\.]?
+            (?P<dev_n>[0-9]+)?
+        )?
+    )
+    (?:\+(?P<local>[a-z0-9]+(?:[-_\.][a-z0-9]+)*))?
+"""
+
+_VERSION_RE = re.compile(r"^\s*" + VERSION_PATTERN + r"\s*$", re.VERBOSE | re.IGNORECASE)
+_PRE_RANK = {"a": 0, "alpha": 0, "b": 1, "beta": 1, "c": 2, "rc": 2, "pre": 2, "preview": 2}
+
+# 无效版本号的排序键，与合法版本的排序键结构相同（epoch 为-1），可以与之比较，排在所有合法版本之前
+INVALID_VERSION_KEY = (-1, (), (0,), (0,), (0,), (0,))
+
+
+def parse_version(version):
+    """
+    将版本号解析为可比较的排序键，规则与 packaging.version.Version 一致，
+    无法解析时返回None。
+    """
+    match = _VERSION_RE.match(version)
+    if not match:
+        return None
+    release = tuple(int(x) for x in match.group("release").split("."))
+    # 比较时忽略末尾的0，1.0 == 1.0.0
+    trimmed = release
+    while len(trimmed) > 1 and trimmed[-1] == 0:
+        trimmed = trimmed[:-1]
+
+    # 每个字段编码为元组：(0,) 表示负无穷，(2,) 表示正无穷，(1, ...) 为实际值
+    if match.group("pre_l"):
+        pre = (1, _PRE_RANK[match.group("pre_l").lower()], int(match.group("pre_n") or 0))
+    elif match.group("dev_l") and not match.group("post"):
+        pre = (0,)  # 1.0.dev0 排在 1.0a0 之前
+    else:
+        pre = (2,)
+    if match.group("post"):
+        post = (1, int(match.group("post_n1") or match.group("post_n2") or 0))
+    else:
+        post = (0,)
+    if match.group("dev_l"):
+        dev = (1, int(match.group("dev_n") or 0))
+    else:
+        dev = (2,)
+    if match.group("local"):
+        parts = re.split(r"[-_.]", match.group("local").lower())
+        local = (1,) + tuple((1, int(p), "") if p.isdigit() else (0, 0, p) for p in parts)
+    else:
+        local = (0,)
+    return (int(match.group("epoch") or 0), trimmed, pre, post, dev, local)
+
+
+def version_key(version):
+    """版本号排序键，无效版本号排在最前"""
+    return parse_version(version) or INVALID_VERSION_KEY
+
+
+def release_tuple(version):
+    match = _VERSION_RE.match(version)
+    if not match:
+        return None
+    return tuple(int(x) for x in match.group("release").split("."))
+
+
+def is_prerelease(version):
+    """是否为预发布版本（包括开发版本）"""
+    match = _VERSION_RE.match(version)
+    return bool(match and (match.group("pre_l") or match.group("dev_l")))
+
+
+def _pad(release, length):
+    return release + (0,) * (length - len(release))
+
+
+def _prefix_match(version, prefix):
+    release = release_tuple(version)
+    prefix_release = release_tuple(prefix)
+    if release is None or prefix_release is None:
+        return False
+    return _pad(release, len(prefix_release))[:len(prefix_release)] == prefix_release
+
+
+def _check(op, spec, version):
+    if op == "===":
+        return version == spec
+    if op in ("==", "!=") and spec.endswith(".*"):
+        matched = _prefix_match(version, spec[:-2])
+        return matched if op == "==" else not matched
+    key, spec_key = parse_version(version), parse_version(spec)
+    if key is None or spec_key is None:
+        return False
+    if op == "==":
+        # 版本约束中没有本地版本号时忽略被比较版本的本地版本号
+        return key[:5] == spec_key[:5] if spec_key[5] == (0,) else key == spec_key
+    if op == "!=":
+        return not _check("==", spec, version)
+    if op == "~=":
+        release = release_tuple(spec)
+        return key >= spec_key and _prefix_match(version, ".".join(map(str, release[:-1])))
+    return {
+        "<": key < spec_key, "<=": key <= spec_key,
+        ">": key > spec_key, ">=": key >= spec_key,
+    }.get(op, False)
+
+
+_SPECIFIER_RE = re.compile(r"^\s*(~=|===|==|!=|<=|>=|<|>)\s*([^\s,]+)\s*$")
+
+
+def specifier_contains(specifiers, version):
+    """
+    判断版本号是否满足以逗号分隔的版本约束（如 requires-python 中的 ">=3.8,!=3.9.*"）。
+    约束无法解析时返回True，与pip忽略无效 requires-python 的行为一致。
+    """
+    if not specifiers or not specifiers.strip():
+        return True
+    for item in specifiers.split(","):
+        if not item.strip():
+            continue
+        match = _SPECIFIER_RE.match(item)
+        if not match:
+            return True
+        if not _check(match.group(1), match.group(2), version):
+            return False
+    return True